@@ -0,0 +1,491 @@
+
+'''
+
+Contraction Hierarchies (CH) for fast long distance routing.
+
+Preprocessing (offline) orders the nodes by importance and 'contracts'
+them one at a time, least important first.  When a node v is removed
+a shortcut u->w is added for every u->v->w that is the only shortest
+path between u and w.  A query is then a bidirectional Dijkstra that
+only ever moves to more important nodes, and settles a few hundred
+nodes even for London to Glasgow.
+
+The hierarchy is built from the same tile graphs that
+DataStore.GenericDataStore.loadEdgeGraphForTile creates, and every
+shortcut remembers the node it bypasses so that a route can be unpacked
+into the original GISEdges (for RoutingFacade._getJSONResultFromNodesList).
+
+Each arc of the hierarchy is a tuple
+
+    ( costHRS, lengthKM, tollKM, GISEdge or None, bypassed node or None )
+
+Classes/functions in this module are:
+
+- ContractionHierarchy      Build, save, load and query a hierarchy, and
+                            compute many-to-many tables
+
+- shortestPathCH            Routing engine for RoutingFacade
+
+- getContractionHierarchy   Access the hierarchy named by env TOLL_CH_FILE
+
+Build from the command line with:
+
+    python ContractionHierarchy.py <edgeFile|s3> <outFile> <tileID> [<tileID> ..]
+
+'''
+
+import heapq
+import os
+import cPickle
+
+from DataStructures import IndexedHeap
+from apperror import AppError
+import utils
+
+
+COST, KM, TOLL_KM, EDGE, VIA = range (5)
+
+
+class ContractionHierarchy (object):
+
+    '''
+    A contracted graph.
+
+    rank   { node: order of contraction }
+    up     { v: { w: arc v->w } }   for rank(w) > rank(v)
+    down   { v: { u: arc u->v } }   for rank(u) > rank(v)
+
+    The forward search of a query uses 'up', the backward search 'down'.
+
+    '''
+
+    # Number of nodes a witness search may settle before giving up.
+    # Giving up early only costs an unnecessary shortcut.
+    witnessLimit = 200
+
+    def __init__ (self):
+
+        self.rank = {}
+        self.up   = {}
+        self.down = {}
+
+    @classmethod
+    def build (cls, lstGraphs):
+
+        '''
+        @lstGraphs  list of graphs as loadEdgeGraphForTile (), e.g. one
+                    per tile.  Nodes shared by neighbouring tiles are joined.
+
+        Returns a ContractionHierarchy
+        '''
+
+        ch = cls ()
+
+        try:
+            ch._contract ( _arcsFromGraphs ( lstGraphs ) )
+        except Exception as e:
+            import traceback
+            utils.logError ( traceback.format_exc() )
+            raise AppError (utils.timestampStr (), 'ContractionHierarchy', 'build', e )
+
+        return ch
+
+    def _contract (self, out):
+
+        '''
+        @out  { v: { w: arc v->w } } - consumed by this method
+        '''
+
+        inc = {}
+        for v, arcs in out.iteritems ():
+            for w, arc in arcs.iteritems ():
+                inc.setdefault ( w, {} ) [v] = arc
+        for v in out.keys ():
+            inc.setdefault ( v, {} )
+        for v in inc.keys ():
+            out.setdefault ( v, {} )
+
+        deletedNeighbours = dict.fromkeys ( out, 0 )
+
+        def priority (v):
+            shortcuts = self._shortcutsFor ( v, out, inc )
+            return len (shortcuts) - len (out[v]) - len (inc[v]) + \
+                   deletedNeighbours [v]
+
+        heap = [ (priority (v), v) for v in out ]
+        heapq.heapify ( heap )
+
+        nextRank = 0
+
+        while heap:
+
+            p, v = heapq.heappop ( heap )
+
+            # lazy update: the priority may have gone up since it was queued
+            newP = priority ( v )
+            if heap and newP > heap[0][0]:
+                heapq.heappush ( heap, (newP, v) )
+                continue
+
+            for u, w, arc in self._shortcutsFor ( v, out, inc ):
+                if w not in out[u] or arc[COST] < out[u][w][COST]:
+                    out[u][w] = arc
+                    inc[w][u] = arc
+
+            self.rank [v] = nextRank
+            nextRank += 1
+
+            # everything still attached to v is more important than v
+            self.up   [v] = out.pop ( v )
+            self.down [v] = inc.pop ( v )
+
+            for w in self.up [v]:
+                del inc[w][v]
+                deletedNeighbours [w] += 1
+            for u in self.down [v]:
+                del out[u][v]
+                deletedNeighbours [u] += 1
+
+    def _shortcutsFor (self, v, out, inc):
+
+        '''
+        Return a list of (u, w, arc) shortcuts needed if v is contracted
+        '''
+
+        shortcuts = []
+
+        targets = out [v]
+        if not targets:
+            return shortcuts
+
+        for u, arcUV in inc[v].iteritems ():
+
+            maxCost = arcUV[COST] + max ( [a[COST] for a in targets.itervalues ()] )
+            D = self._witnessSearch ( u, v, maxCost, out )
+
+            for w, arcVW in targets.iteritems ():
+                if w == u:
+                    continue
+                viaCost = arcUV[COST] + arcVW[COST]
+                if D.get ( w, viaCost + 1 ) > viaCost:
+                    shortcuts.append ( (u, w, ( viaCost,
+                                                arcUV[KM] + arcVW[KM],
+                                                arcUV[TOLL_KM] + arcVW[TOLL_KM],
+                                                None, v ) ) )
+
+        return shortcuts
+
+    def _witnessSearch (self, source, excluded, maxCost, out):
+
+        '''
+        Dijkstra from source, avoiding node excluded, up to maxCost.
+        Returns { node: distance } of the settled nodes.
+        '''
+
+        D = {}
+        Q = IndexedHeap ()
+        Q [source] = 0.0
+
+        while Q and len (D) < self.witnessLimit:
+
+            x = Q.smallest ()
+            d = Q [x]
+            Q.pop_smallest ()
+            D [x] = d
+
+            if d > maxCost:
+                break
+
+            for y, arc in out[x].iteritems ():
+                if y == excluded or y in D:
+                    continue
+                dy = d + arc[COST]
+                if y not in Q or dy < Q[y]:
+                    Q[y] = dy
+
+        return D
+
+    def query (self, start, end, stats = None):
+
+        '''
+        Returns (cost, list of GISEdges from start to end)
+        '''
+
+        for node in (start, end):
+            if node not in self.rank:
+                raise AppError (utils.timestampStr (), 'ContractionHierarchy.query', \
+                                'Node %s is not in the hierarchy' %(node), None )
+
+        Df = {}
+        Db = {}
+        Pf = {}   # node -> (previous node, arc previous->node)
+        Pb = {}   # node -> (next node, arc node->next)
+
+        Qf = IndexedHeap ()
+        Qb = IndexedHeap ()
+        Qf [start] = 0.0
+        Qb [end]   = 0.0
+
+        best = float ('inf')
+        meet = None
+
+        while True:
+
+            minF = Qf [Qf.smallest ()] if Qf else best
+            minB = Qb [Qb.smallest ()] if Qb else best
+
+            if minF >= best and minB >= best:
+                break
+
+            if minF <= minB:
+                v = Qf.pop_smallest ()
+                Df [v] = minF
+                if v in Db and minF + Db[v] < best:
+                    best = minF + Db[v]
+                    meet = v
+                for w, arc in self.up[v].iteritems ():
+                    dw = minF + arc[COST]
+                    if w not in Df and ( w not in Qf or dw < Qf[w] ):
+                        Qf [w] = dw
+                        Pf [w] = ( v, arc )
+            else:
+                v = Qb.pop_smallest ()
+                Db [v] = minB
+                if v in Df and minB + Df[v] < best:
+                    best = minB + Df[v]
+                    meet = v
+                for u, arc in self.down[v].iteritems ():
+                    du = minB + arc[COST]
+                    if u not in Db and ( u not in Qb or du < Qb[u] ):
+                        Qb [u] = du
+                        Pb [u] = ( v, arc )
+
+        if stats is not None:
+            stats ['settled'] = len (Df) + len (Db)
+
+        if meet is None:
+            raise AppError (utils.timestampStr (), 'ContractionHierarchy.query', \
+                            'No route found from %s to %s' %(start, end), None )
+
+        arcs = []
+        node = meet
+        while node != start:
+            prev, arc = Pf [node]
+            arcs.append ( (prev, node, arc) )
+            node = prev
+        arcs.reverse ()
+
+        node = meet
+        while node != end:
+            nxt, arc = Pb [node]
+            arcs.append ( (node, nxt, arc) )
+            node = nxt
+
+        Path = []
+        for a, b, arc in arcs:
+            self._unpack ( a, b, arc, Path )
+
+        return best, Path
+
+    def manyToMany (self, sources, targets, stats = None):
+
+        '''
+        Bucket based many-to-many search.  One upward search back from 
+        each target leaves (target, distance) in a bucket at every node it 
+        settles; one upward search out from each source then scans the 
+        buckets of the nodes it settles.  Every pair meets at the top of
+        its shortest path, so the table costs len (sources) + len (targets)
+        small searches rather than one query per pair.
+
+        Returns a list (per source) of lists (per target) of 
+        (costHRS, lengthKM, tollKM), or None where there is no route.
+        '''
+
+        for node in list (sources) + list (targets):
+            if node not in self.rank:
+                raise AppError (utils.timestampStr (), 'ContractionHierarchy.manyToMany', \
+                                'Node %s is not in the hierarchy' %(node), None )
+
+        settled = 0
+
+        buckets = {}
+        for j, target in enumerate ( targets ):
+            space = self._upwardSearch ( target, self.down )
+            settled += len ( space )
+            for v, (cost, km, tollKM) in space.iteritems ():
+                buckets.setdefault ( v, [] ).append ( (j, cost, km, tollKM) )
+
+        table = []
+        for source in sources:
+            row = [None] * len ( targets )
+            space = self._upwardSearch ( source, self.up )
+            settled += len ( space )
+            for v, (cost, km, tollKM) in space.iteritems ():
+                for j, cost2, km2, tollKM2 in buckets.get ( v, () ):
+                    if row[j] is None or cost + cost2 < row[j][0]:
+                        row[j] = ( cost + cost2, km + km2, tollKM + tollKM2 )
+            table.append ( row )
+
+        if stats is not None:
+            stats ['settled'] = settled
+
+        return table
+
+    def _upwardSearch (self, source, arcs):
+
+        '''
+        Complete Dijkstra from source over arcs (self.up or self.down).
+        Returns { node: (costHRS, lengthKM, tollKM) } 
+        '''
+
+        D = {}
+        Q = IndexedHeap ()
+        Q [source] = 0.0
+        via = { source: (0.0, 0.0) }    # (lengthKM, tollKM) of path to node
+
+        while Q:
+            v = Q.smallest ()
+            cost = Q [v]
+            Q.pop_smallest ()
+            km, tollKM = via [v]
+            D [v] = ( cost, km, tollKM )
+
+            for w, arc in arcs[v].iteritems ():
+                dw = cost + arc[COST]
+                if w not in D and ( w not in Q or dw < Q[w] ):
+                    Q [w] = dw
+                    via [w] = ( km + arc[KM], tollKM + arc[TOLL_KM] )
+
+        return D
+
+    def _unpack (self, a, b, arc, Path):
+
+        '''
+        Append the original GISEdges of arc a->b to Path
+        '''
+
+        stack = [ (a, b, arc) ]
+
+        while stack:
+            a, b, arc = stack.pop ()
+            if arc[EDGE] is not None:
+                Path.append ( arc[EDGE] )
+            else:
+                mid = arc[VIA]
+                # a->mid and mid->b were both stored when mid was contracted.
+                # push the second half first so the first half is unpacked first
+                stack.append ( (mid, b, self.up  [mid][b]) )
+                stack.append ( (a, mid, self.down[mid][a]) )
+
+    def save (self, filePath):
+
+        try:
+            fs = open ( filePath, 'wb' )
+            cPickle.dump ( (self.rank, self.up, self.down), fs, cPickle.HIGHEST_PROTOCOL )
+            fs.close ()
+        except IOError as e:
+            import traceback
+            utils.logError ( traceback.format_exc() )
+            raise AppError (utils.timestampStr (), 'ContractionHierarchy', 'save %s' %(filePath), e )
+
+    @classmethod
+    def load (cls, filePath):
+
+        ch = cls ()
+
+        try:
+            fs = open ( filePath, 'rb' )
+            ch.rank, ch.up, ch.down = cPickle.load ( fs )
+            fs.close ()
+        except (IOError, cPickle.UnpicklingError) as e:
+            import traceback
+            utils.logError ( traceback.format_exc() )
+            raise AppError (utils.timestampStr (), 'ContractionHierarchy', 'load %s' %(filePath), e )
+
+        return ch
+
+
+def _arcsFromGraphs (lstGraphs):
+
+    '''
+    Join a list of tile graphs into { v: { w: arc v->w } }
+    '''
+
+    out = {}
+
+    for graph in lstGraphs:
+        for v, neighbours in graph.iteritems ():
+            arcs = out.setdefault ( v, {} )
+            for w, edge in neighbours.iteritems ():
+                if w == v:
+                    continue
+                cost = edge.getCost ()
+                if w in arcs and arcs[w][COST] <= cost:
+                    continue
+                tollKM = 0.0
+                if edge.isToll:
+                    tollKM = edge.lengthKM
+                arcs [w] = ( cost, edge.lengthKM, tollKM, edge, None )
+
+    return out
+
+
+aContractionHierarchy = None
+
+def getContractionHierarchy ():
+
+    '''
+    Load (once) the hierarchy saved in the file named by env TOLL_CH_FILE
+    '''
+
+    global aContractionHierarchy
+
+    if aContractionHierarchy is None:
+
+        if 'TOLL_CH_FILE' not in os.environ:
+            raise AppError (utils.timestampStr (), 'ContractionHierarchy', \
+                            'TOLL_CH_FILE not set', None )
+
+        aContractionHierarchy = ContractionHierarchy.load ( os.environ ['TOLL_CH_FILE'] )
+
+    return aContractionHierarchy
+
+
+def shortestPathCH (G, start, end, stats = None):
+
+    '''
+    Routing engine with the signature of algorithms.shortestPath2.  G is
+    not used: the whole network is in the hierarchy.
+    '''
+
+    cost, Path = getContractionHierarchy ().query ( start, end, stats )
+
+    return Path
+
+
+if __name__ == "__main__":
+
+    import sys
+    from gis import Locator
+    from DataStore import FileDataStore, AWS_S3DataStore
+
+    if len ( sys.argv ) < 4:
+        print "usage: python ContractionHierarchy.py <edgeFile|s3> <outFile> <tileID> [<tileID> ..]"
+        sys.exit (1)
+
+    if sys.argv[1] == 's3':
+        dataStore = AWS_S3DataStore ()
+    else:
+        dataStore = FileDataStore ( sys.argv[1] )
+
+    lstGraphs = []
+    for tileID in sys.argv[3:]:
+        print "loading tile %s" %(tileID)
+        lstGraphs.append ( dataStore.loadEdgeGraphForTile ( Locator.getTileFromID ( tileID ) ) )
+
+    print "contracting"
+    ch = ContractionHierarchy.build ( lstGraphs )
+
+    print "%s nodes, %s arcs" %( len (ch.rank),
+                                 sum ( [len (a) for a in ch.up.itervalues ()] ) )
+    ch.save ( sys.argv[2] )
@@ -20,18 +20,111 @@ Classes in this module are:
 
 - FileDataStore
 
+- CompiledDataStore         Abstract.  Loads tiles compiled by TileCompiler
+                            with one read each
+
+- CompiledFileDataStore     Compiled tiles in a directory
+
+- AWS_S3CompiledDataStore   Compiled tiles in S3
+
+- DiskTileCache             Size bounded directory of tile files, checked
+                            against their source's versions
+
+- CachingDataStore          Read-through disk cache in front of any
+                            DataStore (see makeCachingDataStore)
+
+- CachingCompiledDataStore  The same for a CompiledDataStore
+
 '''
 
-from DataStructures import GISEdge
+from DataStructures import GISEdge, CSRGraph, CompactEdge, GeometryBlob, MappedGeometry
+from DataStructures import SharedCSRGraph
 from gis import Tile 
 
 from apperror import AppError
+import csv
+import itertools
 import os
+import struct
+import tempfile
+import zlib
 
 from boto.s3.key import Key
 from boto.exception import AWSConnectionError
 from boto.s3.connection import S3Connection
 
+# Directory of the memory mapped tile geometry files (loadMappedGraphForTile)
+GEOMETRY_DIR = os.environ.get ( 'TOLL_GEOMETRY_DIR', 
+                                os.path.join ( tempfile.gettempdir (), 'm6toll-geometry' ) )
+
+# Directory, size and revalidation interval of the disk cache of tiles 
+# fetched from S3 (see CachingDataStore)
+TILE_CACHE_DIR = os.environ.get ( 'TOLL_TILE_CACHE_DIR',
+                                  os.path.join ( tempfile.gettempdir (), 'm6toll-tiles' ) )
+
+TILE_CACHE_BYTES = int ( float ( os.environ.get ( 'TOLL_TILE_CACHE_MB', '1024' ) ) * 1024 * 1024 )
+
+TILE_CACHE_REVALIDATE_SECS = float ( os.environ.get ( 'TOLL_TILE_CACHE_REVALIDATE', '300' ) )
+
+# Directory of the memory mapped tile graph files (loadSharedGraphForTile).
+# Remove its files when the tiles change.
+SHARED_GRAPH_DIR = os.environ.get ( 'TOLL_SHARED_GRAPH_DIR', 
+                                    os.path.join ( tempfile.gettempdir (), 'm6toll-graphs' ) )
+
+
+def _makeDirs ( dirPath ):
+
+    if not os.path.isdir ( dirPath ):
+        try:
+            os.makedirs ( dirPath )
+        except OSError:
+            # made by another process
+            pass
+
+
+def _splitRows ( lines ):
+
+    '''
+    The '|' delimited lines (any iterable of strings, e.g. a file) split 
+    into lists of columns by the csv module, in C, a line at a time.  
+    Blank lines are dropped.
+    '''
+
+    return itertools.ifilter ( None, csv.reader ( lines, delimiter = '|', 
+                                                  quoting = csv.QUOTE_NONE ) )
+
+
+def _iterLines ( chunks ):
+
+    '''
+    The lines (without newlines) in a stream of blocks of text, e.g. an
+    S3 key read a block at a time.  Only one block is held at once.
+    '''
+
+    partial = ''
+
+    for chunk in chunks:
+        lines   = ( partial + chunk ).split ('\n')
+        partial = lines.pop ()
+        for aLine in lines:
+            if aLine:
+                yield aLine
+
+    if partial:
+        yield partial
+
+
+class _WKTList (list):
+
+    '''
+    Collects the WKT of a tile's edges; an edge's ref is its edge number
+    '''
+
+    def add (self, WKT):
+        self.append ( WKT )
+        return len (self) - 1
+
+
 class GenericDataStore (object):
 
     '''
@@ -41,7 +134,10 @@ class GenericDataStore (object):
     This function creates a graph from a list of strings, the required format of 
     which is defined below.
 
-    Subclasses will be need to implement the method _getStringList (self, thisTile)
+    Subclasses will be need to implement the method _getStringList (self, thisTile),
+    or _getLineStream (self, thisTile) to stream the tile rather than
+    hold all of its lines at once.  The loaders read the stream a row at
+    a time (see _getRowStream).
 
     Note that there is not closedown () function (for connections, file handles etc) 
     BUT subclasses are expected to manage and reuse connections while ensuring that 
@@ -65,6 +161,90 @@ class GenericDataStore (object):
         pass 
 
 
+    def _getLineStream (self, thisTile):
+
+        '''
+        An iterable of thisTile's lines.  By default _getStringList.
+        '''
+
+        return self._getStringList ( thisTile )
+
+
+    def _getVersionedLineStream (self, thisTile):
+
+        '''
+        ( _getTileVersion, _getLineStream ) of thisTile, for caches.  
+        Stores that are told the version by the read itself override this
+        to save asking for it separately.
+        '''
+
+        return self._getTileVersion ( thisTile ), self._getLineStream ( thisTile )
+
+
+    def _getTileVersion (self, thisTile):
+
+        '''
+        A string that changes whenever thisTile does (e.g. an S3 ETag), 
+        for caches to tell whether their copy is current.  None if the 
+        store has no versions.
+        '''
+
+        return None
+
+
+    def _getLocalTileVersion (self, thisTile):
+
+        '''
+        thisTile's version (see _getTileVersion) if it is known without a
+        request to the source, e.g. from a cache, else None
+        '''
+
+        return None
+
+
+    def _getSourceCRC (self, thisTile):
+
+        '''
+        A crc32 of thisTile's version, or of its text if the store has no
+        versions (a full read), to tell whether a file built from the 
+        tile is current (see SharedCSRGraph.sourceCRC)
+        '''
+
+        version = self._getTileVersion ( thisTile )
+        if version is not None:
+            return zlib.crc32 ( version )
+
+        crc = 0
+        for thisLine in self._getLineStream ( thisTile ):
+            crc = zlib.crc32 ( thisLine, crc )
+
+        return crc
+
+
+    def _getSharedSourceCRC (self, thisTile):
+
+        '''
+        _getSourceCRC for loadSharedGraphForTile: from _getLocalTileVersion
+        if it is known, so that a current file is used without asking the
+        source
+        '''
+
+        version = self._getLocalTileVersion ( thisTile )
+        if version is not None:
+            return zlib.crc32 ( version )
+
+        return self._getSourceCRC ( thisTile )
+
+
+    def _getRowStream (self, thisTile):
+
+        '''
+        thisTile's lines, split into columns, one at a time
+        '''
+
+        return _splitRows ( self._getLineStream ( thisTile ) )
+
+
     def _createEdgeFromLine (self, lineStr):
 
         '''
@@ -83,25 +263,30 @@ class GenericDataStore (object):
 
         '''
 
-        cols = lineStr.replace('\n','').split ("|")
-        source     = str(cols [0])
-        target     = str(cols [1])
+        return self._createEdgeFromRow ( lineStr.replace('\n','').split ("|") )
 
-        edgeID     = str (source) + "-" + str (target)
-        costHRS    = float (cols [2])
-        costHRSRev = float (cols [3])
-        km         = float (cols [4])
 
-        if cols[6] == 't':
-            isToll  = True
-        else:
-            isToll  = False
+    def _createEdgeFromRow (self, cols):
+
+        '''
+        As _createEdgeFromLine, from the line's columns
+        '''
+
+        # centroid is like POINT(-3.0460 53.81371)
+        centroid = cols [8].replace ('POINT(','' ).replace ( ')','' ).split (" ")
 
-        wktGM      = cols [7]  # e.g. LINESTRING(-3.04 53.8,-3.047 53.81)
-        centroidWKT= cols [8] # e.g. POINT(-3.0460 53.81371)
+        thisEdge = GISEdge.__new__ ( GISEdge )
 
-        thisEdge   = GISEdge ( edgeID, source, target, wktGM , float (km), 
-                               costHRS, centroidWKT , isToll) 
+        thisEdge.sourceNode   = cols [0]
+        thisEdge.targetNode   = cols [1]
+        thisEdge.edgeID       = cols [0] + "-" + cols [1]
+        thisEdge.edgeCost     = float ( cols [2] )
+        thisEdge.originalCost = thisEdge.edgeCost
+        thisEdge.lengthKM     = float ( cols [4] )
+        thisEdge.isToll       = cols [6] == 't'
+        thisEdge.WKT          = cols [7]  # e.g. LINESTRING(-3.04 53.8,-3.047 53.81)
+        thisEdge.CentroidX    = float ( centroid [0] )
+        thisEdge.CentroidY    = float ( centroid [1] )
 
         return thisEdge 
 
@@ -127,13 +312,11 @@ class GenericDataStore (object):
 
         try:
 
-            strList = self._getStringList ( thisTile )
-
             graph = {}
 
-            for thisLine in strList:
+            for cols in self._getRowStream ( thisTile ):
 
-                thisEdge = self._createEdgeFromLine (thisLine)
+                thisEdge = self._createEdgeFromRow ( cols )
 
                 # note, do not implement reverse costs/Edges at this
                 # stage, to reduce memory requirement
@@ -154,6 +337,186 @@ class GenericDataStore (object):
         return graph 
 
 
+    def _createCompactEdgeFromLine (self, lineStr, geometry):
+
+        '''
+        As _createEdgeFromLine, but returns a DataStructures.CompactEdge with
+        its WKT added to geometry (a GeometryBlob) and interned node names.
+        '''
+
+        return self._createCompactEdgeFromRow ( lineStr.replace('\n','').split ("|"), geometry )
+
+
+    def _createCompactEdgeFromRow (self, cols, geometry):
+
+        '''
+        As _createCompactEdgeFromLine, from the line's columns
+        '''
+
+        # centroid is like POINT(-3.0460 53.81371)
+        centroid = cols [8].replace ('POINT(','' ).replace ( ')','' ).split (" ")
+
+        return CompactEdge ( intern ( cols [0] ), intern ( cols [1] ), float ( cols [4] ),
+                             float ( cols [2] ), float ( centroid [0] ), float ( centroid [1] ),
+                             cols [6] == 't', geometry, geometry.add ( cols [7] ) )
+
+
+    def loadCompactGraphForTile (self, thisTile):
+
+        '''
+
+        As loadEdgeGraphForTile, but the edges are DataStructures.CompactEdges,
+        which share one GeometryBlob per tile.
+
+        '''
+
+        try:
+
+            graph = {}
+            geometry = GeometryBlob ()
+
+            for cols in self._getRowStream ( thisTile ):
+
+                thisEdge = self._createCompactEdgeFromRow ( cols, geometry )
+
+                graph.setdefault ( thisEdge.sourceNode, {} ) 
+                graph[thisEdge.sourceNode][thisEdge.targetNode] = thisEdge
+
+                graph.setdefault ( thisEdge.targetNode, {} ) 
+                graph[thisEdge.targetNode][thisEdge.sourceNode] = thisEdge
+
+            geometry.close ()
+
+        except (AWSConnectionError, Exception) as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+
+            raise AppError (utils.timestampStr (), 'DataStore', \
+                            'loadCompactGraphForTile',   e )
+
+        return graph 
+
+
+    def loadMappedGraphForTile (self, thisTile, geometryDir = None):
+
+        '''
+
+        As loadCompactGraphForTile, but the WKT goes to a memory mapped 
+        file per tile in geometryDir (default GEOMETRY_DIR), indexed by 
+        edge number (DataStructures.MappedGeometry).  The file is only 
+        rewritten if the tile's geometry has changed, so processes that 
+        load the same tile share its pages.
+
+        '''
+
+        if geometryDir is None:
+            geometryDir = GEOMETRY_DIR
+
+        try:
+
+            graph = {}
+            edges = []
+            lstWKT = _WKTList ()
+
+            for cols in self._getRowStream ( thisTile ):
+
+                thisEdge = self._createCompactEdgeFromRow ( cols, lstWKT )
+                edges.append ( thisEdge )
+
+                graph.setdefault ( thisEdge.sourceNode, {} ) 
+                graph[thisEdge.sourceNode][thisEdge.targetNode] = thisEdge
+
+                graph.setdefault ( thisEdge.targetNode, {} ) 
+                graph[thisEdge.targetNode][thisEdge.sourceNode] = thisEdge
+
+            _makeDirs ( geometryDir )
+
+            geometry = MappedGeometry.openOrWrite ( 
+                           os.path.join ( geometryDir, '%s.geom' %( str (thisTile) ) ), lstWKT )
+
+            for thisEdge in edges:
+                thisEdge._geometry = geometry
+
+        except (AWSConnectionError, Exception) as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+
+            raise AppError (utils.timestampStr (), 'DataStore', \
+                            'loadMappedGraphForTile',   e )
+
+        return graph 
+
+
+    def loadCSRGraphForTile (self, thisTile):
+
+        '''
+
+        As loadEdgeGraphForTile, but the graph is a DataStructures.CSRGraph,
+        which needs a fraction of the memory of the dict of dicts.
+
+        '''
+
+        try:
+
+            graph = CSRGraph.fromEdges ( itertools.imap ( self._createEdgeFromRow, 
+                                                          self._getRowStream ( thisTile ) ) )
+
+        except (AWSConnectionError, Exception) as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+
+            raise AppError (utils.timestampStr (), 'DataStore', \
+                            'loadCSRGraphForTile',   e )
+
+        return graph 
+
+
+    def loadSharedGraphForTile (self, thisTile, sharedDir = None):
+
+        '''
+
+        As loadCSRGraphForTile, but the graph is a DataStructures.SharedCSRGraph
+        mapped from a file per tile in sharedDir (default SHARED_GRAPH_DIR).
+
+        The first process to load a tile builds its file; every other 
+        process (e.g. the other gunicorn workers, or all of them after a 
+        restart) maps that file without fetching or parsing the tile, and
+        shares its pages.  The file's header holds the tile's 
+        _getSourceCRC, and the file is built again when that changes.  
+        The source is only asked for the tile's version if 
+        _getLocalTileVersion does not know it.
+
+        '''
+
+        if sharedDir is None:
+            sharedDir = SHARED_GRAPH_DIR
+
+        filePath = os.path.join ( sharedDir, '%s.csr' %( str (thisTile) ) )
+
+        try:
+
+            sourceCRC = self._getSharedSourceCRC ( thisTile )
+
+            graph = SharedCSRGraph.openFile ( filePath, sourceCRC )
+            if graph is not None:
+                return graph
+
+            _makeDirs ( sharedDir )
+
+            SharedCSRGraph.write ( filePath, self.loadCSRGraphForTile ( thisTile ), sourceCRC )
+
+            graph = SharedCSRGraph ( filePath )
+
+        except (AWSConnectionError, Exception) as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+
+            raise AppError (utils.timestampStr (), 'DataStore', \
+                            'loadSharedGraphForTile',   e )
+
+        return graph 
+
+
 class AWS_S3DataStore (GenericDataStore):
    
     '''
@@ -169,48 +532,92 @@ class AWS_S3DataStore (GenericDataStore):
 
     def _getKeyNameFromTile (self, aTile ):
         return self.bucketPrefix + '.' + aTile.getID ()
-    
-    def _getStringList (self, thisTile):
- 
-        conn = self._getS3Connection ()
 
-        bucketRef = None
-        keyID = None 
+    def _getKeyID (self, aTile):
+
+        '''
+        The name of aTile's key in the bucket
+        '''
+
+        return aTile.getID ()
+
+    def _getTileVersion (self, thisTile):
+
+        '''
+        The ETag of thisTile's key (a HEAD request, the body is not read)
+        '''
+
+        conn = self._getS3Connection ()
+        keyID = self._getKeyID ( thisTile )
 
         try:
-            bucketRef =conn.get_bucket ( self.bucketPrefix );
+            keyRef = conn.get_bucket ( self.bucketPrefix ).get_key ( keyID )
         except (AWSConnectionError, Exception) as e:
             import traceback, utils
             utils.logError ( traceback.format_exc() )
-            errStr = 'Opening key %s' %( keyID )
+            errStr = 'Reading bucket key: %s' %( keyID )
             raise AppError (utils.timestampStr (), 'DataStore', errStr,   e )
+        finally:
+            conn.close ()
+
+        if keyRef is None:
+            return None
+
+        return keyRef.etag
+    
+    def _getStringList (self, thisTile):
+
+        return list ( self._getLineStream ( thisTile ) )
+
+    def _getLineStream (self, thisTile):
+
+        '''
+        Streams the tile's key a block at a time (boto Keys iterate in 
+        blocks), rather than reading it into one string and splitting it
+        '''
+
+        version, lines = self._getVersionedLineStream ( thisTile )
+
+        for aLine in lines:
+            yield aLine
+
+    def _getVersionedLineStream (self, thisTile):
+
+        '''
+        The ETag of the tile's key and its lines, from the one request
+        '''
+ 
+        conn = self._getS3Connection ()
 
-        strEdges = None
         tileID = thisTile.getID ()
         keyRef = None
 
         try:
-            keyRef = bucketRef.get_key ( thisTile.getID ())
-            strEdges = keyRef.get_contents_as_string() 
+            keyRef = conn.get_bucket ( self.bucketPrefix ).get_key ( self._getKeyID ( thisTile ) )
+            if keyRef is None:
+                raise KeyError ( tileID )
         except (AWSConnectionError, Exception) as e:
+            conn.close ()
             import traceback, utils
             utils.logError ( traceback.format_exc() )
-            errStr = 'Reading bucket key: %s' %( tileID )
+            errStr = 'Opening key %s' %( tileID )
             raise AppError (utils.timestampStr (), 'DataStore', errStr,   e )
 
-        resultList = []
-        someLines = strEdges.split ('\n')
-        listLen = len ( someLines )
-        count = 0
+        return keyRef.etag, self._iterKeyLines ( tileID, conn, keyRef )
 
-        while (len ( someLines ) > 0 ):
-            aLine = someLines.pop ()
-            if len (aLine ) > 0:
-                resultList.append ( aLine )
+    def _iterKeyLines (self, tileID, conn, keyRef):
 
-        conn.close ()
-
-        return resultList
+        try:
+            for aLine in _iterLines ( keyRef ):
+                yield aLine
+        except (AWSConnectionError, Exception) as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+            errStr = 'Reading bucket key: %s' %( tileID )
+            raise AppError (utils.timestampStr (), 'DataStore', errStr,   e )
+        finally:
+            keyRef.close ()
+            conn.close ()
 
     def _getS3Connection (self):
 
@@ -256,7 +663,11 @@ class TestDataStore (GenericDataStore):
 
         return self.strList
 
+import copy
+import json
 import math
+import threading
+import time
 
 class FileDataStore (GenericDataStore):
 
@@ -264,11 +675,30 @@ class FileDataStore (GenericDataStore):
 
     Utility class for testing program without going online
 
+    The first load builds an index of the file, the byte ranges of each
+    tile's lines, in one pass.  Every load after that seeks to the tile's
+    ranges and reads only them.  The index is kept for the process (for
+    every FileDataStore of the same unchanged file), and in indexPath if
+    given, so that it is only built once per file.
+
+    A file written by writeSortedByTile has one range per tile.
+
     '''
 
-    def __init__ (self, filePath, hasHeader=False):
+    # (filePath, hasHeader) -> index, for all instances
+    _indexes   = {}
+    _indexLock = threading.Lock ()
+
+    # Bytes read at once from a tile's ranges
+    BLOCK_SIZE = 1 << 20
+
+    # { tileID: list of lines } already read, see withTiles
+    _readLines = None
+
+    def __init__ (self, filePath, hasHeader=False, indexPath=None):
         self.filePath = filePath
         self.hasHeader= hasHeader
+        self.indexPath= indexPath
    
     def _getStringList (self, thisTile):
 
@@ -277,43 +707,935 @@ class FileDataStore (GenericDataStore):
         return a list of those matched lines.
         '''
 
-        lstLines = []
-
-        try:
-
-           fs = open ( self.filePath, 'r' )
-
-           if (self.hasHeader): 
-               fs.readline ()
-
-           allLines = fs.readlines ()
-
-           for thisLine in allLines:
+        return list ( self._getLineStream ( thisTile ) )
 
-#               print thisLine
+    def _getLineStream (self, thisTile):
 
-               cols = thisLine.split ("|")
-               centroidWKT= cols [8]
+        '''
+        The lines of the file that are in Tile thisTile, read from its
+        ranges a block at a time (or from those read by withTiles)
+        '''
 
-               # centroidWKT is like "POINT (0.2343 0.2332432)"
-               tmpList = centroidWKT.replace ('POINT(','' ).replace ( ')','' ).split (" ")
-               X     = float (tmpList[0] )
-               Y     = float (tmpList[1] )
+        if self._readLines is not None and thisTile.getID () in self._readLines:
+            return iter ( self._readLines [ thisTile.getID () ] )
 
-               # Find the integer "floor" value of x & y co-ordinates
-               xVal = int (math.floor ( X ) )
-               yVal = int (math.floor ( Y ) )
+        ranges = self.getIndex () ['tiles'].get ( thisTile.getID (), [] )
 
-               if ( Tile ( xVal , yVal ) == thisTile  ):
-                   lstLines.append ( thisLine )
+        return _iterLines ( self._readRanges ( ranges ) )
 
-           fs.close ()
+    def _readRanges (self, ranges):
 
+        try:
+            fs = open ( self.filePath, 'rb' )
         except IOError as e:
             import traceback, utils
             utils.logError ( traceback.format_exc() )
             raise AppError (utils.timestampStr (), 'FileDataStore', 'open/read file',   e )
- 
-        return lstLines
 
+        try:
+            for start, end in ranges:
+                fs.seek ( start )
+                while start < end:
+                    block = fs.read ( min ( self.BLOCK_SIZE, end - start ) )
+                    if not block:
+                        break
+                    start += len ( block )
+                    yield block
+        finally:
+            fs.close ()
+
+    def readTiles (self, lstTiles):
+
+        '''
+        { tileID: list of lines } for each of lstTiles, read in one pass
+        through the file in the order of their ranges.  The ranges are of
+        whole lines, so a line is in the range it starts in.
+        '''
+
+        tiles  = self.getIndex () ['tiles']
+        ranges = sorted ( [ ( start, end, aTile.getID () ) for aTile in lstTiles 
+                            for start, end in tiles.get ( aTile.getID (), [] ) ] )
+
+        result = dict ( [ ( aTile.getID (), [] ) for aTile in lstTiles ] )
+
+        # where each range ends in the bytes read
+        ends = []
+        for start, end, tileID in ranges:
+            ends.append ( ( ends and ends [-1] or 0 ) + end - start )
+
+        r       = 0
+        offset  = 0
+        partial = ''
+
+        for block in self._readRanges ( [ ( start, end ) for start, end, tileID in ranges ] ):
+
+            lines   = ( partial + block ).split ('\n')
+            partial = lines.pop ()
+
+            for aLine in lines:
+                while offset >= ends [r]:
+                    r += 1
+                if aLine:
+                    result [ ranges [r][2] ].append ( aLine )
+                offset += len ( aLine ) + 1
+
+        # the last line of the file, without a newline
+        if partial:
+            result [ ranges [-1][2] ].append ( partial )
+
+        return result
+
+    def withTiles (self, lstTiles):
+
+        '''
+        A copy of this store holding the lines of lstTiles, read in one
+        pass (readTiles), which its loaders use rather than reading each
+        tile's ranges again
+        '''
+
+        dataStore = copy.copy ( self )
+        dataStore._readLines = self.readTiles ( lstTiles )
+
+        return dataStore
+
+    def _getTileVersion (self, thisTile):
+
+        '''
+        The size and modification time of the file
+        '''
+
+        index = self.getIndex ()
+        return '%s-%r' %( index ['size'], index ['mtime'] )
+
+    def _getLocalTileVersion (self, thisTile):
+        return self._getTileVersion ( thisTile )
+
+    def getTileIDs (self):
+
+        '''
+        Sorted IDs of the tiles with lines in the file
+        '''
+
+        return sorted ( self.getIndex () ['tiles'] )
+
+    def getIndex (self):
+
+        '''
+        The file's index:
+
+            'size', 'mtime'   of the file indexed
+            'tiles'           { tileID: [ [start, end], .. ] } byte ranges
+                              of whole lines, in file order
+
+        Built on first use, or read from indexPath if that was written for
+        the file as it is now.  Rebuilt if the file changes.
+        '''
+
+        try:
+            fileStat = os.stat ( self.filePath )
+        except OSError as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+            raise AppError (utils.timestampStr (), 'FileDataStore', 'open/read file',   e )
+
+        key = ( os.path.abspath ( self.filePath ), self.hasHeader )
+
+        self._indexLock.acquire ()
+        try:
+            index = self._indexes.get ( key )
+            if not self._isCurrent ( index, fileStat ):
+                index = self._loadIndex ( fileStat )
+                if index is None:
+                    index = self._buildIndex ( fileStat )
+                    self._saveIndex ( index )
+                self._indexes [key] = index
+        finally:
+            self._indexLock.release ()
+
+        return index
+
+    def _isCurrent (self, index, fileStat):
+
+        return index is not None and index ['size']  == fileStat.st_size \
+                                 and index ['mtime'] == fileStat.st_mtime \
+                                 and index ['hasHeader'] == self.hasHeader
+
+    def _buildIndex (self, fileStat):
+
+        print "indexing %s" %( self.filePath )
+
+        tiles   = {}
+        tileIDs = {}   # (floor x, floor y) -> tile ID
+        floor   = math.floor
+
+        fs = open ( self.filePath, 'rb' )
+
+        try:
+
+            offset = 0
+            if (self.hasHeader): 
+                offset = len ( fs.readline () )
+
+            for thisLine in fs:
+
+                end  = offset + len ( thisLine )
+                cols = thisLine.split ("|", 9)
+
+                if len ( cols ) >= 9:
+
+                    # centroid is like "POINT(0.2343 0.2332432)"; the line is
+                    # in the tile of the "floor" values of x & y
+                    X, Y = cols [8].replace ('POINT(','' ).replace ( ')','' ).split (" ")
+                    xy   = ( int ( floor ( float (X) ) ), int ( floor ( float (Y) ) ) )
+
+                    tileID = tileIDs.get ( xy )
+                    if tileID is None:
+                        tileID = tileIDs [xy] = Tile ( xy[0], xy[1] ).getID ()
+
+                    ranges = tiles.setdefault ( tileID, [] )
+                    if ranges and ranges [-1][1] == offset:
+                        ranges [-1][1] = end
+                    else:
+                        ranges.append ( [ offset, end ] )
+
+                offset = end
+
+        finally:
+            fs.close ()
+
+        return { 'size'     : fileStat.st_size,
+                 'mtime'    : fileStat.st_mtime,
+                 'hasHeader': self.hasHeader,
+                 'tiles'    : tiles }
+
+    def _loadIndex (self, fileStat):
+
+        if self.indexPath is None or not os.path.exists ( self.indexPath ):
+            return None
+
+        try:
+            fs = open ( self.indexPath, 'r' )
+            try:
+                index = json.load ( fs )
+            finally:
+                fs.close ()
+        except (IOError, ValueError):
+            return None
+
+        if not self._isCurrent ( index, fileStat ):
+            return None
+
+        index ['tiles'] = dict ( [ ( str (tileID), ranges ) for tileID, ranges 
+                                   in index ['tiles'].iteritems () ] )
+        return index
+
+    def _saveIndex (self, index):
+
+        if self.indexPath is None:
+            return
+
+        try:
+            tmpPath = '%s.%s.tmp' %( self.indexPath, os.getpid () )
+            fs = open ( tmpPath, 'w' )
+            json.dump ( index, fs )
+            fs.close ()
+            os.rename ( tmpPath, self.indexPath )
+        except (IOError, OSError) as e:
+            # a read only directory only costs rebuilding the index
+            print "not saving index %s: %s" %( self.indexPath, e )
+
+    def writeSortedByTile (self, outPath):
+
+        '''
+        Write the file's lines (without a header) to outPath grouped by 
+        tile, so that each tile is one range
+        '''
+
+        tiles = self.getIndex () ['tiles']
+
+        fs = open ( outPath, 'wb' )
+        try:
+            for tileID in sorted ( tiles ):
+                for aLine in _iterLines ( self._readRanges ( tiles [tileID] ) ):
+                    fs.write ( aLine + '\n' )
+        finally:
+            fs.close ()
+
+
+class CompiledDataStore (GenericDataStore):
+
+    '''
+
+    Abstract base class for tiles compiled by TileCompiler (the binary 
+    format of DataStructures.SharedCSRGraph).  A tile is one read of 
+    one blob, its tables are unpacked with a call each, and there are 
+    no lines to split or numbers to parse.
+
+    Subclasses implement _getCompiledBytes (self, thisTile).
+
+    '''
+
+    def _getCompiledBytes (self, thisTile):
+
+        '''
+
+        Virtual method - override this in subclasses
+
+        The contents of thisTile's compiled file, as a string
+
+        '''
+
+        pass
+
+
+    def _getVersionedCompiledBytes (self, thisTile):
+
+        '''
+        ( _getTileVersion, _getCompiledBytes ) of thisTile, for caches 
+        (see GenericDataStore._getVersionedLineStream)
+        '''
+
+        return self._getTileVersion ( thisTile ), self._getCompiledBytes ( thisTile )
+
+
+    def _getSourceCRC (self, thisTile):
+
+        '''
+        A crc32 of thisTile's version, or of its compiled bytes if the 
+        store has no versions
+        '''
+
+        version = self._getTileVersion ( thisTile )
+        if version is not None:
+            return zlib.crc32 ( version )
+
+        return zlib.crc32 ( self._getCompiledBytes ( thisTile ) )
+
+
+    def _getCompiledGraph (self, thisTile):
+
+        '''
+        thisTile as a SharedCSRGraph over its bytes.  Raises an AppError if
+        the bytes are not a compiled tile of this version.
+        '''
+
+        data = self._getCompiledBytes ( thisTile )
+
+        try:
+            return SharedCSRGraph.fromBytes ( data )
+        except (IOError, struct.error) as e:
+            import utils
+            raise AppError (utils.timestampStr (), 'DataStore', \
+                            'compiled tile %s: %s' %( str (thisTile), e ), e )
+
+
+    def _graphFromCSR (self, csr, makeEdge):
+
+        '''
+        The dict of dicts of csr, with makeEdge ( ref, cost ) for each edge
+        (one object for both directions, as loadEdgeGraphForTile)
+        '''
+
+        graph    = {}
+        edges    = {}
+        nodes    = csr.nodes
+        offsets  = csr.offsets
+        targets  = csr.targets
+        costs    = csr.costs
+        edgeRefs = csr.edgeRefs
+
+        for i, v in enumerate ( nodes ):
+
+            neighbours = graph [v] = {}
+
+            for arc in xrange ( offsets [i], offsets [i + 1] ):
+                ref  = edgeRefs [arc]
+                edge = edges.get ( ref )
+                if edge is None:
+                    edge = edges [ref] = makeEdge ( ref, costs [arc] )
+                neighbours [ nodes [ targets [arc] ] ] = edge
+
+        return graph
+
+
+    def _compactGraphFromCSR (self, csr, geometry):
+
+        nodes      = csr.nodes = [ intern (v) for v in csr.nodes ]
+        edgeSource = csr.edgeSource
+        edgeTarget = csr.edgeTarget
+        lengthKM   = csr.lengthKM
+        centroidX  = csr.centroidX
+        centroidY  = csr.centroidY
+        isToll     = csr.isToll
+
+        return self._graphFromCSR ( csr, lambda ref, cost: \
+                   CompactEdge ( nodes [ edgeSource [ref] ], nodes [ edgeTarget [ref] ],
+                                 lengthKM [ref], cost, centroidX [ref], centroidY [ref],
+                                 bool ( isToll [ref] ), geometry, ref ) )
+
+
+    def loadEdgeGraphForTile (self, thisTile):
+
+        try:
+            csr = self._getCompiledGraph ( thisTile ).toCSRGraph ()
+            graph = self._graphFromCSR ( csr, csr.getEdge )
+
+        except (AWSConnectionError, Exception) as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+
+            raise AppError (utils.timestampStr (), 'DataStore', \
+                            'loadEdgeGraphForTile',   e )
+
+        return graph
+
+
+    def loadCompactGraphForTile (self, thisTile):
+
+        '''
+        The edges' geometry is kept in the compiled tile (a string), cut out
+        when asked for
+        '''
+
+        try:
+            compiled = self._getCompiledGraph ( thisTile )
+            graph = self._compactGraphFromCSR ( compiled.toCSRGraph (), compiled )
+
+        except (AWSConnectionError, Exception) as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+
+            raise AppError (utils.timestampStr (), 'DataStore', \
+                            'loadCompactGraphForTile',   e )
+
+        return graph
+
+
+    def loadMappedGraphForTile (self, thisTile, geometryDir = None):
+
+        if geometryDir is None:
+            geometryDir = GEOMETRY_DIR
+
+        try:
+            csr = self._getCompiledGraph ( thisTile ).toCSRGraph ()
+
+            _makeDirs ( geometryDir )
+
+            geometry = MappedGeometry.openOrWrite ( 
+                           os.path.join ( geometryDir, '%s.geom' %( str (thisTile) ) ), csr.WKT )
+
+            graph = self._compactGraphFromCSR ( csr, geometry )
+
+        except (AWSConnectionError, Exception) as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+
+            raise AppError (utils.timestampStr (), 'DataStore', \
+                            'loadMappedGraphForTile',   e )
+
+        return graph
+
+
+    def loadCSRGraphForTile (self, thisTile):
+
+        try:
+            graph = self._getCompiledGraph ( thisTile ).toCSRGraph ()
+
+        except (AWSConnectionError, Exception) as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+
+            raise AppError (utils.timestampStr (), 'DataStore', \
+                            'loadCSRGraphForTile',   e )
+
+        return graph
+
+
+    def loadSharedGraphForTile (self, thisTile, sharedDir = None):
+
+        '''
+        The compiled tile is already in the shared format, so it is written
+        to sharedDir as it is, but with the header's sourceCRC set to this
+        store's _getSourceCRC of the tile (rather than the crc of the text
+        it was compiled from) so that the file is replaced when the 
+        compiled tile is
+        '''
+
+        if sharedDir is None:
+            sharedDir = SHARED_GRAPH_DIR
+
+        filePath = os.path.join ( sharedDir, '%s.csr' %( str (thisTile) ) )
+
+        try:
+
+            sourceCRC = self._getSharedSourceCRC ( thisTile )
+
+            graph = SharedCSRGraph.openFile ( filePath, sourceCRC )
+            if graph is not None:
+                return graph
+
+            _makeDirs ( sharedDir )
+
+            SharedCSRGraph.writeBytes ( filePath, SharedCSRGraph.withSourceCRC ( 
+                                            self._getCompiledGraph ( thisTile ).data, sourceCRC ) )
+
+            graph = SharedCSRGraph ( filePath )
+
+        except (AWSConnectionError, Exception) as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+
+            raise AppError (utils.timestampStr (), 'DataStore', \
+                            'loadSharedGraphForTile',   e )
+
+        return graph
+
+
+class CompiledFileDataStore (CompiledDataStore):
+
+    '''
+
+    Compiled tiles in a directory, one file <tileID>.csr per tile (see
+    TileCompiler.compileTiles)
+
+    '''
+
+    def __init__ (self, dirPath):
+        self.dirPath = dirPath
+
+    def _getTilePath (self, thisTile):
+        return os.path.join ( self.dirPath, '%s.csr' %( thisTile.getID () ) )
+
+    def _getTileVersion (self, thisTile):
+
+        '''
+        The size and modification time of the tile's file
+        '''
+
+        try:
+            fileStat = os.stat ( self._getTilePath ( thisTile ) )
+        except OSError:
+            return None
+
+        return '%s-%r' %( fileStat.st_size, fileStat.st_mtime )
+
+    def _getLocalTileVersion (self, thisTile):
+        return self._getTileVersion ( thisTile )
+
+    def _getCompiledBytes (self, thisTile):
+
+        try:
+            fs = open ( self._getTilePath ( thisTile ), 'rb' )
+            try:
+                data = fs.read ()
+            finally:
+                fs.close ()
+
+        except IOError as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+            raise AppError (utils.timestampStr (), 'CompiledFileDataStore', 'open/read file',   e )
+
+        return data
+
+
+class AWS_S3CompiledDataStore (CompiledDataStore, AWS_S3DataStore):
+
+    '''
+
+    Compiled tiles in the S3 bucket of AWS_S3DataStore, key <tileID>.csr
+
+    '''
+
+    def _getKeyID (self, aTile):
+        return '%s.csr' %( aTile.getID () )
+
+    def _getCompiledBytes (self, thisTile):
+        return self._getVersionedCompiledBytes ( thisTile ) [1]
+
+    def _getVersionedCompiledBytes (self, thisTile):
+
+        '''
+        The ETag of the tile's key and its contents, from the one request
+        '''
+
+        conn = self._getS3Connection ()
+        keyID = self._getKeyID ( thisTile )
+
+        try:
+            bucketRef = conn.get_bucket ( self.bucketPrefix )
+            keyRef = bucketRef.get_key ( keyID )
+            data = keyRef.get_contents_as_string ()
+        except (AWSConnectionError, Exception) as e:
+            import traceback, utils
+            utils.logError ( traceback.format_exc() )
+            errStr = 'Reading bucket key: %s' %( keyID )
+            raise AppError (utils.timestampStr (), 'DataStore', errStr,   e )
+        finally:
+            conn.close ()
+
+        return keyRef.etag, data
+
+
+class DiskTileCache (object):
+
+    '''
+
+    A directory of tile files of at most maxBytes, the least recently used
+    removed first.  Each file has a <name>.meta (JSON) with the version of
+    the tile it holds (see GenericDataStore._getTileVersion) and when that
+    was last checked.  A file is only checked against its source again
+    after revalidateSecs, so within that time a tile is read from disk 
+    without any network request.
+
+    Processes may share the directory: files are written to a temporary
+    name and renamed, and readers hold an open file, which survives the
+    file being evicted by another process.
+
+    '''
+
+    def __init__ (self, cacheDir, maxBytes = TILE_CACHE_BYTES, 
+                        revalidateSecs = TILE_CACHE_REVALIDATE_SECS):
+
+        self.cacheDir       = cacheDir
+        self.maxBytes       = maxBytes
+        self.revalidateSecs = revalidateSecs
+        self.lock           = threading.Lock ()
+
+        self.hits        = 0
+        self.misses      = 0
+        self.stale       = 0
+        self.evictions   = 0
+
+    def _count (self, counter):
+        self.lock.acquire ()
+        setattr ( self, counter, getattr ( self, counter ) + 1 )
+        self.lock.release ()
+
+    def _readMeta (self, name):
+
+        try:
+            fs = open ( os.path.join ( self.cacheDir, name + '.meta' ), 'r' )
+            try:
+                return json.load ( fs )
+            finally:
+                fs.close ()
+        except (IOError, ValueError):
+            return None
+
+    def _writeMeta (self, name, meta):
+
+        metaPath = os.path.join ( self.cacheDir, name + '.meta' )
+        tmpPath  = '%s.%s.%s.tmp' %( metaPath, os.getpid (), threading.current_thread ().ident )
+
+        fs = open ( tmpPath, 'w' )
+        json.dump ( meta, fs )
+        fs.close ()
+
+        os.rename ( tmpPath, metaPath )
+
+    def currentVersion (self, name):
+
+        '''
+        The version of the cached file name if it was checked against its
+        source within revalidateSecs, else None
+        '''
+
+        meta = self._readMeta ( name )
+        if meta is None or time.time () - meta ['checked'] >= self.revalidateSecs:
+            return None
+
+        return meta ['version']
+
+    def openFile (self, name, getVersion):
+
+        '''
+        The cached file name, opened for reading, if it is current.  
+        getVersion () returns the version of the source; it is only called
+        if the file was last checked over revalidateSecs ago.  Returns None
+        (and removes the file if stale) otherwise.
+
+        If the source cannot be reached (getVersion raises an AppError) the
+        file is used as it is.
+        '''
+
+        meta = self._readMeta ( name )
+        if meta is None:
+            self._count ( 'misses' )
+            return None
+
+        filePath = os.path.join ( self.cacheDir, name )
+
+        if time.time () - meta ['checked'] >= self.revalidateSecs:
+
+            try:
+                version = getVersion ()
+            except AppError as e:
+                print "using cached tile file %s unchecked: %s" %( name, e )
+                version = None
+
+            if version is not None and version != meta ['version']:
+                self._count ( 'stale' )
+                self._remove ( name )
+                return None
+
+            meta ['checked'] = time.time ()
+            try:
+                self._writeMeta ( name, meta )
+            except (IOError, OSError):
+                pass
+
+        try:
+            fs = open ( filePath, 'rb' )
+            os.utime ( filePath, None )
+        except (IOError, OSError):
+            self._count ( 'misses' )
+            return None
+
+        self._count ( 'hits' )
+        return fs
+
+    def store (self, name, version, blocks):
+
+        '''
+        Write the strings blocks to the file name, with version, evict the
+        least recently used files over maxBytes, and return the file opened
+        for reading
+        '''
+
+        _makeDirs ( self.cacheDir )
+
+        filePath = os.path.join ( self.cacheDir, name )
+        tmpPath  = '%s.%s.%s.tmp' %( filePath, os.getpid (), threading.current_thread ().ident )
+
+        fs = open ( tmpPath, 'wb' )
+        try:
+            for block in blocks:
+                fs.write ( block )
+        except:
+            fs.close ()
+            os.remove ( tmpPath )
+            raise
+        fs.close ()
+
+        os.rename ( tmpPath, filePath )
+        self._writeMeta ( name, { 'version': version, 'checked': time.time () } )
+
+        fs = open ( filePath, 'rb' )
+
+        self.enforceBudget ( [ name ] )
+
+        return fs
+
+    def _remove (self, name):
+
+        for filePath in [ os.path.join ( self.cacheDir, name + '.meta' ),
+                          os.path.join ( self.cacheDir, name ) ]:
+            try:
+                os.remove ( filePath )
+            except OSError:
+                # removed by another process
+                pass
+
+    def entries (self):
+
+        '''
+        [ (last used, bytes, name) ] of the cached files
+        '''
+
+        result = []
+
+        if not os.path.isdir ( self.cacheDir ):
+            return result
+
+        for name in os.listdir ( self.cacheDir ):
+            if name.endswith ( '.meta' ) or name.endswith ( '.tmp' ):
+                continue
+            try:
+                fileStat = os.stat ( os.path.join ( self.cacheDir, name ) )
+            except OSError:
+                continue
+            result.append ( ( fileStat.st_mtime, fileStat.st_size, name ) )
+
+        return result
+
+    def totalBytes (self):
+        return sum ( [ nbytes for used, nbytes, name in self.entries () ] )
+
+    def enforceBudget (self, lstKeep = ()):
+
+        '''
+        Remove the least recently used files (not those in lstKeep) until
+        the files are within maxBytes
+        '''
+
+        entries = sorted ( self.entries () )
+        total   = sum ( [ nbytes for used, nbytes, name in entries ] )
+
+        for used, nbytes, name in entries:
+
+            if total <= self.maxBytes:
+                break
+            if name in lstKeep:
+                continue
+
+            print "evicting cached tile file %s" %( name )
+            self._remove ( name )
+            self._count ( 'evictions' )
+            total -= nbytes
+
+    def cacheStats (self):
+
+        self.lock.acquire ()
+        try:
+            stats = { 'dir'       : self.cacheDir,
+                      'maxBytes'  : self.maxBytes,
+                      'hits'      : self.hits,
+                      'misses'    : self.misses,
+                      'stale'     : self.stale,
+                      'evictions' : self.evictions }
+        finally:
+            self.lock.release ()
+
+        stats ['totalBytes'] = self.totalBytes ()
+
+        return stats
+
+
+def _readBlocks ( fs, blockSize = FileDataStore.BLOCK_SIZE ):
+
+    '''
+    The contents of the open file fs a block at a time, then closes it
+    '''
+
+    try:
+        while True:
+            block = fs.read ( blockSize )
+            if not block:
+                break
+            yield block
+    finally:
+        fs.close ()
+
+
+class CachingDataStore (GenericDataStore):
+
+    '''
+
+    Read-through disk cache in front of another DataStore: a tile is 
+    fetched from dataStore once, written to a DiskTileCache in cacheDir 
+    (default TILE_CACHE_DIR/<class of dataStore>), and read from there 
+    after that, by this and every later process, until it is evicted or
+    dataStore reports a new version of it.
+
+    The text of the tile is cached, and parsed by the loaders as usual.
+
+    '''
+
+    def __init__ (self, dataStore, cacheDir = None, maxBytes = TILE_CACHE_BYTES,
+                        revalidateSecs = TILE_CACHE_REVALIDATE_SECS):
+
+        if cacheDir is None:
+            cacheDir = os.path.join ( TILE_CACHE_DIR, dataStore.__class__.__name__ )
+
+        self.dataStore = dataStore
+        self.cache     = DiskTileCache ( cacheDir, maxBytes, revalidateSecs )
+
+    def _getTileVersion (self, thisTile):
+
+        '''
+        The cached tile's version while it is trusted (see 
+        _getLocalTileVersion), else dataStore's
+        '''
+
+        version = self._getLocalTileVersion ( thisTile )
+        if version is None:
+            version = self.dataStore._getTileVersion ( thisTile )
+
+        return version
+
+    def _getCacheName (self, thisTile):
+        return '%s.txt' %( thisTile.getID () )
+
+    def _getLocalTileVersion (self, thisTile):
+
+        '''
+        The version of the cached tile, while the cache trusts it without
+        asking dataStore (see DiskTileCache.openFile)
+        '''
+
+        return self.cache.currentVersion ( self._getCacheName ( thisTile ) )
+
+    def _openCached (self, thisTile, name, getVersionedBlocks):
+
+        '''
+        The cached file name of thisTile, opened for reading.  On a miss 
+        getVersionedBlocks () gives the version and the blocks to store, 
+        from one read of dataStore.
+        '''
+
+        fs = self.cache.openFile ( name, lambda: self.dataStore._getTileVersion ( thisTile ) )
+
+        if fs is None:
+            version, blocks = getVersionedBlocks ()
+            fs = self.cache.store ( name, version, blocks )
+
+        return fs
+
+    def _getLineStream (self, thisTile):
+
+        def getVersionedBlocks ():
+            version, lines = self.dataStore._getVersionedLineStream ( thisTile )
+            return version, ( aLine.rstrip ('\n') + '\n' for aLine in lines )
+
+        fs = self._openCached ( thisTile, self._getCacheName ( thisTile ), getVersionedBlocks )
+
+        return _iterLines ( _readBlocks ( fs ) )
+
+    def _getStringList (self, thisTile):
+        return list ( self._getLineStream ( thisTile ) )
+
+    def cacheStats (self):
+        return self.cache.cacheStats ()
+
+
+class CachingCompiledDataStore (CompiledDataStore, CachingDataStore):
+
+    '''
+
+    CachingDataStore for a CompiledDataStore: the compiled tiles are 
+    cached
+
+    '''
+
+    def _getCacheName (self, thisTile):
+        return '%s.csr' %( thisTile.getID () )
+
+    def _getCompiledBytes (self, thisTile):
+
+        def getVersionedBlocks ():
+            version, data = self.dataStore._getVersionedCompiledBytes ( thisTile )
+            return version, [ data ]
+
+        fs = self._openCached ( thisTile, self._getCacheName ( thisTile ), getVersionedBlocks )
+
+        try:
+            data = fs.read ()
+        finally:
+            fs.close ()
+
+        return data
+
+
+def makeCachingDataStore (dataStore, cacheDir = None, maxBytes = TILE_CACHE_BYTES,
+                          revalidateSecs = TILE_CACHE_REVALIDATE_SECS):
+
+    '''
+    dataStore behind a CachingDataStore, or a CachingCompiledDataStore if
+    it is a CompiledDataStore
+    '''
+
+    if isinstance ( dataStore, CompiledDataStore ):
+        return CachingCompiledDataStore ( dataStore, cacheDir, maxBytes, revalidateSecs )
 
+    return CachingDataStore ( dataStore, cacheDir, maxBytes, revalidateSecs )
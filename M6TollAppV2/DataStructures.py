@@ -26,6 +26,15 @@ The following classes are defined in this module:
                       fast database with fast 'reads' (on 200,000 +/- keys) may 
                       eliminate the need for this class.
 
+- CompactEdge         Same interface as GISEdge in a fraction of the memory: 
+                      __slots__, node names shared with the graph, and the WKT 
+                      left in a per-tile GeometryBlob until it is asked for.
+
+- GeometryBlob        The WKT of all of the edges of one tile in one string.
+
+- MappedGeometry      The WKT of all of the edges of one tile in a memory 
+                      mapped file, indexed by edge number.
+
 - priority_dict       Subclass of dictionary providing a fast ordering on each   
                       (value) item in the dictionary
                       
@@ -34,12 +43,26 @@ The following classes are defined in this module:
                       order. At the end of each iteration the selected key/value item 
                       is deleted.
 
+- IndexedHeap         Priority queue with the priority_dict interface.  A binary
+                      heap that knows where each key sits, so a priority can be 
+                      lowered in place: no stale entries and no heap rebuilds.
+
 - CompositeGraph      Provides key value access to a set of different sub graphs.
                       Caters for the routing algorithm which expects a single graph.
                       Allows for the fact that this app has memory restrictions on the 
-                      number of graphs permiited in memory at one time. 
+                      number of graphs permiited in memory at one time.
+
+- TileGraphView       A CompositeGraph limited to the tiles chosen for one query. 
                       Works closely with  GraphRepository.GraphRepository.
 
+- CSRGraph            Array backed (compressed sparse row) replacement for the 
+                      dict of dicts tile graph.  Node names are interned to int
+                      indexes and edge attributes are held in parallel arrays. 
+                      GISEdges are only created for the nodes actually looked up.
+
+- SharedCSRGraph      A CSRGraph in a read-only memory mapped file, so that the
+                      processes of a web server share one copy of each tile.
+
 Hence with all these tweaks the final graph structure is structured along these lines:
 
     CompositeGraph   = [{ 'a':  { 'b' : GISEdge(A-B), 'c': GISEdge(A-C)  },
@@ -57,8 +80,15 @@ CompositeGraph ['c'] = { 'a' : COST1 , 'd': COST2  }
 '''
 
 from heapq import heapify, heappush, heappop
+from itertools import izip
+from array import array
+import os
+import struct
+import sys
+import zlib
 from GraphRepository import GraphRepository
 from apperror import AppError
+import gis
 import utils
 
 
@@ -80,6 +110,9 @@ class EdgeCost (object):
 
     '''
 
+    # no per-instance __dict__, so that subclasses may use __slots__
+    __slots__ = ( 'edgeCost', )
+
     def __init__(self, inCost = 100000):
         self.edgeCost = float (inCost)
     
@@ -140,6 +173,188 @@ class GISEdge (EdgeCost):
                                                   self.edgeCost )
 
 
+class GeometryBlob (object):
+
+    '''
+    The WKT of the edges of one tile, joined into one string.  Each edge 
+    keeps a single int, ref, from which its WKT is cut out on request:
+
+        ref = offset << 24 | length
+
+    Build with add () for each edge then close ().
+    '''
+
+    __slots__ = ( 'data', '_parts', '_size' )
+
+    def __init__ (self):
+
+        self.data   = ''
+        self._parts = []
+        self._size  = 0
+
+    def add (self, WKT):
+
+        ref = self._size << 24 | len (WKT)
+        self._parts.append ( WKT )
+        self._size += len (WKT)
+        return ref
+
+    def close (self):
+
+        self.data   = ''.join ( self._parts )
+        self._parts = []
+
+    def getWKT (self, ref):
+
+        offset = ref >> 24
+        return self.data [ offset : offset + ( ref & 0xFFFFFF ) ]
+
+
+class MappedGeometry (object):
+
+    '''
+    The WKT of the edges of one tile in a read-only memory mapped file, 
+    indexed by edge number (the ref of a CompactEdge).  The routing data
+    stays small in the heap; the OS reads in the pages of geometry of 
+    the few edges on a route, and shares them between processes that 
+    map the same file (e.g. gunicorn workers).
+
+    File format (little endian):
+
+        'GEO1', uint32 numEdges, int32 crc32 of all of the WKT
+        offsets   uint32 [numEdges + 1]   into the WKT data
+        WKT data
+
+    '''
+
+    _MAGIC  = 'GEO1'
+    _HEADER = '<4sIi'
+
+    def __init__ (self, filePath):
+
+        import mmap
+
+        fs = open ( filePath, 'rb' )
+        self.data = mmap.mmap ( fs.fileno (), 0, access = mmap.ACCESS_READ )
+        fs.close ()
+
+        magic, self.numEdges, self.crc = struct.unpack_from ( self._HEADER, self.data, 0 )
+        if magic != self._MAGIC:
+            raise IOError ( 'Not a geometry file: %s' %(filePath) )
+
+        self._offsets   = struct.calcsize ( self._HEADER )
+        self._dataStart = self._offsets + 4 * ( self.numEdges + 1 )
+
+    def getWKT (self, ref):
+
+        start, end = struct.unpack_from ( '<II', self.data, self._offsets + 4 * ref )
+        return self.data [ self._dataStart + start : self._dataStart + end ]
+
+    @classmethod
+    def checksum (cls, lstWKT):
+
+        crc = 0
+        for WKT in lstWKT:
+            crc = zlib.crc32 ( WKT, crc )
+        return crc
+
+    @classmethod
+    def write (cls, filePath, lstWKT):
+
+        '''
+        Write the geometry file for lstWKT (edge number -> WKT).  The file
+        is written under a temporary name and renamed, so another process
+        never maps half a file.
+        '''
+
+        offsets = array ( 'I', [0] )
+        for WKT in lstWKT:
+            offsets.append ( offsets [-1] + len (WKT) )
+
+        if sys.byteorder == 'big':
+            offsets.byteswap ()
+
+        tmpPath = '%s.%s.tmp' %( filePath, os.getpid () )
+
+        fs = open ( tmpPath, 'wb' )
+        fs.write ( struct.pack ( cls._HEADER, cls._MAGIC, len (lstWKT), cls.checksum (lstWKT) ) )
+        offsets.tofile ( fs )
+        for WKT in lstWKT:
+            fs.write ( WKT )
+        fs.close ()
+
+        os.rename ( tmpPath, filePath )
+
+    @classmethod
+    def openOrWrite (cls, filePath, lstWKT):
+
+        '''
+        Map the geometry file for lstWKT, (re)writing it first if it is 
+        missing or holds other geometry.
+        '''
+
+        if os.path.exists ( filePath ):
+            try:
+                geometry = cls ( filePath )
+                if geometry.numEdges == len (lstWKT) and geometry.crc == cls.checksum (lstWKT):
+                    return geometry
+            except (IOError, ValueError, struct.error):
+                pass
+
+        cls.write ( filePath, lstWKT )
+        return cls ( filePath )
+
+
+class CompactEdge (EdgeCost):
+
+    ''' 
+
+    A GISEdge in less memory, for tiles with 200,000+ edges.
+
+    - __slots__: no per-instance __dict__
+    - edgeID is made when asked for, not stored
+    - the node names should be the (interned) strings used as graph keys
+    - WKT is only cut out of the tile's GeometryBlob (or MappedGeometry)
+      when asked for, which is for the few edges on a returned route 
+
+    The centroid is kept as numbers as every edge of a tile is looked at 
+    when snapping a point to the nearest road.
+
+    '''
+
+    __slots__ = ( 'sourceNode', 'targetNode', 'lengthKM', 'isToll', 
+                  'CentroidX', 'CentroidY', '_geometry', '_geometryRef' )
+
+    def __init__ (self, sourceNode, targetNode, lengthKM, edgeCost, 
+                        centroidX, centroidY, isToll, geometry, geometryRef ):
+
+        self.edgeCost     = edgeCost
+        self.sourceNode   = sourceNode
+        self.targetNode   = targetNode
+        self.lengthKM     = lengthKM
+        self.isToll       = isToll
+        self.CentroidX    = centroidX
+        self.CentroidY    = centroidY
+        self._geometry    = geometry      # a GeometryBlob or MappedGeometry
+        self._geometryRef = geometryRef
+
+    @property
+    def edgeID (self):
+        return self.sourceNode + "-" + self.targetNode
+
+    @property
+    def originalCost (self):
+        return self.edgeCost
+
+    @property
+    def WKT (self):
+        return self._geometry.getWKT ( self._geometryRef )
+
+    def __str__(self):
+        return "Edge from %s to %s at cost %s " %(self.sourceNode,self.targetNode,\
+                                                  self.edgeCost )
+
+
 # source/credits:
 # http://code.activestate.com/recipes/522995-priority-dict-a-priority-queue-with-updatable-prio/?c=14610
 
@@ -240,6 +455,159 @@ class d_priority_dict (priority_dict):
         return iterfn()
 
 
+class IndexedHeap (object):
+
+    '''
+    Priority queue used by the routing engines in place of priority_dict.
+
+    priority_dict pushes a new heap entry on every update and leaves the
+    old one to be skipped over (or the heap rebuilt) later.  A search 
+    lowers the priority of many nodes, so the heap fills with stale 
+    entries.  Here the position of each key in the heap is kept, so a
+    new priority moves the existing entry up or down in O(log n).
+
+    Supports the parts of the priority_dict interface that the engines 
+    use:  Q[key] = priority,  Q[key],  key in Q,  len (Q),  Q.get (),
+    del Q[key],  Q.smallest () and Q.pop_smallest ().
+    '''
+
+    def __init__ (self):
+
+        self._heap     = []     # heap ordered [priority, key] entries
+        self._position = {}     # { key: index of its entry in self._heap }
+
+    def __len__ (self):
+        return len ( self._heap )
+
+    def __contains__ (self, key):
+        return key in self._position
+
+    def __getitem__ (self, key):
+        return self._heap [ self._position [key] ][0]
+
+    def get (self, key, default = None):
+
+        i = self._position.get ( key )
+        if i is None:
+            return default
+        return self._heap [i][0]
+
+    def __setitem__ (self, key, val):
+
+        heap, position = self._heap, self._position
+
+        i = position.get ( key )
+
+        if i is None:
+            i = len ( heap )
+            entry = [ val, key ]
+            heap.append ( entry )
+
+        else:
+            entry = heap [i]
+            if val >= entry [0]:
+                entry [0] = val
+                self._siftDown ( i )
+                return
+            entry [0] = val
+
+        # sift up (inlined: the engines call this for every edge relaxed)
+        while i > 0:
+            parent = ( i - 1 ) >> 1
+            parentEntry = heap [parent]
+            if parentEntry [0] <= val:
+                break
+            heap [i] = parentEntry
+            position [ parentEntry[1] ] = i
+            i = parent
+
+        heap [i] = entry
+        position [key] = i
+
+    def __delitem__ (self, key):
+
+        heap, position = self._heap, self._position
+
+        i = position.pop ( key )
+        last = heap.pop ()
+
+        if i < len ( heap ):
+            heap [i] = last
+            position [ last[1] ] = i
+            self._siftDown ( i )
+            self._siftUp ( position [ last[1] ] )
+
+    def smallest (self):
+
+        '''
+        Return the key with the lowest priority.  Raises IndexError if empty.
+        '''
+
+        return self._heap [0][1]
+
+    def pop_smallest (self):
+
+        '''
+        Return the key with the lowest priority and remove it.
+        Raises IndexError if empty.
+        '''
+
+        heap = self._heap
+
+        entry = heap [0]
+        del self._position [ entry[1] ]
+
+        last = heap.pop ()
+        if heap:
+            heap [0] = last
+            self._siftDown ( 0 )
+
+        return entry [1]
+
+    def _siftDown (self, i):
+
+        heap, position = self._heap, self._position
+
+        n     = len ( heap )
+        entry = heap [i]
+        val   = entry [0]
+
+        child = 2 * i + 1
+        while child < n:
+            childEntry = heap [child]
+            if child + 1 < n and heap [child + 1][0] < childEntry [0]:
+                child += 1
+                childEntry = heap [child]
+            if val <= childEntry [0]:
+                break
+            heap [i] = childEntry
+            position [ childEntry[1] ] = i
+            i = child
+            child = 2 * i + 1
+
+        heap [i]  = entry
+        position [ entry[1] ] = i
+
+    def _siftUp (self, i):
+
+        heap, position = self._heap, self._position
+
+        entry = heap [i]
+        val   = entry [0]
+
+        while i > 0:
+            parent = ( i - 1 ) >> 1
+            parentEntry = heap [parent]
+            if parentEntry [0] <= val:
+                break
+            heap [i] = parentEntry
+            position [ parentEntry[1] ] = i
+            i = parent
+
+        heap [i] = entry
+        position [ entry[1] ] = i
+
+
 class CompositeGraph (dict):
     
     '''
@@ -271,6 +639,9 @@ class CompositeGraph (dict):
    
         self.GraphRepository = GraphRepository
 
+        # for Instrumentation: number of lookups
+        self.lookups = 0
+
     def __getitem__(self, key):
 
         '''
@@ -293,28 +664,39 @@ class CompositeGraph (dict):
            necessary to return a graph that includes the values of
            all child graphs.
 
+        The GraphRepository merges these once, as tiles are added or 
+        removed, into GraphRepository.adjacency.  So a lookup is a single 
+        dict access, except for nodes of tiles that are not dicts (e.g. 
+        CSRGraph), which are asked in turn.  The result must not be 
+        modified.
+
         '''
  
-        lstAvailableGraphs = []
-        lstAvailableGraphs = self.GraphRepository.getGraphs ()
+        self.lookups += 1
 
-        lstResults = []
+        try:
+            return self.GraphRepository.adjacency [key]
+        except KeyError:
+            pass
 
-        for eachGraph in lstAvailableGraphs:
-            # create a list of (key,val) tuples
+        for eachGraph in self.GraphRepository.lazyGraphs.itervalues ():
             if key in eachGraph:
+                return eachGraph [key]
 
-                dictResult = eachGraph[key]
-                lstResults =lstResults + \
-                           [(akey,val) for akey,val in dictResult.iteritems()]
+        print "failed to find key %s " %(key)
+        raise AppError (utils.timestampStr (), 'DataStructures.DynamicGraph', \
+                        'Failed to find key "%s" in CompositeGraph:' %(key), 'AppError' )
 
-        if len (lstResults) == 0:
-            print "failed to find key %s " %(key)
-            raise AppError (utils.timestampStr (), 'DataStructures.DynamicGraph', \
-                            'Failed to find key "%s" in CompositeGraph:' %(key), 'AppError' )
+    def __contains__(self, key):
 
-        # note: the next line will flatten out any duplicates.
-        return dict ( lstResults ) # generate dict from key/val pairs
+        if key in self.GraphRepository.adjacency:
+            return True
+
+        for eachGraph in self.GraphRepository.lazyGraphs.itervalues ():
+            if key in eachGraph:
+                return True
+
+        return False
 
     def __setitem__(self, key, val):
         '''
@@ -323,3 +705,795 @@ class CompositeGraph (dict):
         pass
  
 
+
+class TileGraphView (CompositeGraph):
+
+    '''
+    A CompositeGraph that only sees the tiles named in lstTileIDs, e.g.
+    the bounding set of a query, and not the other tiles cached by the 
+    GraphRepository for earlier requests.  A search can not leave these 
+    tiles.
+
+    A node is looked up in GraphRepository.adjacency, as for the 
+    CompositeGraph, and kept if GraphRepository.nodeTiles puts it in 
+    one of the view's tiles.  Nodes on a tile border are given only 
+    their neighbours inside the view, merged once per view.  Nodes of 
+    tiles that are not dicts (e.g. CSRGraph) are looked for in the 
+    view's tiles of that kind.
+
+    tilesRead is the set of the tile IDs that lookups have read from, 
+    for the query statistics.
+
+    '''
+
+    def __init__ (self, GraphRepository, lstTileIDs ):
+
+        CompositeGraph.__init__ ( self, GraphRepository )
+
+        self.tileIDs = set ( [ str (t) for t in lstTileIDs ] )
+        self.lazyGraphs = [ ( t, GraphRepository.lazyGraphs [t] ) for t in self.tileIDs \
+                            if t in GraphRepository.lazyGraphs ]
+
+        self.borderNodes = {}
+        self.tilesRead   = set ()
+
+    def addTiles (self, lstTileIDs):
+
+        '''
+        Let the view see the tiles in lstTileIDs too, e.g. those a search
+        loads as it reaches them
+        '''
+
+        for t in lstTileIDs:
+            t = str (t)
+            if t in self.tileIDs:
+                continue
+            self.tileIDs.add ( t )
+            if t in self.GraphRepository.lazyGraphs:
+                self.lazyGraphs.append ( ( t, self.GraphRepository.lazyGraphs [t] ) )
+
+        # border nodes may have neighbours in the new tiles
+        self.borderNodes.clear ()
+
+    def __getitem__(self, key):
+
+        self.lookups += 1
+
+        nbrs = self.borderNodes.get ( key )
+        if nbrs is not None:
+            return nbrs
+
+        tileIDs = self.GraphRepository.sharedNodes.get ( key )
+
+        if tileIDs is None:
+
+            tileID = self.GraphRepository.nodeTiles.get ( key )
+            if tileID in self.tileIDs:
+                self.tilesRead.add ( tileID )
+                return self.GraphRepository.adjacency [key]
+
+            for tileID, eachGraph in self.lazyGraphs:
+                if key in eachGraph:
+                    self.tilesRead.add ( tileID )
+                    return eachGraph [key]
+
+        else:
+            inView = [ t for t in tileIDs if t in self.tileIDs ]
+            if inView:
+                nbrs = {}
+                for t in inView:
+                    nbrs.update ( dict.__getitem__ ( self.GraphRepository, t ) [key] )
+                self.borderNodes [key] = nbrs
+                self.tilesRead.update ( inView )
+                return nbrs
+
+        print "failed to find key %s " %(key)
+        raise AppError (utils.timestampStr (), 'DataStructures.TileGraphView', \
+                        'Failed to find key "%s" in TileGraphView:' %(key), 'AppError' )
+
+    def __contains__(self, key):
+
+        tileIDs = self.GraphRepository.sharedNodes.get ( key )
+
+        if tileIDs is not None:
+            return len ( [ t for t in tileIDs if t in self.tileIDs ] ) > 0
+
+        if self.GraphRepository.nodeTiles.get ( key ) in self.tileIDs:
+            return True
+
+        for tileID, eachGraph in self.lazyGraphs:
+            if key in eachGraph:
+                return True
+
+        return False
+
+
+class CSRGraph (object):
+
+    '''
+    Read-only graph in compressed sparse row form.  The arcs leaving 
+    node index i are  targets [ offsets[i] : offsets[i+1] ]  with costs 
+    in the same positions of costs. 
+
+    nodes       index -> node name
+    nodeIndex   node name -> index (int32 in the arrays)
+    offsets     array ('i') of len (nodes) + 1
+    targets     array ('i') target node index of each arc
+    costs       array ('d') cost of each arc
+    edgeRefs    array ('i') row of the edge table for each arc
+
+    The edge table holds one row per road (both directions of a road 
+    share a row): source and target index, length, toll flag, centroid 
+    and WKT geometry.
+
+    The graph answers the same mapping protocol as a dict of dicts
+    (G [node] -> { target: GISEdge }) so that the routing algorithms, 
+    CompositeGraph and GraphRepository run on it unchanged.  The GISEdges 
+    are created on each lookup from the arrays.
+
+    '''
+
+    def __init__ (self):
+
+        self.nodes     = []
+        self.nodeIndex = {}
+
+        self.offsets   = array ( 'i', [0] )
+        self.targets   = array ( 'i' )
+        self.costs     = array ( 'd' )
+        self.edgeRefs  = array ( 'i' )
+
+        # edge table
+        self.edgeSource = array ( 'i' )
+        self.edgeTarget = array ( 'i' )
+        self.lengthKM   = array ( 'd' )
+        self.isToll     = array ( 'b' )
+        self.centroidX  = array ( 'd' )
+        self.centroidY  = array ( 'd' )
+        self.WKT        = []
+
+    @classmethod
+    def fromEdges (cls, edges):
+
+        '''
+        Build from an iterable of GISEdges, each of which is added in 
+        both directions (as DataStore.loadEdgeGraphForTile does)
+        '''
+
+        graph = cls ()
+        arcs  = []
+
+        for edge in edges:
+            ref = graph._addEdge ( edge )
+            s = graph.edgeSource [ref]
+            t = graph.edgeTarget [ref]
+            cost = edge.getCost ()
+            arcs.append ( (s, t, cost, ref) )
+            arcs.append ( (t, s, cost, ref) )
+
+        graph._setArcs ( arcs )
+
+        return graph
+
+    @classmethod
+    def fromGraph (cls, aGraph):
+
+        '''
+        Build from a dict of dicts graph of GISEdges
+        '''
+
+        graph = cls ()
+        arcs  = []
+        refs  = {}     # id (GISEdge) -> edge table row
+
+        for v, neighbours in aGraph.iteritems ():
+            for w, edge in neighbours.iteritems ():
+                if id (edge) not in refs:
+                    refs [id (edge)] = graph._addEdge ( edge )
+                arcs.append ( ( graph._intern (v), graph._intern (w),
+                                edge.getCost (), refs [id (edge)] ) )
+
+        graph._setArcs ( arcs )
+
+        return graph
+
+    def _intern (self, node):
+
+        i = self.nodeIndex.get ( node )
+        if i is None:
+            i = len ( self.nodes )
+            self.nodes.append ( node )
+            self.nodeIndex [node] = i
+        return i
+
+    def _addEdge (self, edge):
+
+        self.edgeSource.append ( self._intern ( edge.sourceNode ) )
+        self.edgeTarget.append ( self._intern ( edge.targetNode ) )
+        self.lengthKM.append   ( edge.lengthKM )
+        self.isToll.append     ( int ( bool ( edge.isToll ) ) )
+        self.centroidX.append  ( edge.CentroidX )
+        self.centroidY.append  ( edge.CentroidY )
+        self.WKT.append        ( edge.WKT )
+
+        return len ( self.WKT ) - 1
+
+    def _setArcs (self, arcs):
+
+        '''
+        @arcs list of (source index, target index, cost, edge row)
+        '''
+
+        arcs.sort ()
+
+        counts = [0] * len ( self.nodes )
+        for s, t, cost, ref in arcs:
+            counts [s] += 1
+            self.targets.append  ( t )
+            self.costs.append    ( cost )
+            self.edgeRefs.append ( ref )
+
+        total = 0
+        for c in counts:
+            total += c
+            self.offsets.append ( total )
+
+    def getEdge (self, ref, cost):
+
+        '''
+        Create the GISEdge for edge table row ref, with cost (e.g. for 
+        arc: edgeRefs [arc], costs [arc])
+        '''
+
+        edge = GISEdge.__new__ ( GISEdge )
+
+        edge.edgeCost     = cost
+        edge.originalCost = cost
+        edge.sourceNode   = self.nodes [ self.edgeSource [ref] ]
+        edge.targetNode   = self.nodes [ self.edgeTarget [ref] ]
+        edge.edgeID       = edge.sourceNode + '-' + edge.targetNode
+        edge.WKT          = self.WKT [ref]
+        edge.lengthKM     = self.lengthKM [ref]
+        edge.CentroidX    = self.centroidX [ref]
+        edge.CentroidY    = self.centroidY [ref]
+        edge.isToll       = bool ( self.isToll [ref] )
+
+        return edge
+
+    def getWKT (self, ref):
+
+        '''
+        WKT of edge table row ref (so that CompactEdges can keep their 
+        geometry here)
+        '''
+
+        return self.WKT [ref]
+
+    def __len__ (self):
+        return len ( self.nodes )
+
+    def __contains__ (self, node):
+        return node in self.nodeIndex
+
+    def __iter__ (self):
+        return iter ( self.nodes )
+
+    def iterkeys (self):
+        return iter ( self.nodes )
+
+    def keys (self):
+        return list ( self.nodes )
+
+    def __getitem__ (self, node):
+
+        i = self.nodeIndex [node]   # KeyError, as a dict
+
+        result = {}
+        for arc in xrange ( self.offsets[i], self.offsets[i+1] ):
+            result [ self.nodes [ self.targets[arc] ] ] = \
+                self.getEdge ( self.edgeRefs[arc], self.costs[arc] )
+
+        return result
+
+    def iteritems (self):
+        for node in self.nodes:
+            yield node, self[node]
+
+    def itervalues (self):
+        for node in self.nodes:
+            yield self[node]
+
+    def closestEdge (self, X, Y):
+
+        '''
+        The edge whose centroid is closest to (X, Y).  Used by 
+        gis.Locator.closestEdgeInGraph, without creating every GISEdge.
+        '''
+
+        closest = None
+        maxDist = 10000000000
+
+        for ref in xrange ( len ( self.WKT ) ):
+            dist = gis._pythagorasDistance ( X, Y, self.centroidX[ref], self.centroidY[ref] )
+            if dist < maxDist:
+                maxDist = dist
+                closest = ref
+
+        if closest is None:
+            return None
+
+        # cost of the forward arc of this edge
+        s = self.edgeSource [closest]
+        for arc in xrange ( self.offsets[s], self.offsets[s+1] ):
+            if self.edgeRefs [arc] == closest:
+                return self.getEdge ( closest, self.costs[arc] )
+
+        return None
+
+    def nbytes (self):
+
+        '''
+        Approximate memory held by the arrays (excluding node names and WKT)
+        '''
+
+        return sum ( [ a.itemsize * len (a) for a in
+                       ( self.offsets, self.targets, self.costs, self.edgeRefs,
+                         self.edgeSource, self.edgeTarget, self.lengthKM, 
+                         self.isToll, self.centroidX, self.centroidY ) ] )
+
+
+class _MappedArray (object):
+
+    '''
+    Read-only array of length numbers packed (little endian, struct 
+    format fmt) in data from offset.  Indexed like an array.array.
+    '''
+
+    def __init__ (self, data, offset, fmt, length):
+
+        self.data   = data
+        self.offset = offset
+        self.length = length
+
+        packing      = struct.Struct ( '<' + fmt )
+        self.size    = packing.size
+        self._unpack = packing.unpack_from
+
+    def __len__ (self):
+        return self.length
+
+    def __getitem__ (self, i):
+
+        if not 0 <= i < self.length:
+            raise IndexError ( i )
+        return self._unpack ( self.data, self.offset + i * self.size ) [0]
+
+    def nbytes (self):
+        return self.size * self.length
+
+
+_UNPACK_PAIR = struct.Struct ( '<II' ).unpack_from
+
+class _MappedStrings (object):
+
+    '''
+    Read-only list of count strings in data from offset:
+    uint32 offsets [count + 1] into the string bytes, then the bytes
+    '''
+
+    def __init__ (self, data, offset, count):
+
+        self.data   = data
+        self.offset = offset
+        self.count  = count
+        self.base   = offset + 4 * ( count + 1 )
+
+    def __len__ (self):
+        return self.count
+
+    def __getitem__ (self, i):
+
+        if not 0 <= i < self.count:
+            raise IndexError ( i )
+        start, end = _UNPACK_PAIR ( self.data, self.offset + 4 * i )
+        return self.data [ self.base + start : self.base + end ]
+
+    def __iter__ (self):
+        for i in xrange ( self.count ):
+            yield self [i]
+
+    def nbytes (self):
+        return self.base - self.offset + _UNPACK_PAIR ( self.data, self.offset + 4 * self.count ) [0]
+
+    def toList (self):
+
+        '''
+        All the strings as a list, the offsets unpacked with one call
+        '''
+
+        starts = struct.unpack_from ( '<%sI' %( self.count + 1 ), self.data, self.offset )
+        blob   = self.data [ self.base : self.base + starts [-1] ]
+
+        return [ blob [ starts [i] : starts [i + 1] ] for i in xrange ( self.count ) ]
+
+    @classmethod
+    def pack (cls, lstStrings):
+
+        starts = array ( 'I', [0] )
+        for aString in lstStrings:
+            starts.append ( starts [-1] + len (aString) )
+
+        if sys.byteorder == 'big':
+            starts.byteswap ()
+
+        return starts.tostring () + ''.join ( lstStrings )
+
+
+class _MappedNodeIndex (object):
+
+    '''
+    node name -> index, by an open addressing hash table in the mapped
+    file (table: node index or -1, at zlib.crc32 (name) & mask, and the
+    slots after it), so that the index is shared too rather than a dict
+    in each process
+    '''
+
+    def __init__ (self, nodes, table):
+
+        self.nodes  = nodes
+        self.table  = table
+        self.mask   = len ( table ) - 1
+
+    def get (self, node, default = None):
+
+        table = self.table
+        nodes = self.nodes
+        mask  = self.mask
+
+        slot = zlib.crc32 ( node ) & mask
+
+        while True:
+            i = table [slot]
+            if i < 0:
+                return default
+            if nodes [i] == node:
+                return i
+            slot = ( slot + 1 ) & mask
+
+    def __getitem__ (self, node):
+
+        i = self.get ( node )
+        if i is None:
+            raise KeyError ( node )
+        return i
+
+    def __contains__ (self, node):
+        return self.get ( node ) is not None
+
+    @classmethod
+    def build (cls, nodes):
+
+        '''
+        The hash table (array ('i')) for the list of names nodes: a power 
+        of two at least twice as long
+        '''
+
+        size = 2
+        while size < 2 * len ( nodes ):
+            size *= 2
+
+        mask  = size - 1
+        table = array ( 'i', [-1] ) * size
+
+        for i, node in enumerate ( nodes ):
+            slot = zlib.crc32 ( node ) & mask
+            while table [slot] >= 0:
+                slot = ( slot + 1 ) & mask
+            table [slot] = i
+
+        return table
+
+
+class SharedCSRGraph (CSRGraph):
+
+    '''
+    A CSRGraph in a read-only memory mapped file rather than the heap.  
+    Processes that map the same file (e.g. gunicorn workers) share one 
+    physical copy of the tile in the page cache, and as nothing in it is 
+    a Python object, reference counting never copies its pages.  
+
+    The file is also the compiled tile format (see TileCompiler), which 
+    a DataStore.CompiledDataStore fetches in one read.  fromBytes reads 
+    it from a string, and toCSRGraph unpacks it into a CSRGraph in bulk.
+
+    Each lookup unpacks the few records it needs and returns CompactEdges
+    whose WKT is only cut out of the file when asked for.
+
+    File format (little endian):
+
+        'CSR1', uint16 version, uint16 0, int32 numNodes, int32 numArcs, 
+        int32 numEdges, int32 tableSize, int32 source crc32
+        offsets    int32 [numNodes + 1]      arcs of node i are 
+                                             offsets[i] .. offsets[i+1]
+        arcs       [numArcs] of   int32 target node, float64 cost, 
+                                  int32 edge row
+        edges      [numEdges] of  int32 source node, int32 target node,
+                                  float64 lengthKM, float64 centroidX, 
+                                  float64 centroidY, int8 isToll
+        nodeHash   int32 [tableSize]         hash table of the node names
+                                             (see _MappedNodeIndex)
+        nodes      strings [numNodes]        (see _MappedStrings)
+        WKT        strings [numEdges]
+
+    sourceCRC is a checksum of whatever the graph was built from (e.g. 
+    the tile's text), for the loader to tell whether the file is current.
+
+    '''
+
+    _MAGIC   = 'CSR1'
+    _HEADER  = '<4sHHiiiii'
+    VERSION  = 1
+
+    _ARC     = struct.Struct ( '<idi' )
+    _EDGE    = struct.Struct ( '<iidddb' )
+
+    isShared = True
+
+    def __init__ (self, filePath):
+
+        import mmap
+
+        fs = open ( filePath, 'rb' )
+        try:
+            self.data = mmap.mmap ( fs.fileno (), 0, access = mmap.ACCESS_READ )
+        finally:
+            fs.close ()
+
+        self.filePath = filePath
+        self._mapSections ( self.data )
+
+    @classmethod
+    def fromBytes (cls, data):
+
+        '''
+        The graph in the string data (the contents of a file), unmapped
+        '''
+
+        graph = cls.__new__ ( cls )
+        graph.data     = data
+        graph.filePath = None
+        graph._mapSections ( data )
+        return graph
+
+    def toCSRGraph (self):
+
+        '''
+        A CSRGraph in the heap with the same contents, each section 
+        unpacked with one call
+        '''
+
+        graph = CSRGraph ()
+        data  = self.data
+
+        graph.offsets = array ( 'i', struct.unpack_from ( '<%si' %( len ( self.offsets ) ), 
+                                                          data, self.offsets.offset ) )
+
+        arcs = struct.unpack_from ( '<' + 'idi' * self.numArcs, data, self._arcsStart )
+        graph.targets  = array ( 'i', arcs [0::3] )
+        graph.costs    = array ( 'd', arcs [1::3] )
+        graph.edgeRefs = array ( 'i', arcs [2::3] )
+
+        edges = struct.unpack_from ( '<' + 'iidddb' * self.numEdges, data, self._edgesStart )
+        graph.edgeSource = array ( 'i', edges [0::6] )
+        graph.edgeTarget = array ( 'i', edges [1::6] )
+        graph.lengthKM   = array ( 'd', edges [2::6] )
+        graph.centroidX  = array ( 'd', edges [3::6] )
+        graph.centroidY  = array ( 'd', edges [4::6] )
+        graph.isToll     = array ( 'b', edges [5::6] )
+
+        graph.nodes     = self.nodes.toList ()
+        graph.nodeIndex = dict ( izip ( graph.nodes, xrange ( len ( graph.nodes ) ) ) )
+        graph.WKT       = self.WKT.toList ()
+
+        return graph
+
+    def _mapSections (self, data):
+
+        header = struct.unpack_from ( self._HEADER, data, 0 )
+        magic, version, unused, numNodes, numArcs, numEdges, tableSize, self.sourceCRC = header
+
+        if magic != self._MAGIC:
+            raise IOError ( 'Not a graph file: %s' %( getattr ( self, 'filePath', '' ) ) )
+        if version != self.VERSION:
+            raise IOError ( 'Graph file version %s, not %s' %( version, self.VERSION ) )
+
+        self.numArcs  = numArcs
+        self.numEdges = numEdges
+
+        offset = struct.calcsize ( self._HEADER )
+
+        self.offsets = _MappedArray ( data, offset, 'i', numNodes + 1 )
+        offset += self.offsets.nbytes ()
+
+        self._arcsStart = offset
+        offset += self._ARC.size * numArcs
+
+        self._edgesStart = offset
+        offset += self._EDGE.size * numEdges
+
+        self.nodeHash = _MappedArray ( data, offset, 'i', tableSize )
+        offset += self.nodeHash.nbytes ()
+
+        self.nodes = _MappedStrings ( data, offset, numNodes )
+        offset += self.nodes.nbytes ()
+
+        self.WKT = _MappedStrings ( data, offset, numEdges )
+        offset += self.WKT.nbytes ()
+
+        if offset != len ( data ):
+            raise IOError ( 'Graph file is %s bytes, not %s' %( len (data), offset ) )
+
+        self.nodeIndex = _MappedNodeIndex ( self.nodes, self.nodeHash )
+
+    def getEdge (self, ref, cost):
+
+        source, target, lengthKM, centroidX, centroidY, isToll = \
+            self._EDGE.unpack_from ( self.data, self._edgesStart + self._EDGE.size * ref )
+
+        return CompactEdge ( self.nodes [source], self.nodes [target], lengthKM, cost, 
+                             centroidX, centroidY, bool ( isToll ), self, ref )
+
+    def __getitem__ (self, node):
+
+        i = self.nodeIndex [node]   # KeyError, as a dict
+
+        data      = self.data
+        nodes     = self.nodes
+        unpackArc = self._ARC.unpack_from
+        arcSize   = self._ARC.size
+        arcsStart = self._arcsStart
+
+        start, end = struct.unpack_from ( '<ii', data, self.offsets.offset + 4 * i )
+
+        result = {}
+        for arc in xrange ( start, end ):
+            target, cost, ref = unpackArc ( data, arcsStart + arcSize * arc )
+            result [ nodes [target] ] = self.getEdge ( ref, cost )
+
+        return result
+
+    def closestEdge (self, X, Y):
+
+        closest = None
+        maxDist = 10000000000
+
+        unpackEdge = self._EDGE.unpack_from
+        edgeSize   = self._EDGE.size
+
+        for ref in xrange ( self.numEdges ):
+            centroidX, centroidY = unpackEdge ( self.data, self._edgesStart + edgeSize * ref ) [3:5]
+            dist = gis._pythagorasDistance ( X, Y, centroidX, centroidY )
+            if dist < maxDist:
+                maxDist = dist
+                closest = ref
+
+        if closest is None:
+            return None
+
+        # cost of the forward arc of this edge
+        s = self._EDGE.unpack_from ( self.data, self._edgesStart + edgeSize * closest ) [0]
+        for arc in xrange ( self.offsets[s], self.offsets[s+1] ):
+            target, cost, ref = self._ARC.unpack_from ( self.data, 
+                                                        self._arcsStart + self._ARC.size * arc )
+            if ref == closest:
+                return self.getEdge ( closest, cost )
+
+        return None
+
+    def keys (self):
+        return list ( self.nodes )
+
+    def nbytes (self):
+
+        '''
+        Heap memory held by the arrays: none, they are mapped
+        '''
+
+        return 0
+
+    @classmethod
+    def pack (cls, graph, sourceCRC = 0):
+
+        '''
+        The bytes of the file for CSRGraph graph
+        '''
+
+        numNodes = len ( graph.nodes )
+        numArcs  = len ( graph.targets )
+        numEdges = len ( graph.WKT )
+
+        nodeHash = _MappedNodeIndex.build ( graph.nodes )
+
+        offsets = array ( 'i', graph.offsets )
+
+        if sys.byteorder == 'big':
+            offsets.byteswap ()
+            nodeHash.byteswap ()
+
+        parts = [ struct.pack ( cls._HEADER, cls._MAGIC, cls.VERSION, 0, numNodes, 
+                                numArcs, numEdges, len ( nodeHash ), sourceCRC ),
+                  offsets.tostring () ]
+
+        for arc in xrange ( numArcs ):
+            parts.append ( cls._ARC.pack ( graph.targets [arc], graph.costs [arc], 
+                                           graph.edgeRefs [arc] ) )
+
+        for ref in xrange ( numEdges ):
+            parts.append ( cls._EDGE.pack ( graph.edgeSource [ref], graph.edgeTarget [ref],
+                                            graph.lengthKM [ref], graph.centroidX [ref],
+                                            graph.centroidY [ref], graph.isToll [ref] ) )
+
+        parts.append ( nodeHash.tostring () )
+        parts.append ( _MappedStrings.pack ( graph.nodes ) )
+        parts.append ( _MappedStrings.pack ( graph.WKT ) )
+
+        return ''.join ( parts )
+
+    @classmethod
+    def withSourceCRC (cls, data, sourceCRC):
+
+        '''
+        The bytes of a file (from pack) with its sourceCRC replaced
+        '''
+
+        header = list ( struct.unpack_from ( cls._HEADER, data, 0 ) )
+        header [-1] = sourceCRC
+
+        return struct.pack ( cls._HEADER, *header ) + data [ struct.calcsize ( cls._HEADER ): ]
+
+    @classmethod
+    def write (cls, filePath, graph, sourceCRC = 0):
+
+        '''
+        Write the file for CSRGraph graph.  It is written under a 
+        temporary name and renamed, so another process never maps half 
+        a file.
+        '''
+
+        cls.writeBytes ( filePath, cls.pack ( graph, sourceCRC ) )
+
+    @classmethod
+    def writeBytes (cls, filePath, data):
+
+        '''
+        Write data (from pack) to filePath, as write
+        '''
+
+        tmpPath = '%s.%s.tmp' %( filePath, os.getpid () )
+
+        fs = open ( tmpPath, 'wb' )
+        fs.write ( data )
+        fs.close ()
+
+        os.rename ( tmpPath, filePath )
+
+    @classmethod
+    def openFile (cls, filePath, sourceCRC = None):
+
+        '''
+        Map the file, or None if it is missing, of another version or 
+        damaged, or (if sourceCRC is given) built from another source
+        '''
+
+        if not os.path.exists ( filePath ):
+            return None
+
+        try:
+            graph = cls ( filePath )
+        except (IOError, ValueError, struct.error, EnvironmentError):
+            return None
+
+        if sourceCRC is not None and graph.sourceCRC != sourceCRC:
+            return None
+
+        return graph
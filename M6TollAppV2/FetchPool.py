@@ -0,0 +1,147 @@
+
+'''
+
+A fixed number of threads that fetch tiles (or do any other blocking
+work) for requests, so that the tiles of a query are downloaded at the
+same time rather than one after another.
+
+Fetching a tile is mostly waiting on S3, which releases the GIL, so the
+threads overlap well.  Parsing the tiles does not, but a route's cold
+start costs about one round trip rather than one per tile.
+
+The pool is bounded: however many requests arrive, no more than
+numThreads fetches run at once.  The rest queue.
+
+Classes/functions in this module are:
+
+- FetchPool      Threads that run lists of functions, with a time limit
+
+- getFetchPool   The process wide FetchPool (env TOLL_FETCH_THREADS
+                 threads, default 8)
+
+'''
+
+import os
+import Queue
+import threading
+import time
+
+from apperror import AppError
+import utils
+
+
+FETCH_THREADS = int ( os.environ.get ( 'TOLL_FETCH_THREADS', '8' ) )
+
+
+class _Batch (object):
+
+    '''
+    The functions given to one FetchPool.runAll, and their results
+    '''
+
+    def __init__ (self, numFunctions):
+
+        self.lock      = threading.Lock ()
+        self.remaining = numFunctions
+        self.results   = [ None ] * numFunctions
+        self.error     = None
+        self.done      = threading.Event ()
+
+        if numFunctions == 0:
+            self.done.set ()
+
+    def run (self, i, function):
+
+        try:
+            result = function ()
+        except Exception as e:
+            result = None
+            self.lock.acquire ()
+            if self.error is None:
+                self.error = e
+            self.lock.release ()
+
+        self.lock.acquire ()
+        try:
+            self.results [i] = result
+            self.remaining  -= 1
+            if self.remaining == 0:
+                self.done.set ()
+        finally:
+            self.lock.release ()
+
+
+class FetchPool (object):
+
+    '''
+    numThreads  most functions run at once
+    tasks       queue of (batch, index, function) waiting for a thread
+
+    The threads are started on first use, and are daemons so that they
+    do not keep the process alive.
+    '''
+
+    def __init__ (self, numThreads = FETCH_THREADS):
+
+        self.numThreads = max ( 1, numThreads )
+        self.tasks      = Queue.Queue ()
+        self.threads    = []
+        self.lock       = threading.Lock ()
+
+    def _start (self):
+
+        self.lock.acquire ()
+        try:
+            while len ( self.threads ) < self.numThreads:
+                t = threading.Thread ( target = self._work,
+                                       name = 'FetchPool-%s' %( len ( self.threads ) ) )
+                t.daemon = True
+                t.start ()
+                self.threads.append ( t )
+        finally:
+            self.lock.release ()
+
+    def _work (self):
+
+        while True:
+            batch, i, function = self.tasks.get ()
+            batch.run ( i, function )
+
+    def runAll (self, lstFunctions, timeoutSecs = None):
+
+        '''
+        Call each of lstFunctions () on the pool's threads, and return
+        their results in order once all have finished.
+
+        If any raises, the first exception is raised here (after all have
+        finished).  If they have not all finished within timeoutSecs an
+        AppError is raised; those still running carry on in the
+        background.
+        '''
+
+        if len ( self.threads ) < self.numThreads:
+            self._start ()
+
+        batch = _Batch ( len ( lstFunctions ) )
+
+        for i, function in enumerate ( lstFunctions ):
+            self.tasks.put ( ( batch, i, function ) )
+
+        startTime = time.time ()
+
+        if not batch.done.wait ( timeoutSecs ):
+            raise AppError (utils.timestampStr (), 'FetchPool', \
+                            '%s of %s fetches not done after %.1f secs' %(
+                            batch.remaining, len ( lstFunctions ),
+                            time.time () - startTime ), None )
+
+        if batch.error is not None:
+            raise batch.error
+
+        return batch.results
+
+
+aFetchPool = FetchPool ()
+
+def getFetchPool ():
+    return aFetchPool
@@ -6,12 +6,52 @@ the program.
 Rather than instantiate GraphCache directly use getGraphCache ()
 to access the singleton.
 
+The repository also keeps a stitched adjacency of all of its tiles
+(see GraphRepository.adjacency), which DataStructures.CompositeGraph 
+reads.
+
+The memory used by each tile graph is estimated (estimateGraphBytes) 
+as it is added, so that the repository can be held to a byte budget 
+(GraphRepository.setMemoryBudget) rather than a number of tiles: a 
+dense urban tile can be ten times the size of a rural one.
+
+When a tile is added past the budget, tiles are evicted at once, in the
+order chosen by the repository's eviction policy:
+
+- LRUPolicy     least recently used first
+
+- ARCPolicy     adaptive replacement cache: balances tiles used once 
+                recently against tiles used repeatedly, learning from 
+                the tiles it evicted too early
+
+- GDSFPolicy    greedy dual size frequency: keeps tiles that are used 
+                often, were slow to load and are small
+
+Set the policy of the shared repository with env TOLL_EVICTION_POLICY
+('lru', 'arc' or 'gdsf').  GraphRepository.cacheStats gives the hits,
+misses and evictions.
+
+The repository may be shared by the threads of a web server.  Changes
+to it are made under its lock, and GraphRepository.loadTile loads each 
+missing tile once however many requests want it at the same time.
+
 '''
 
+import os
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+
 from gis import Tile
 from apperror import AppError
 
 
+# Edges measured by estimateGraphBytes; the rest are assumed alike
+SIZE_SAMPLE = 200
+
+
 class GraphRepository (dict):
 
     '''
@@ -27,10 +67,42 @@ class GraphRepository (dict):
     If a tile is not available the RoutingFacade can use the DataStore
     to download the required tile and then add it to the Repository
     >  GraphRepository [aTile] = downloadedGraph 
+    or, where several threads may want the tile, let the repository 
+    call the download once for all of them
+    >  GraphRepository.loadTile ( aTile, downloadFunction )
+
+    adjacency    { node: { node: edge } } over all of the tiles, kept up to 
+                 date as tiles are added and removed.  A node in one tile 
+                 maps to that tile's own dict (no copy); a node on a 
+                 tile border, in several tiles, maps to a merged dict.
+                 Do not modify.
+    sharedNodes  { node: [tileID, ..] } for the nodes in more than one tile
+    nodeTiles    { node: tileID } for the other nodes of dict tiles, so 
+                 that a DataStructures.TileGraphView can tell which tile 
+                 a node in adjacency is from
+    lazyGraphs   { tileID: graph } for tiles that are not dicts of dicts
+                 (e.g. DataStructures.CSRGraph, which builds each node's 
+                 dict on lookup).  Only their shared nodes are in adjacency.
+    tileBytes    { tileID: estimated bytes of its graph }
+    totalBytes   sum of tileBytes
+    maxBytes     byte budget for the graphs (None: no limit)
+    maxRSSBytes  limit on the resident memory of the process (None: not 
+                 checked)
+    rssTarget    lowered byte target while the resident memory is over 
+                 maxRSSBytes (None: not lowered), see _byteTarget
+    rssAtTarget  the resident memory when rssTarget was last lowered
+    policy       the EvictionPolicy
+    pinCounts    { tileID: count } of tiles in use, which are not evicted 
+                 (see pin)
+    hits, misses, evictions, evictedBytes, coalesced
+                 counters for cacheStats
+    lock         held while the repository is changed (re-entrant)
+    loading      { tileID: _TileLoad } for the tiles being loaded by 
+                 loadTile
 
     '''
 
-    def __init__ (self, lstImmutableTiles ):
+    def __init__ (self, lstImmutableTiles, policy = None ):
 
         '''
         Add a list of Tiles that should be preserved when the 
@@ -42,11 +114,39 @@ class GraphRepository (dict):
         Note: cannot construct this with GraphRepository ( [] ) 
         unless __init__ is upgraded.
 
+        @policy  an EvictionPolicy.  Default LRUPolicy.
+
         '''
 
         self.lstImmutableTiles = [str(st) for st in lstImmutableTiles]
         self.accessFrequency = {}
 
+        self.adjacency   = {}
+        self.sharedNodes = {}
+        self.nodeTiles   = {}
+        self.lazyGraphs  = {}
+
+        self.tileBytes   = {}
+        self.totalBytes  = 0
+        self.maxBytes    = None
+        self.maxRSSBytes = None
+        self.rssTarget   = None
+        self.rssAtTarget = None
+
+        if policy is None:
+            policy = LRUPolicy ()
+        self.policy    = policy
+        self.pinCounts = {}
+
+        self.hits         = 0
+        self.misses       = 0
+        self.evictions    = 0
+        self.evictedBytes = 0
+        self.coalesced    = 0
+
+        self.lock    = threading.RLock ()
+        self.loading = {}
+
  
     def __getitem__(self, key):
 
@@ -66,10 +166,14 @@ class GraphRepository (dict):
             raise AppError (utils.timestampStr (), 'GraphRepository', \
                             'Tile with key: %s not found in GraphRepository' %(keyStr), e )
 
-        if keyStr in self.accessFrequency:
-           self.accessFrequency [keyStr] = self.accessFrequency [keyStr] + 1
-        else:
-           self.accessFrequency [keyStr] = 1
+        with self.lock:
+            if keyStr in self.accessFrequency:
+               self.accessFrequency [keyStr] = self.accessFrequency [keyStr] + 1
+            else:
+               self.accessFrequency [keyStr] = 1
+
+            self.policy.accessed ( keyStr )
+
         return val
 
     def __setitem__(self, key, val):
@@ -78,13 +182,237 @@ class GraphRepository (dict):
         Anticipate that the key may be a Tile object
         '''
 
-        dict.__setitem__(self, str(key), val)
-        self.accessFrequency.setdefault ( str(key) , 0 ) 
+        self.addTile ( key, val )
+
+    def addTile (self, key, val, loadSecs = None):
+
+        '''
+        Add (or replace) a tile graph, then evict other tiles if this 
+        takes the repository over its memory budget.
+
+        @loadSecs  time taken to load the tile, if known, for policies
+                   that keep tiles that are slow to load (GDSFPolicy)
+        '''
+
+        keyStr = str (key)
+
+        # measured before taking the lock
+        nbytes = estimateGraphBytes ( val )
+
+        with self.lock:
+
+            if dict.__contains__ ( self, keyStr ):
+                self._unstitch ( keyStr, dict.__getitem__ ( self, keyStr ) )
+                self.policy.removed ( keyStr )
+
+            dict.__setitem__(self, keyStr, val)
+            self.accessFrequency.setdefault ( keyStr , 0 ) 
+
+            self._stitch ( keyStr, val, nbytes )
+
+            self.policy.inserted ( keyStr, nbytes, loadSecs )
+
+            self.enforceBudget ( [ keyStr ] )
+
+    def loadTile (self, key, loadFunction):
+
+        '''
+        Return the graph of a tile, calling loadFunction () to load it
+        (then addTile) if it is not held.
+
+        If other threads ask for the same tile while it is being loaded,
+        they wait for that load and are given the same graph (or the 
+        same exception), rather than loading it again.  Tiles are loaded 
+        outside the lock, so different tiles load at the same time.
+        '''
+
+        keyStr = str (key)
+
+        with self.lock:
+
+            if dict.__contains__ ( self, keyStr ):
+                self.hits += 1
+                self.policy.accessed ( keyStr )
+                return dict.__getitem__ ( self, keyStr )
+
+            aLoad = self.loading.get ( keyStr )
+
+            if aLoad is None:
+                self.misses += 1
+                aLoad = _TileLoad ()
+                self.loading [keyStr] = aLoad
+                isLoader = True
+            else:
+                self.coalesced += 1
+                isLoader = False
+
+        if not isLoader:
+            return aLoad.wait ()
+
+        try:
+            startTime = time.time ()
+            graph = loadFunction ()
+            self.addTile ( keyStr, graph, time.time () - startTime )
+            aLoad.graph = graph
+        except Exception as e:
+            aLoad.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.loading [keyStr]
+            aLoad.done.set ()
+
+        return graph
 
     def __delitem__(self, key):
         keyStr = str (key)
-        self.accessFrequency.pop ( keyStr, None)
-        return dict.__delitem__(self, self.__keytransform__(keyStr))
+        with self.lock:
+            self.accessFrequency.pop ( keyStr, None)
+            self._unstitch ( keyStr, dict.__getitem__ ( self, keyStr ) )
+            self.policy.removed ( keyStr )
+            return dict.__delitem__(self, keyStr)
+
+    def pop (self, key, *default):
+
+        '''
+        As dict.pop, keeping the adjacency up to date
+        '''
+
+        keyStr = str (key)
+
+        with self.lock:
+
+            if not dict.__contains__ ( self, keyStr ):
+                if default:
+                    return default [0]
+                raise KeyError ( keyStr )
+
+            val = dict.__getitem__ ( self, keyStr )
+            del self [keyStr]
+            return val
+
+    def popitem (self):
+
+        with self.lock:
+            keyStr, val = dict.popitem (self)
+            self.accessFrequency.pop ( keyStr, None)
+            self._unstitch ( keyStr, val )
+            self.policy.removed ( keyStr )
+            return keyStr, val
+
+    def clear (self):
+
+        with self.lock:
+            dict.clear (self)
+            self.accessFrequency.clear ()
+            self.adjacency.clear ()
+            self.sharedNodes.clear ()
+            self.nodeTiles.clear ()
+            self.lazyGraphs.clear ()
+            self.tileBytes.clear ()
+            self.totalBytes = 0
+            self.policy.clear ()
+
+    def update (self, *args, **kwargs):
+
+        for key, val in dict ( *args, **kwargs ).iteritems ():
+            self [key] = val
+
+    def setdefault (self, key, val = None):
+
+        with self.lock:
+            if str (key) not in self:
+                self [key] = val
+            return dict.__getitem__ ( self, str (key) )
+
+    def _stitch (self, keyStr, graph, nbytes):
+
+        '''
+        Add the nodes of a newly added tile graph to the adjacency
+        '''
+
+        adjacency   = self.adjacency
+        sharedNodes = self.sharedNodes
+        nodeTiles   = self.nodeTiles
+
+        self.tileBytes [keyStr] = nbytes
+        self.totalBytes += nbytes
+
+        otherLazyGraphs = self.lazyGraphs.values ()
+
+        isLazy = not isinstance ( graph, dict )
+        if isLazy:
+            self.lazyGraphs [keyStr] = graph
+
+        for v in graph.iterkeys ():
+
+            if v in sharedNodes:
+                sharedNodes [v].append ( keyStr )
+                adjacency [v] = self._merge ( v )
+
+            elif v in adjacency or \
+                 ( otherLazyGraphs and [ g for g in otherLazyGraphs if v in g ] ):
+
+                # first time on a tile border: find the tile(s) holding it.  
+                # Few nodes are, so the scan is cheap.
+                sharedNodes [v] = [ tileID for tileID, g in dict.iteritems (self) \
+                                    if v in g ]
+                nodeTiles.pop ( v, None )
+                adjacency [v] = self._merge ( v )
+
+            elif not isLazy:
+                adjacency [v] = graph [v]
+                nodeTiles [v] = keyStr
+
+    def _unstitch (self, keyStr, graph):
+
+        '''
+        Remove the nodes of a tile graph that is about to be removed 
+        from the adjacency
+        '''
+
+        adjacency   = self.adjacency
+        sharedNodes = self.sharedNodes
+        nodeTiles   = self.nodeTiles
+
+        self.lazyGraphs.pop ( keyStr, None )
+        self.totalBytes -= self.tileBytes.pop ( keyStr, 0 )
+
+        for v in graph.iterkeys ():
+
+            tileIDs = sharedNodes.get ( v )
+
+            if tileIDs is None:
+                adjacency.pop ( v, None )
+                nodeTiles.pop ( v, None )
+                continue
+
+            if keyStr in tileIDs:
+                tileIDs.remove ( keyStr )
+
+            if len ( tileIDs ) > 1:
+                adjacency [v] = self._merge ( v )
+                continue
+
+            del sharedNodes [v]
+            adjacency.pop ( v, None )
+
+            if tileIDs:
+                remaining = dict.__getitem__ ( self, tileIDs[0] )
+                if isinstance ( remaining, dict ):
+                    adjacency [v] = remaining [v]
+                    nodeTiles [v] = tileIDs[0]
+
+    def _merge (self, v):
+
+        '''
+        A new dict of the neighbours of shared node v in all of its tiles
+        '''
+
+        merged = {}
+        for tileID in self.sharedNodes [v]:
+            merged.update ( dict.__getitem__ ( self, tileID ) [v] )
+        return merged
 
     def getKeys (self):
         '''
@@ -123,12 +451,94 @@ class GraphRepository (dict):
 
         return lst
 
+    def lookupTile (self, key):
+
+        '''
+        True if the tile is held.  Counted as a cache hit or miss, and 
+        as a use of the tile by the eviction policy.
+        '''
+
+        keyStr = str (key)
+
+        with self.lock:
+
+            if dict.__contains__ ( self, keyStr ):
+                self.hits += 1
+                self.policy.accessed ( keyStr )
+                return True
+
+            self.misses += 1
+            return False
+
+    def pin (self, lstKeys):
+
+        '''
+        Do not evict these tiles (e.g. while a query uses them) until 
+        they are unpinned.  Pins are counted, so that overlapping queries
+        can pin the same tile.
+        '''
+
+        with self.lock:
+            for key in lstKeys:
+                keyStr = str (key)
+                self.pinCounts [keyStr] = self.pinCounts.get ( keyStr, 0 ) + 1
+
+    def unpin (self, lstKeys):
+
+        with self.lock:
+            for key in lstKeys:
+                keyStr = str (key)
+                count = self.pinCounts.get ( keyStr, 0 ) - 1
+                if count > 0:
+                    self.pinCounts [keyStr] = count
+                else:
+                    self.pinCounts.pop ( keyStr, None )
+
+    def pinned (self, lstKeys):
+
+        '''
+        Pin tiles for the length of a with block, e.g. a query's search:
+
+            with graphRepository.pinned ( tileSet ):
+                ...
+        '''
+
+        return _Pins ( self, [ str (key) for key in lstKeys ] )
+
+    def cacheStats (self):
+
+        '''
+        { 'policy', 'tiles', 'totalBytes', 'maxBytes', 'hits', 'misses', 
+          'hitRate', 'coalesced', 'evictions', 'evictedBytes' }
+
+        coalesced: requests that waited for another's load of a tile
+        '''
+
+        with self.lock:
+
+            lookups = self.hits + self.misses
+
+            hitRate = None
+            if lookups:
+                hitRate = float ( self.hits ) / lookups
+
+            return { 'policy'      : self.policy.name,
+                     'tiles'       : len (self),
+                     'totalBytes'  : self.totalBytes,
+                     'maxBytes'    : self.maxBytes,
+                     'hits'        : self.hits,
+                     'misses'      : self.misses,
+                     'hitRate'     : hitRate,
+                     'coalesced'   : self.coalesced,
+                     'evictions'   : self.evictions,
+                     'evictedBytes': self.evictedBytes }
+
     def trim (self, maxTiles):
 
         '''
 
-        Trim the cache back down to size, by removing the 
-        least used tiles.
+        Trim the cache back down to size, by evicting tiles 
+        in the order of the eviction policy.
 
         '''
 
@@ -137,17 +547,529 @@ class GraphRepository (dict):
         if ( maxTiles < numTilesToKeep) : 
             return
 
-        availList = [(self.accessFrequency[aKey],aKey,)  \
-                    for aKey in self if aKey not in self.lstImmutableTiles  ]
+        with self.lock:
+            self._evict ( (), lambda: len (self) > maxTiles )
+
+    def setMemoryBudget (self, maxBytes, maxRSSBytes = None):
+
+        '''
+        @maxBytes     most bytes (estimated) of tile graphs to hold
+        @maxRSSBytes  optional: also keep the resident memory of the 
+                      process below this, where it can be read (Linux)
+        '''
+
+        self.maxBytes    = maxBytes
+        self.maxRSSBytes = maxRSSBytes
+        self.rssTarget   = None
+        self.rssAtTarget = None
+
+        self.policy.setCapacity ( maxBytes )
+
+    def overBudget (self):
+
+        '''
+        True if the tile graphs are over maxBytes.  The resident memory
+        only lowers the target that tiles are evicted down to (see 
+        _byteTarget): it stays high after tiles are freed, so it can 
+        not tell whether the tiles a query needs fit.
+        '''
+
+        return self.maxBytes is not None and self.totalBytes > self.maxBytes
+
+    def enforceBudget (self, lstKeep = ()):
+
+        '''
+        Evict tiles, other than the immutable and pinned tiles and those 
+        in lstKeep, until the repository is within its memory budget 
+        (_byteTarget).
+
+        Returns False if the tiles that must be kept are over maxBytes 
+        by themselves.
+        '''
+
+        with self.lock:
+
+            target = self._byteTarget ()
+            if target is not None:
+                self._evict ( lstKeep, lambda: self.totalBytes > target )
+
+            return not self.overBudget ()
 
-        sortedKeys = sorted ( availList , reverse=True  ) 
+    def _byteTarget (self):
 
-        while ( numTilesToKeep +  len ( sortedKeys ) > maxTiles ):
+        '''
+        The bytes of tile graphs to evict down to: maxBytes, lowered 
+        while the resident memory of the process is over maxRSSBytes.
+
+        The first time the resident memory is over, the target becomes
+        totalBytes less the overshoot.  Freed memory is not always 
+        returned to the system, so the resident memory may stay over: 
+        the target is then only lowered again by as much as it grows, 
+        and is lifted when it falls back under maxRSSBytes.
+        '''
+
+        if self.maxRSSBytes is not None:
+
+            rss = currentRSSBytes ()
+
+            if rss is None or rss <= self.maxRSSBytes:
+                self.rssTarget = None
 
-            poppedKey = sortedKeys.pop () [1]
+            elif self.rssTarget is None:
+                self.rssTarget   = max ( 0, self.totalBytes - ( rss - self.maxRSSBytes ) )
+                self.rssAtTarget = rss
+
+            elif rss > self.rssAtTarget:
+                self.rssTarget   = max ( 0, self.rssTarget - ( rss - self.rssAtTarget ) )
+                self.rssAtTarget = rss
+
+        if self.rssTarget is None:
+            return self.maxBytes
+        if self.maxBytes is None:
+            return self.rssTarget
+        return min ( self.maxBytes, self.rssTarget )
+
+    def _evict (self, lstKeep, isOver):
+
+        '''
+        Evict tiles chosen by the policy while isOver () is True.  
+        Returns False if only tiles that must be kept are left.
+        '''
+
+        keep = set ( self.lstImmutableTiles ) | set ( self.pinCounts ) | \
+               set ( [ str (k) for k in lstKeep ] )
+
+        candidates = set ( [ aKey for aKey in self if aKey not in keep ] )
+
+        while isOver ():
+
+            if not candidates:
+                return False
+
+            poppedKey = self.policy.victim ( candidates )
+            candidates.discard ( poppedKey )
+
+            print "evicting tile %s (%s bytes)" %( poppedKey, self.tileBytes.get ( poppedKey ) )
+
+            self.evictions    += 1
+            self.evictedBytes += self.tileBytes.get ( poppedKey, 0 )
             self.pop ( poppedKey, None )
 
+        return True
+
+
+class _TileLoad (object):
+
+    '''
+    A load of one tile by GraphRepository.loadTile, for other threads
+    to wait on
+    '''
+
+    def __init__ (self):
+
+        self.done  = threading.Event ()
+        self.graph = None
+        self.error = None
+
+    def wait (self):
+
+        self.done.wait ()
+
+        if self.error is not None:
+            raise self.error
+        return self.graph
+
+
+class _Pins (object):
+
+    def __init__ (self, graphRepository, lstKeys):
+        self.graphRepository = graphRepository
+        self.lstKeys         = lstKeys
+
+    def __enter__ (self):
+        self.graphRepository.pin ( self.lstKeys )
+        return self
+
+    def __exit__ (self, excType, excValue, tb):
+        self.graphRepository.unpin ( self.lstKeys )
+        return False
+
+
+class EvictionPolicy (object):
+
+    '''
+    The order in which a GraphRepository evicts its tiles.  The 
+    repository tells the policy of each tile added, used and removed,
+    and asks it which of the tiles that may be evicted should go next.
+    '''
+
+    name = None
+
+    def setCapacity (self, maxBytes):
+        pass
+
+    def inserted (self, key, nbytes, loadSecs):
+
+        '''
+
+        Virtual method - override this in subclasses
+
+        Tile key, of nbytes, has been added after a load of loadSecs
+
+        '''
+
+        pass
+
+    def accessed (self, key):
+
+        '''
+
+        Virtual method - override this in subclasses
+
+        Tile key has been used
+
+        '''
+
+        pass
+
+    def removed (self, key):
+
+        '''
+
+        Virtual method - override this in subclasses
+
+        Tile key has been removed from the repository
+
+        '''
+
+        pass
+
+    def victim (self, candidates):
+
+        '''
+
+        Virtual method - override this in subclasses
+
+        The tile to evict next, one of the set candidates
+
+        '''
+
+        pass
+
+    def clear (self):
+
+        '''
+
+        Virtual method - override this in subclasses
+
+        Forget every tile
+
+        '''
+
+        pass
+
+
+class LRUPolicy (EvictionPolicy):
+
+    '''
+    Least recently used first
+    '''
+
+    name = 'lru'
+
+    def __init__ (self):
+        self.recency = OrderedDict ()
+
+    def inserted (self, key, nbytes, loadSecs):
+        self.recency.pop ( key, None )
+        self.recency [key] = True
+
+    def accessed (self, key):
+        if self.recency.pop ( key, None ):
+            self.recency [key] = True
+
+    def removed (self, key):
+        self.recency.pop ( key, None )
+
+    def victim (self, candidates):
+
+        for key in self.recency:
+            if key in candidates:
+                return key
+
+        return iter ( candidates ).next ()
+
+    def clear (self):
+        self.recency.clear ()
+
+
+class ARCPolicy (EvictionPolicy):
+
+    '''
+    Adaptive replacement cache (Megiddo and Modha), in bytes:
+
+    recent    tiles used once since they were loaded, LRU first
+    frequent  tiles used more than once, LRU first
+    ghostRecent, ghostFrequent 
+              { tileID: bytes } of tiles recently evicted from each list
+
+    targetRecent, the bytes the recent list should hold, grows when a 
+    tile evicted from it is loaded again, and shrinks when a tile 
+    evicted from the frequent list is.  So a scan over many tiles, each 
+    used once, does not push out the tiles used every day.
+    '''
+
+    name = 'arc'
+
+    def __init__ (self, capacity = None):
+
+        self.capacity = capacity
+        self.clear ()
+
+    def setCapacity (self, maxBytes):
+        self.capacity = maxBytes
+
+    def clear (self):
+
+        self.recent        = OrderedDict ()
+        self.frequent      = OrderedDict ()
+        self.ghostRecent   = OrderedDict ()
+        self.ghostFrequent = OrderedDict ()
+        self.nbytes        = {}
+        self.targetRecent  = 0
+
+    def _capacity (self):
+
+        if self.capacity is not None:
+            return self.capacity
+        return sum ( self.nbytes.itervalues () )
+
+    def inserted (self, key, nbytes, loadSecs):
+
+        self.nbytes [key] = nbytes
+
+        ghostRecentBytes   = sum ( self.ghostRecent.itervalues () )
+        ghostFrequentBytes = sum ( self.ghostFrequent.itervalues () )
+
+        if key in self.ghostRecent:
+            # evicted from recent too soon: give recent more room
+            delta = max ( ghostFrequentBytes / max ( ghostRecentBytes, 1 ), 1 ) * nbytes
+            self.targetRecent = min ( self._capacity (), self.targetRecent + delta )
+            del self.ghostRecent [key]
+            self.frequent [key] = True
+
+        elif key in self.ghostFrequent:
+            # evicted from frequent too soon: give frequent more room
+            delta = max ( ghostRecentBytes / max ( ghostFrequentBytes, 1 ), 1 ) * nbytes
+            self.targetRecent = max ( 0, self.targetRecent - delta )
+            del self.ghostFrequent [key]
+            self.frequent [key] = True
+
+        else:
+            self.recent [key] = True
+
+    def accessed (self, key):
+
+        if self.recent.pop ( key, None ) or self.frequent.pop ( key, None ):
+            self.frequent [key] = True
+
+    def removed (self, key):
+
+        nbytes = self.nbytes.pop ( key, 0 )
+
+        if self.recent.pop ( key, None ):
+            self.ghostRecent [key] = nbytes
+        elif self.frequent.pop ( key, None ):
+            self.ghostFrequent [key] = nbytes
+
+        # remember about as many bytes of evicted tiles as are cached
+        capacity = self._capacity ()
+        for ghost in ( self.ghostRecent, self.ghostFrequent ):
+            while ghost and sum ( ghost.itervalues () ) > capacity:
+                ghost.popitem ( last = False )
+
+    def victim (self, candidates):
+
+        recentBytes = sum ( [ self.nbytes.get ( k, 0 ) for k in self.recent ] )
+
+        if recentBytes > self.targetRecent:
+            lists = [ self.recent, self.frequent ]
+        else:
+            lists = [ self.frequent, self.recent ]
+
+        for tiles in lists:
+            for key in tiles:
+                if key in candidates:
+                    return key
+
+        return iter ( candidates ).next ()
+
+
+class GDSFPolicy (EvictionPolicy):
+
+    '''
+    Greedy dual size frequency (Cherkasova): each tile's priority is
+
+        inflation + uses * loadSecs / bytes
+
+    and the lowest priority tile goes first.  inflation rises to the 
+    priority of each evicted tile, so tiles that were used often long 
+    ago age out.  Tiles with no load time are given DEFAULT_LOAD_SECS.
+    '''
+
+    name = 'gdsf'
+
+    DEFAULT_LOAD_SECS = 1.0
+
+    def __init__ (self):
+        self.clear ()
+
+    def clear (self):
+
+        self.inflation = 0.0
+        self.priority  = {}
+        self.uses      = {}
+        self.weight    = {}
+
+    def inserted (self, key, nbytes, loadSecs):
+
+        if loadSecs is None:
+            loadSecs = self.DEFAULT_LOAD_SECS
+
+        self.uses [key]   = 1
+        self.weight [key] = float ( loadSecs ) / max ( nbytes, 1 )
+        self.priority [key] = self.inflation + self.weight [key]
+
+    def accessed (self, key):
+
+        if key in self.uses:
+            self.uses [key] += 1
+            self.priority [key] = self.inflation + self.uses [key] * self.weight [key]
+
+    def removed (self, key):
+
+        self.uses.pop ( key, None )
+        self.weight.pop ( key, None )
+        self.priority.pop ( key, None )
+
+    def victim (self, candidates):
+
+        key = min ( candidates, key = lambda k: self.priority.get ( k, 0.0 ) )
+        self.inflation = max ( self.inflation, self.priority.get ( key, 0.0 ) )
+        return key
+
+
+EVICTION_POLICIES = { 'lru' : LRUPolicy,
+                      'arc' : ARCPolicy,
+                      'gdsf': GDSFPolicy }
+
+def makeEvictionPolicy ( name ):
+
+    '''
+    A new EvictionPolicy by name: 'lru', 'arc' or 'gdsf'
+    '''
+
+    try:
+        return EVICTION_POLICIES [name] ()
+    except KeyError as e:
+        import utils
+        raise AppError (utils.timestampStr (), 'GraphRepository', \
+                        'Unknown eviction policy: %s' %(name), e )
+
  
+# Edge attributes holding node names, which are counted as graph keys
+_NODE_ATTRIBUTES = ( 'sourceNode', 'targetNode' )
+
+
+def estimateGraphBytes ( graph ):
+
+    '''
+    Estimated memory held by a tile graph: its dicts and node names, and
+    its edges, measured on a sample of SIZE_SAMPLE edges.  Geometry held
+    in one place for the whole tile (GeometryBlob) is counted once; 
+    memory mapped geometry and graphs are not counted.
+    '''
+
+    if getattr ( graph, 'isShared', False ):
+        # SharedCSRGraph: memory mapped, shared with other processes
+        return sys.getsizeof ( graph ) + sys.getsizeof ( graph.__dict__ )
+
+    if not isinstance ( graph, dict ):
+        # CSRGraph
+        total = graph.nbytes () + sys.getsizeof ( graph.nodeIndex )
+        for lst in ( graph.nodes, graph.WKT ):
+            sample = lst [:SIZE_SAMPLE]
+            if sample:
+                total += sys.getsizeof ( lst ) + \
+                         len (lst) * sum ( [ sys.getsizeof (x) for x in sample ] ) / len (sample)
+        return total
+
+    total    = sys.getsizeof ( graph )
+    numArcs  = 0
+    sample   = {}
+
+    for v, neighbours in graph.iteritems ():
+        total += sys.getsizeof ( v ) + sys.getsizeof ( neighbours )
+        if not isinstance ( neighbours, dict ):
+            continue
+        numArcs += len ( neighbours )
+        if len ( sample ) < SIZE_SAMPLE:
+            for edge in neighbours.itervalues ():
+                sample [ id (edge) ] = edge
+
+    if not sample:
+        return total
+
+    edgeBytes = 0
+    shared    = {}
+
+    for edge in sample.itervalues ():
+
+        edgeBytes += sys.getsizeof ( edge )
+
+        if hasattr ( edge, '__dict__' ):
+            items = edge.__dict__.items ()
+            edgeBytes += sys.getsizeof ( edge.__dict__ )
+        else:
+            items = [ ( slot, getattr ( edge, slot, None ) ) for cls in type (edge).__mro__ \
+                      for slot in cls.__dict__.get ( '__slots__', () ) ]
+
+        for name, val in items:
+            if name in _NODE_ATTRIBUTES:
+                # a node name, counted as a key of the graph
+                continue
+            if hasattr ( val, 'getWKT' ):
+                # geometry of the whole tile
+                shared [ id (val) ] = val
+            else:
+                edgeBytes += sys.getsizeof ( val )
+
+    # each edge is in the graph in both directions
+    total += ( numArcs / 2.0 ) * edgeBytes / len ( sample )
+
+    for geometry in shared.itervalues ():
+        if isinstance ( getattr ( geometry, 'data', None ), str ):
+            total += sys.getsizeof ( geometry.data )
+
+    return int ( total )
+
+
+def currentRSSBytes ():
+
+    '''
+    Resident memory of this process now, or None where it can not be read
+    '''
+
+    try:
+        fs = open ( '/proc/self/statm' )
+        pages = int ( fs.read ().split () [1] )
+        fs.close ()
+    except (IOError, ValueError, IndexError):
+        return None
+
+    return pages * os.sysconf ( 'SC_PAGE_SIZE' )
+
+
 class GraphRepositoryFactory (object):
 
     def __init__(self):
@@ -170,7 +1092,8 @@ class GraphRepositoryFactory (object):
 
         return gr
 
-aGraphRepository = GraphRepository ([])
+aGraphRepository = GraphRepository ( [], makeEvictionPolicy ( 
+                                            os.environ.get ( 'TOLL_EVICTION_POLICY', 'lru' ) ) )
 
 def getGraphRepository (  ):
     return aGraphRepository
@@ -0,0 +1,212 @@
+
+'''
+
+Per-query statistics for routing requests, and an optional aggregate
+of them across requests.
+
+A QueryStats object travels with one request.  RoutingFacade times each
+phase of the request with it (snap, tile load, search, path unpack, JSON
+build) and copies in the counters filled by the search (settled nodes per
+direction, heap operations), the CompositeGraph lookups and the number
+of tiles the search read (DataStructures.TileGraphView.tilesRead).
+
+If env TOLL_QUERY_STATS is '1', finished queries are also added to a
+process wide StatsAggregate, shown by the /stats/ page, so that a slow
+down under production load can be seen.
+
+Classes/functions in this module are:
+
+- QueryStats          Counters and phase timings of one query
+
+- StatsAggregate      Totals and latency percentiles over many queries
+
+- getAggregate        The process wide StatsAggregate
+
+- recordQuery         Add a finished query to the aggregate (if enabled)
+
+'''
+
+import os
+import threading
+import time
+
+
+AGGREGATE_ENABLED = os.environ.get ( 'TOLL_QUERY_STATS', '0' ) == '1'
+
+# Timings kept per phase for the percentiles
+MAX_SAMPLES = 1000
+
+
+class _PhaseTimer (object):
+
+    def __init__ (self, queryStats, phase):
+        self.queryStats = queryStats
+        self.phase      = phase
+
+    def __enter__ (self):
+        self.startTime = time.time ()
+        return self
+
+    def __exit__ (self, excType, excValue, tb):
+        self.queryStats.addTime ( self.phase, time.time () - self.startTime )
+        return False
+
+
+class QueryStats (object):
+
+    '''
+    kind      type of query, e.g. 'route'
+    counters  { name: number }, e.g. 'settledForward', 'heapPushes'
+    phases    { phase: seconds }, e.g. 'snap', 'search'
+    info      { name: value } that is not summed, e.g. 'engine'
+
+    Time a phase with
+
+        with queryStats.timer ('search'):
+            ...
+    '''
+
+    def __init__ (self, kind = 'route'):
+
+        self.kind      = kind
+        self.counters  = {}
+        self.phases    = {}
+        self.info      = {}
+        self.startTime = time.time ()
+
+        # tiles of one query are fetched on several threads
+        self.lock      = threading.Lock ()
+
+    def count (self, name, n = 1):
+        with self.lock:
+            self.counters [name] = self.counters.get ( name, 0 ) + n
+
+    def addCounters (self, dictCounters):
+
+        '''
+        Add in the numeric entries of a search's stats dict
+        '''
+
+        for name, n in dictCounters.iteritems ():
+            if isinstance ( n, (int, long, float) ) and not isinstance ( n, bool ):
+                self.count ( name, n )
+
+    def addTime (self, phase, secs):
+        self.phases [phase] = self.phases.get ( phase, 0.0 ) + secs
+
+    def timer (self, phase):
+        return _PhaseTimer ( self, phase )
+
+    def totalSecs (self):
+        return time.time () - self.startTime
+
+    def toDict (self):
+
+        result = {}
+        result ['kind']       = self.kind
+        result ['counters']   = dict ( self.counters )
+        result ['phaseSecs']  = dict ( self.phases )
+        result ['totalSecs']  = self.totalSecs ()
+        result.update ( self.info )
+        return result
+
+
+class StatsAggregate (object):
+
+    '''
+    Totals of the counters, and the mean and percentiles of the last
+    MAX_SAMPLES timings of each phase, per kind of query.  Safe to
+    record from several threads.
+    '''
+
+    def __init__ (self, maxSamples = MAX_SAMPLES):
+
+        self.maxSamples = maxSamples
+        self.lock       = threading.Lock ()
+        self.reset ()
+
+    def reset (self):
+
+        self.startTime = time.time ()
+        self.kinds     = {}
+
+    def record (self, queryStats):
+
+        totalSecs = queryStats.totalSecs ()
+
+        self.lock.acquire ()
+        try:
+            kind = self.kinds.setdefault ( queryStats.kind,
+                       { 'queries': 0, 'counters': {}, 'samples': {} } )
+
+            kind ['queries'] += 1
+
+            for name, n in queryStats.counters.iteritems ():
+                kind ['counters'][name] = kind ['counters'].get ( name, 0 ) + n
+
+            for phase, secs in queryStats.phases.items () + [ ('total', totalSecs) ]:
+                samples = kind ['samples'].setdefault ( phase, [] )
+                samples.append ( secs )
+                if len ( samples ) > self.maxSamples:
+                    del samples [0]
+        finally:
+            self.lock.release ()
+
+    def summary (self):
+
+        '''
+        Returns { 'uptimeSecs': .., kind: { 'queries', 'counters',
+        'meanCounters', 'phaseSecs': { phase: { 'mean', 'p50', 'p95', 'p99' } } } }
+        '''
+
+        self.lock.acquire ()
+        try:
+            result = { 'uptimeSecs': time.time () - self.startTime }
+
+            for kindName, kind in self.kinds.iteritems ():
+
+                queries = kind ['queries']
+
+                phaseSecs = {}
+                for phase, samples in kind ['samples'].iteritems ():
+                    ordered = sorted ( samples )
+                    phaseSecs [phase] = { 'mean': sum (ordered) / len (ordered),
+                                          'p50' : _percentile ( ordered, 50 ),
+                                          'p95' : _percentile ( ordered, 95 ),
+                                          'p99' : _percentile ( ordered, 99 ) }
+
+                result [kindName] = { 'queries'     : queries,
+                                      'counters'    : dict ( kind ['counters'] ),
+                                      'meanCounters': dict ( [ (name, float (n) / queries) \
+                                          for name, n in kind ['counters'].iteritems () ] ),
+                                      'phaseSecs'   : phaseSecs }
+        finally:
+            self.lock.release ()
+
+        return result
+
+
+def _percentile ( ordered, pc ):
+
+    '''
+    Nearest rank percentile of a sorted, non empty list
+    '''
+
+    i = int ( round ( ( len (ordered) - 1 ) * pc / 100.0 ) )
+    return ordered [i]
+
+
+anAggregate = StatsAggregate ()
+
+def getAggregate ():
+    return anAggregate
+
+
+def recordQuery ( queryStats ):
+
+    '''
+    Add a finished query to the aggregate, if TOLL_QUERY_STATS is on
+    '''
+
+    if AGGREGATE_ENABLED:
+        getAggregate ().record ( queryStats )
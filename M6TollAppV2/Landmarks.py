@@ -0,0 +1,319 @@
+
+'''
+
+ALT routing: A*, Landmarks and the Triangle inequality.
+
+A few landmark nodes are chosen at the edge of the network and the
+travel time from each landmark to every node is stored.  For any node v
+and target t the triangle inequality gives a lower bound
+
+    d(v,t) >= | d(L,t) - d(L,v) |
+
+which is a far better A* estimate than a straight line on a motorway
+network.  (The tile graphs hold every road in both directions at the same
+cost, so d(L,v) = d(v,L).)
+
+The bounds stay valid if edge costs rise.  If costs may fall, e.g. toll
+weights are adjusted, by no more than a fraction COST_TOLERANCE, the
+bounds are scaled down by the same fraction and remain valid.
+
+Classes/functions in this module are:
+
+- LandmarkTable       Build, save and load landmark distance tables
+
+- LandmarkHeuristic   algorithms.AStar estimate from a LandmarkTable
+
+- shortestPathALT     Routing engine for RoutingFacade
+
+- getLandmarkTable    Access the table named by env TOLL_LANDMARK_FILE
+
+Build from the command line with:
+
+    python Landmarks.py <edgeFile|s3> <outFile> <numLandmarks> <tileID> [<tileID> ..]
+
+File format (little endian):
+
+    'ALT1', uint32 numLandmarks, uint32 numNodes, uint32 len (nodeIDs)
+    nodeIDs        newline separated node names
+    landmarks      uint32 [numLandmarks]  index of each landmark node
+    distances      float32 [numNodes] for each landmark in turn
+
+'''
+
+import os
+import struct
+from array import array
+
+from DataStructures import IndexedHeap
+from algorithms import shortestPathAStar
+from apperror import AppError
+import utils
+
+
+# Fraction by which edge costs may fall after the tables were built.
+COST_TOLERANCE = 0.02
+
+# Allowance for rounding distances to float32 in the file
+_FLOAT32_ERROR = 1e-6
+
+_MAGIC = 'ALT1'
+_HEADER = '<4sIII'
+
+INFINITY = float ('inf')
+
+
+class LandmarkTable (object):
+
+    '''
+    nodes      list of node names; a node's position is its index
+    nodeIndex  { node: index }
+    landmarks  list of indexes of the landmark nodes
+    distances  list (per landmark) of array ('f') of distance to each node
+    '''
+
+    def __init__ (self, nodes, landmarks, distances):
+
+        self.nodes     = nodes
+        self.nodeIndex = dict ( [ (n, i) for i, n in enumerate (nodes) ] )
+        self.landmarks = landmarks
+        self.distances = distances
+
+    @classmethod
+    def build (cls, lstGraphs, numLandmarks = 8):
+
+        '''
+        @lstGraphs     list of graphs as loadEdgeGraphForTile (), e.g. one
+                       per tile.
+        @numLandmarks  number of landmarks to choose
+
+        Landmarks are chosen 'farthest first': the first is the node
+        farthest from an arbitrary node, each next one is the node
+        farthest from all landmarks chosen so far.  This places them
+        around the edge of the network.
+        '''
+
+        try:
+
+            adjacency = {}
+            for graph in lstGraphs:
+                for v, neighbours in graph.iteritems ():
+                    costs = adjacency.setdefault ( v, {} )
+                    for w, edge in neighbours.iteritems ():
+                        cost = edge.getCost ()
+                        if w not in costs or cost < costs[w]:
+                            costs [w] = cost
+
+            nodes = sorted ( adjacency )
+            if not nodes:
+                raise ValueError ( 'empty graph' )
+
+            table = cls ( nodes, [], [] )
+
+            nearest = _oneToAll ( adjacency, nodes[0] )
+
+            while len ( table.landmarks ) < min ( numLandmarks, len (nodes) ):
+
+                # farthest reachable node from the landmarks so far
+                candidate = max ( [ n for n in nodes if nearest.get (n, INFINITY) < INFINITY ],
+                                  key = lambda n: nearest [n] )
+
+                D = _oneToAll ( adjacency, candidate )
+
+                table.landmarks.append ( table.nodeIndex [candidate] )
+                table.distances.append ( array ( 'f', [ D.get ( n, INFINITY ) for n in nodes ] ) )
+
+                if len ( table.landmarks ) == 1:
+                    nearest = D
+                else:
+                    for n, d in D.iteritems ():
+                        if d < nearest [n]:
+                            nearest [n] = d
+
+        except Exception as e:
+            import traceback
+            utils.logError ( traceback.format_exc() )
+            raise AppError (utils.timestampStr (), 'LandmarkTable', 'build', e )
+
+        return table
+
+    def save (self, filePath):
+
+        try:
+            fs = open ( filePath, 'wb' )
+
+            strNodes = '\n'.join ( self.nodes )
+            fs.write ( struct.pack ( _HEADER, _MAGIC, len (self.landmarks),
+                                     len (self.nodes), len (strNodes) ) )
+            fs.write ( strNodes )
+            _littleEndian ( array ( 'I', self.landmarks ) ).tofile ( fs )
+            for distances in self.distances:
+                _littleEndian ( array ( 'f', distances ) ).tofile ( fs )
+
+            fs.close ()
+
+        except IOError as e:
+            import traceback
+            utils.logError ( traceback.format_exc() )
+            raise AppError (utils.timestampStr (), 'LandmarkTable', 'save %s' %(filePath), e )
+
+    @classmethod
+    def load (cls, filePath):
+
+        try:
+            fs = open ( filePath, 'rb' )
+
+            magic, numLandmarks, numNodes, lenNodes = \
+                struct.unpack ( _HEADER, fs.read ( struct.calcsize (_HEADER) ) )
+
+            if magic != _MAGIC:
+                raise IOError ( 'Not a landmark file: %s' %(filePath) )
+
+            nodes = fs.read ( lenNodes ).split ('\n')
+
+            landmarks = array ( 'I' )
+            landmarks.fromfile ( fs, numLandmarks )
+
+            distances = []
+            for i in range ( numLandmarks ):
+                d = array ( 'f' )
+                d.fromfile ( fs, numNodes )
+                distances.append ( _littleEndian (d) )
+
+            fs.close ()
+
+        except (IOError, EOFError, struct.error) as e:
+            import traceback
+            utils.logError ( traceback.format_exc() )
+            raise AppError (utils.timestampStr (), 'LandmarkTable', 'load %s' %(filePath), e )
+
+        return cls ( nodes, list ( _littleEndian (landmarks) ), distances )
+
+
+class LandmarkHeuristic (object):
+
+    '''
+    Lower bound on the travel time from a node to end, for algorithms.AStar
+    '''
+
+    def __init__ (self, table, end, tolerance = COST_TOLERANCE):
+
+        self.table = table
+        self.scale = 1.0 - tolerance - _FLOAT32_ERROR
+
+        # distance from each landmark to end, skipping any that can not reach it
+        self.toEnd = []
+        if end in table.nodeIndex:
+            t = table.nodeIndex [end]
+            for distances in table.distances:
+                if distances[t] < INFINITY:
+                    self.toEnd.append ( (distances, distances[t]) )
+
+    def estimate (self, node, viaEdge):
+
+        i = self.table.nodeIndex.get ( node )
+        if i is None:
+            return 0.0
+
+        best = 0.0
+        for distances, dEnd in self.toEnd:
+            d = abs ( dEnd - distances[i] )
+            if d > best and d < INFINITY:
+                best = d
+
+        return best * self.scale
+
+
+def _oneToAll (adjacency, source):
+
+    '''
+    Plain Dijkstra over { v: { w: cost } }.  Returns { node: distance }
+    '''
+
+    D = {}
+    Q = IndexedHeap ()
+    Q [source] = 0.0
+
+    while Q:
+        v = Q.smallest ()
+        D [v] = Q [v]
+        Q.pop_smallest ()
+
+        for w, cost in adjacency[v].iteritems ():
+            if w in D:
+                continue
+            dw = D[v] + cost
+            if w not in Q or dw < Q[w]:
+                Q [w] = dw
+
+    return D
+
+
+def _littleEndian (anArray):
+
+    '''
+    The file is little endian; swap (in place) on a big endian machine
+    '''
+
+    import sys
+    if sys.byteorder == 'big':
+        anArray.byteswap ()
+    return anArray
+
+
+aLandmarkTable = None
+
+def getLandmarkTable ():
+
+    '''
+    Load (once) the table saved in the file named by env TOLL_LANDMARK_FILE
+    '''
+
+    global aLandmarkTable
+
+    if aLandmarkTable is None:
+
+        if 'TOLL_LANDMARK_FILE' not in os.environ:
+            raise AppError (utils.timestampStr (), 'Landmarks', \
+                            'TOLL_LANDMARK_FILE not set', None )
+
+        aLandmarkTable = LandmarkTable.load ( os.environ ['TOLL_LANDMARK_FILE'] )
+
+    return aLandmarkTable
+
+
+def shortestPathALT (G, start, end, stats = None):
+
+    '''
+    Routing engine with the signature of algorithms.shortestPath2
+    '''
+
+    heuristic = LandmarkHeuristic ( getLandmarkTable (), end )
+
+    return shortestPathAStar ( G, start, end, stats, heuristic )
+
+
+if __name__ == "__main__":
+
+    import sys
+    from gis import Locator
+    from DataStore import FileDataStore, AWS_S3DataStore
+
+    if len ( sys.argv ) < 5:
+        print "usage: python Landmarks.py <edgeFile|s3> <outFile> <numLandmarks> <tileID> [<tileID> ..]"
+        sys.exit (1)
+
+    if sys.argv[1] == 's3':
+        dataStore = AWS_S3DataStore ()
+    else:
+        dataStore = FileDataStore ( sys.argv[1] )
+
+    lstGraphs = []
+    for tileID in sys.argv[4:]:
+        print "loading tile %s" %(tileID)
+        lstGraphs.append ( dataStore.loadEdgeGraphForTile ( Locator.getTileFromID ( tileID ) ) )
+
+    print "choosing landmarks"
+    table = LandmarkTable.build ( lstGraphs, int ( sys.argv[3] ) )
+
+    print "landmarks: %s" %( ', '.join ( [ table.nodes[i] for i in table.landmarks ] ) )
+    table.save ( sys.argv[2] )
@@ -9,46 +9,256 @@ purpose of this module is to take this job away from the UI controller.
  
 '''
 
-from DataStore       import AWS_S3DataStore
-from DataStructures  import GISEdge, CompositeGraph
-from algorithms      import shortestPath2
+from DataStore       import AWS_S3DataStore, AWS_S3CompiledDataStore
+from DataStore       import makeCachingDataStore, TILE_CACHE_BYTES
+from DataStructures  import GISEdge, CompositeGraph, TileGraphView
+from algorithms      import shortestPath2, shortestPathAStar, oneToMany
+from algorithms      import reachableWithin, alternativeRoutes
+from algorithms      import tollAndTollFreePaths
+from ContractionHierarchy import shortestPathCH, getContractionHierarchy
+from Landmarks       import shortestPathALT
 from gis             import Locator, Tile
+from apperror        import AppError
+from Instrumentation import QueryStats, recordQuery
+from FetchPool       import getFetchPool
 import gis
+import math
+import os
+import utils
 
 import GraphRepository
 
 
-def _missingTiles ( graphRepository, tileList ):
+# Routing searches selectable in findRoute (engine = ...).  Each takes 
+# (graph, startNode, endNode, stats) and returns a list of GISEdges.
+ROUTING_ENGINES = { 'dijkstra' : shortestPath2,
+                    'astar'    : shortestPathAStar,
+                    'alt'      : shortestPathALT,
+                    'ch'       : shortestPathCH }
+
+# Engines that route over preprocessed data covering the whole network,
+# so only the tiles needed to locate the start and end are loaded.
+PREPROCESSED_ENGINES = [ 'ch' ]
+
+# Engines that findMatrix can use, and how it uses them: 'buckets' is the
+# bucket based many-to-many search of the contraction hierarchy,
+# 'oneToMany' one Dijkstra search per origin over the tile graph.  Goal
+# directed engines (astar, alt) aim at one target so have no matrix form.
+MATRIX_ENGINES = { 'ch'       : 'buckets',
+                   'dijkstra' : 'oneToMany' }
+
+# 'dict' (dict of dicts of GISEdges), 'compact' (dict of dicts of
+# DataStructures.CompactEdges, smaller and as fast to search), 'mapped'
+# (as 'compact' with the geometry in memory mapped files, see 
+# DataStore.GEOMETRY_DIR), 'csr' (DataStructures.CSRGraph, smaller 
+# but slower to search) or 'shared' (DataStructures.SharedCSRGraph, a 
+# CSRGraph in memory mapped files in DataStore.SHARED_GRAPH_DIR that all
+# worker processes share, slower again)
+TILE_GRAPH_FORMAT = os.environ.get ( 'TOLL_GRAPH_FORMAT', 'dict' )
+
+# 'text' (the '|' delimited tiles) or 'compiled' (tiles compiled by 
+# TileCompiler, loaded with one read each) in S3, when no dataStore is
+# given.  They are cached on local disk (DataStore.CachingDataStore) 
+# unless env TOLL_TILE_CACHE_MB is 0.
+TILE_SOURCE = os.environ.get ( 'TOLL_TILE_SOURCE', 'text' )
+
+# Memory allowed for the tile graphs (see GraphRepository.setMemoryBudget),
+# and optionally for the whole process
+MEMORY_BUDGET_BYTES = int ( float ( os.environ.get ( 'TOLL_TILE_BUDGET_MB', '256' ) ) * 1024 * 1024 )
+
+if os.environ.get ( 'TOLL_RSS_LIMIT_MB' ):
+    RSS_LIMIT_BYTES = int ( float ( os.environ ['TOLL_RSS_LIMIT_MB'] ) * 1024 * 1024 )
+else:
+    RSS_LIMIT_BYTES = None
+
+GraphRepository.getGraphRepository ().setMemoryBudget ( MEMORY_BUDGET_BYTES, RSS_LIMIT_BYTES )
+
+# Degrees around the rectangle of a query's end points that its search 
+# may use (see gis.Locator.getTileCorridorSet).  0: only the tiles of 
+# the bounding set.
+CORRIDOR_MARGIN_DEG = float ( os.environ.get ( 'TOLL_CORRIDOR_MARGIN', '0' ) )
+
+# Longest a request waits for its tiles to be fetched (FetchPool)
+FETCH_TIMEOUT_SECS = float ( os.environ.get ( 'TOLL_FETCH_TIMEOUT', '30' ) )
+
+
+_aDefaultDataStore = None
+
+def getDefaultDataStore ():
 
     '''
-    Search the repository for tileList and return 
-    a sub list not in the repository
+    The S3 DataStore for TILE_SOURCE, behind the disk cache
     '''
-    l = []
 
-    for thisTile in tileList:
-        if thisTile.getID () not in graphRepository:
-            l.append (l)
- 
-    return l
+    global _aDefaultDataStore
+
+    if _aDefaultDataStore is None:
+
+        if TILE_SOURCE == 'compiled':
+            dataStore = AWS_S3CompiledDataStore ()
+        else:
+            dataStore = AWS_S3DataStore ()
+
+        if TILE_CACHE_BYTES > 0:
+            dataStore = makeCachingDataStore ( dataStore )
+
+        _aDefaultDataStore = dataStore
+
+    return _aDefaultDataStore
+
+
+def _loadTileGraph ( dataStore, aTile, queryStats = None ):
+
+    '''
+    Load the graph for aTile in the format given by TILE_GRAPH_FORMAT
+    '''
+
+    if queryStats is not None:
+        queryStats.count ( 'tilesLoaded' )
+
+    if TILE_GRAPH_FORMAT == 'csr':
+        return dataStore.loadCSRGraphForTile ( aTile )
+
+    if TILE_GRAPH_FORMAT == 'compact':
+        return dataStore.loadCompactGraphForTile ( aTile )
+
+    if TILE_GRAPH_FORMAT == 'mapped':
+        return dataStore.loadMappedGraphForTile ( aTile )
+
+    if TILE_GRAPH_FORMAT == 'shared':
+        return dataStore.loadSharedGraphForTile ( aTile )
+
+    return dataStore.loadEdgeGraphForTile ( aTile )
+
+
+def _getTile ( graphRepositoryRef, dataStore, aTile, queryStats = None ):
+
+    '''
+    The graph of aTile from the repository, loaded from dataStore if it
+    is not there.  Concurrent requests for a missing tile share one load
+    (GraphRepository.loadTile).
+    '''
+
+    def load ():
+        print "getting tile: %s" %(aTile.getID() )
+        return _loadTileGraph ( dataStore, aTile, queryStats )
+
+    return graphRepositoryRef.loadTile ( aTile, load )
         
 
 
-def findRoute ( X1, Y1, X2, Y2 ):
+def _snapToRoad ( graphRepositoryRef, dataStore, X, Y, queryStats = None ):
+
+    '''
+    Return the GISEdge closest to (X, Y), loading its tile if necessary
+    '''
+
+    aTile = Locator.getTileFromCoords ( X, Y )
+
+    graph = _getTile ( graphRepositoryRef, dataStore, aTile, queryStats )
+
+    return Locator.closestEdgeInGraph ( X, Y, graph )
+
+
+def _queryTileSet ( X1, Y1, X2, Y2 ):
+
+    '''
+    The tiles a search between two points may use: their bounding set,
+    widened by CORRIDOR_MARGIN_DEG.  The search only sees these tiles
+    (DataStructures.TileGraphView), whatever else is cached.
+    '''
+
+    if CORRIDOR_MARGIN_DEG > 0:
+        return Locator.getTileCorridorSet ( X1, Y1, X2, Y2, CORRIDOR_MARGIN_DEG )
+
+    return Locator.getTileBoundingSet ( X1, Y1, X2, Y2 )
+
+
+def _loadTileSet ( graphRepositoryRef, dataStore, tileSet, queryStats = None ):
+
+    '''
+    Load the tiles in tileSet that are not already in the repository.
+    Missing tiles are fetched at the same time, on the FetchPool, so 
+    that a cold start costs about one fetch rather than one per tile.
+    A store that can read several tiles in one pass (withTiles, e.g. 
+    DataStore.FileDataStore) reads the missing tiles that way first.
+    Tiles being loaded for another request are waited for, not loaded
+    again.  Raises an AppError if the tiles are not all loaded within
+    FETCH_TIMEOUT_SECS.
+
+    As each tile is added, the repository evicts others to stay within
+    MEMORY_BUDGET_BYTES (and RSS_LIMIT_BYTES).  The tiles in tileSet 
+    are pinned while they load so that they are not evicted; pin any 
+    other tiles the query is using for the length of the query.
+
+    Returns False if the tiles to be kept do not fit in the budget.
+    '''
+
+    # each tile once
+    tiles = dict ( [ ( aTile.getID (), aTile ) for aTile in tileSet ] ).values ()
+
+    lstKeep = [ aTile.getID () for aTile in tiles ]
+
+    graphRepositoryRef.pin ( lstKeep )
+    try:
+        if len ( tiles ) == 1:
+            _getTile ( graphRepositoryRef, dataStore, tiles [0], queryStats )
+        else:
+            missing = [ aTile for aTile in tiles if aTile.getID () not in graphRepositoryRef ]
+            if len ( missing ) > 1 and hasattr ( dataStore, 'withTiles' ):
+                dataStore = dataStore.withTiles ( missing )
+
+            getFetchPool ().runAll ( [ _tileGetter ( graphRepositoryRef, dataStore, aTile, queryStats ) \
+                                       for aTile in tiles ], FETCH_TIMEOUT_SECS )
+
+        if graphRepositoryRef.overBudget ():
+            print "Memory allowance exceeded"
+            return False
+    finally:
+        graphRepositoryRef.unpin ( lstKeep )
+
+    return True
+
+
+def _tileGetter ( graphRepositoryRef, dataStore, aTile, queryStats ):
+
+    '''
+    A function of no arguments that gets aTile, for the FetchPool
+    '''
+
+    return lambda: _getTile ( graphRepositoryRef, dataStore, aTile, queryStats )
+
+
+def findRoute ( X1, Y1, X2, Y2, engine = 'dijkstra', dataStore = None, queryStats = None ):
 
     '''
 
     Find a route between Two Points.  This involves:  
 
-    1. Find the closest road to start/end locations
-    2. Ensure that there is a complete network between
-       the two points
-    3. Do a routing search
+    1. Ensure that there is a complete network between
+       the two points: fetch the tiles of the two points, and 
+       those between them, in parallel
+    2. Find the closest road to start/end locations
+    3. Do a routing search, using the ROUTING_ENGINES entry 
+       named by engine
     4  Return Distance, Time, GIS route (MULTILINESTRING)
        (as  JSON)
 
+    Tiles come from dataStore, by default from S3 (see TILE_SOURCE).
+
+    Counters and the time of each phase are recorded in queryStats (an
+    Instrumentation.QueryStats, created if not given), returned under 
+    'STATS' and added to the Instrumentation aggregate.  The JSON build 
+    time is only in queryStats and the aggregate.
+
     '''
 
+    import json
+
+    if engine not in ROUTING_ENGINES:
+        raise AppError (utils.timestampStr (), 'RoutingFacade.findRoute', \
+                        'Unknown routing engine: %s' %(engine), None )
+
     X1 = float (X1)
     Y2 = float (Y2)
 
@@ -60,78 +270,557 @@ def findRoute ( X1, Y1, X2, Y2 ):
     print ".. Find route to %s, %s " %(X2, Y2)
 
     graphRepositoryRef = GraphRepository.getGraphRepository ()
-    dataStore = AWS_S3DataStore ()
-    # identify the roads 
-    fromTile = Locator.getTileFromCoords ( X1, Y1 )
-  
-    print "from tile %s" %(fromTile.getID()  )
 
-    if fromTile.getID() not in graphRepositoryRef:
-        print "Getting From Tile %s" %(fromTile.getID())
-        fromTileGraph = dataStore.loadEdgeGraphForTile ( fromTile ) 
-        graphRepositoryRef [fromTile] = fromTileGraph
+    if dataStore is None:
+        dataStore = getDefaultDataStore ()
 
-    fromEdge = Locator.closestEdgeInGraph ( X1, Y1, graphRepositoryRef[fromTile]   )
+    if queryStats is None:
+        queryStats = QueryStats ( 'route' )
 
-    toTile = Locator.getTileFromCoords ( X2, Y2 )
+    queryStats.info ['engine'] = engine
 
-    print ".. TO tile %s" %(toTile.getID()  )
+    print "loading tileset"
 
-    if toTile.getID() not in graphRepositoryRef:
-        print "Getting From Tile %s" %(toTile.getID())
+    tileSet = _queryTileSet ( X1, Y1, X2, Y2 )
 
-        toTileGraph = dataStore.loadEdgeGraphForTile ( toTile ) 
-        graphRepositoryRef [toTile] = toTileGraph
+    if engine in PREPROCESSED_ENGINES:
+        tileSet = []
 
-    toEdge = Locator.closestEdgeInGraph ( X2, Y2, graphRepositoryRef[toTile]   )
+    lstFetch = tileSet + [ Locator.getTileFromCoords ( X1, Y1 ), 
+                           Locator.getTileFromCoords ( X2, Y2 ) ]
 
-    print "loading tileset"
+    # the search's tiles are not evicted by other requests while it runs
+    with graphRepositoryRef.pinned ( lstFetch ):
 
-    tileSet = Locator.getTileBoundingSet ( X1, Y1, X2,Y2)
+        with queryStats.timer ( 'tileLoad' ):
+            tilesLoaded = _loadTileSet ( graphRepositoryRef, dataStore, lstFetch, queryStats )
 
-    lstTilesNeeded = _missingTiles ( graphRepositoryRef, tileSet )
+        if not tilesLoaded:
+            #TODO 
+            return 
 
-    if len ( lstTilesNeeded ) + len ( graphRepositoryRef ) > 20:
-        print "Memory allowance exceeded"
-        #TODO 
-        return 
-
-    for aTile in tileSet:
-        if  aTile.getID() not in graphRepositoryRef:
-            print "getting tile: %s" %(aTile.getID() )
-            G = dataStore.loadEdgeGraphForTile ( aTile )
-            graphRepositoryRef [aTile] = G
+        # identify the roads 
+        with queryStats.timer ( 'snap' ):
+            fromEdge = _snapToRoad ( graphRepositoryRef, dataStore, X1, Y1, queryStats )
+            toEdge   = _snapToRoad ( graphRepositoryRef, dataStore, X2, Y2, queryStats )
     
-    cg = CompositeGraph ( graphRepositoryRef )
+        cg = TileGraphView ( graphRepositoryRef, tileSet )
+
+        print "do shortest path (%s)" %(engine)
+
+        searchStats = {}
+        with queryStats.timer ( 'search' ):
+            resList = ROUTING_ENGINES [engine] ( cg , fromEdge.sourceNode, toEdge.sourceNode, 
+                                                 searchStats )
+
+    queryStats.addCounters ( searchStats )
+    queryStats.count ( 'graphLookups', cg.lookups )
+    queryStats.count ( 'tilesTouched', len ( cg.tilesRead ) )
+
+    with queryStats.timer ( 'unpack' ):
+        resultDict = _getResultDictFromNodesList ( resList )
+
+    resultDict ['ENGINE']        = engine
+    resultDict ['SEARCH_SECS']   = queryStats.phases ['search']
+    resultDict ['SETTLED_NODES'] = searchStats.get ( 'settled' )
+    resultDict ['STATS']         = queryStats.toDict ()
+
+    with queryStats.timer ( 'json' ):
+        JSON_Result = json.dumps ( resultDict )
+
+    recordQuery ( queryStats )
+
+    return JSON_Result
+
+
+def compareTollRoute ( X1, Y1, X2, Y2, dataStore = None, queryStats = None ):
+
+    '''
+
+    Is the toll worth it?  Find the fastest route and the fastest route 
+    that avoids toll roads, in one request.
+
+    The two searches share the snapping, the tiles and the graph view,
+    and are run as one (algorithms.tollAndTollFreePaths): the nodes that
+    the fastest search reaches without a toll road are settled for the
+    toll free search too, so it only expands the rest.  If the fastest 
+    route uses no toll road then it is also the toll free route.
+
+    Returns JSON with keys 
+        'TOLL'                  the fastest route (as findRoute)
+        'TOLL_FREE'             the fastest route avoiding toll roads 
+                                (None if there is none)
+        'HRS_SAVED'             time saved by the fastest route
+        'MINS_SAVED_PER_TOLL_KM' 
+        'STATS'                 queryStats, as findRoute
+
+    '''
+
+    import json
+
+    X1 = float (X1)
+    Y1 = float (Y1)
+    X2 = float (X2)
+    Y2 = float (Y2)
+
+    graphRepositoryRef = GraphRepository.getGraphRepository ()
+
+    if dataStore is None:
+        dataStore = getDefaultDataStore ()
+
+    if queryStats is None:
+        queryStats = QueryStats ( 'toll' )
+
+    tileSet = _queryTileSet ( X1, Y1, X2, Y2 )
+
+    with graphRepositoryRef.pinned ( tileSet ):
+
+        with queryStats.timer ( 'tileLoad' ):
+            tilesLoaded = _loadTileSet ( graphRepositoryRef, dataStore, tileSet, queryStats )
+
+        if not tilesLoaded:
+            return 
+
+        with queryStats.timer ( 'snap' ):
+            fromEdge = _snapToRoad ( graphRepositoryRef, dataStore, X1, Y1, queryStats )
+            toEdge   = _snapToRoad ( graphRepositoryRef, dataStore, X2, Y2, queryStats )
+
+        cg = TileGraphView ( graphRepositoryRef, tileSet )
+
+        searchStats = {}
+        with queryStats.timer ( 'search' ):
+            tollList, freeList = tollAndTollFreePaths ( cg, fromEdge.sourceNode, 
+                                                        toEdge.sourceNode, searchStats )
+
+    queryStats.addCounters ( searchStats )
+    queryStats.count ( 'graphLookups', cg.lookups )
+    queryStats.count ( 'tilesTouched', len ( cg.tilesRead ) )
+
+    with queryStats.timer ( 'unpack' ):
+
+        tollRoute = _getResultDictFromNodesList ( tollList )
+        tollRoute ['SETTLED_NODES'] = searchStats ['settledToll']
+
+        if freeList is tollList:
+
+            freeRoute = tollRoute
+
+        elif freeList is None:
+
+            # every route uses a toll road
+            freeRoute = None
+
+        else:
+
+            freeRoute = _getResultDictFromNodesList ( freeList )
+            freeRoute ['SETTLED_NODES'] = searchStats ['settledTollFree']
+
+    resultDict = {}
+    resultDict ['TOLL']      = tollRoute
+    resultDict ['TOLL_FREE'] = freeRoute
+    resultDict ['HRS_SAVED'] = None
+    resultDict ['MINS_SAVED_PER_TOLL_KM'] = None
+
+    if freeRoute is not None:
+        resultDict ['HRS_SAVED'] = freeRoute ['TIME_HRS'] - tollRoute ['TIME_HRS']
+        if tollRoute ['TOLL_KM'] > 0:
+            resultDict ['MINS_SAVED_PER_TOLL_KM'] = \
+                resultDict ['HRS_SAVED'] * 60.0 / tollRoute ['TOLL_KM']
+
+    resultDict ['STATS'] = queryStats.toDict ()
+
+    with queryStats.timer ( 'json' ):
+        JSON_Result = json.dumps ( resultDict )
+
+    recordQuery ( queryStats )
+
+    return JSON_Result
+
+
+def findAlternatives ( X1, Y1, X2, Y2, k = 3, dataStore = None, queryStats = None ):
+
+    '''
 
-    print "do shortest path"
-    resList = shortestPath2 ( cg , fromEdge.sourceNode, toEdge.sourceNode)
+    Find up to k different routes between two points, best first, with
+    algorithms.alternativeRoutes (one pair of search trees, not k searches).
 
+    Returns JSON with key 'ROUTES', a list of routes as findRoute, and
+    'STATS', queryStats as findRoute.
 
-    return  _getJSONResultFromNodesList ( resList )
+    '''
+
+    import json
+
+    X1 = float (X1)
+    Y1 = float (Y1)
+    X2 = float (X2)
+    Y2 = float (Y2)
+
+    graphRepositoryRef = GraphRepository.getGraphRepository ()
+
+    if dataStore is None:
+        dataStore = getDefaultDataStore ()
+
+    if queryStats is None:
+        queryStats = QueryStats ( 'alternatives' )
+
+    tileSet = _queryTileSet ( X1, Y1, X2, Y2 )
+
+    with graphRepositoryRef.pinned ( tileSet ):
+
+        with queryStats.timer ( 'tileLoad' ):
+            tilesLoaded = _loadTileSet ( graphRepositoryRef, dataStore, tileSet, queryStats )
+
+        if not tilesLoaded:
+            return 
+
+        with queryStats.timer ( 'snap' ):
+            fromEdge = _snapToRoad ( graphRepositoryRef, dataStore, X1, Y1, queryStats )
+            toEdge   = _snapToRoad ( graphRepositoryRef, dataStore, X2, Y2, queryStats )
 
+        cg = TileGraphView ( graphRepositoryRef, tileSet )
+
+        searchStats = {}
+        with queryStats.timer ( 'search' ):
+            routes = alternativeRoutes ( cg, fromEdge.sourceNode, toEdge.sourceNode, 
+                                         int (k), stats = searchStats )
+
+    queryStats.addCounters ( searchStats )
+    queryStats.count ( 'graphLookups', cg.lookups )
+    queryStats.count ( 'tilesTouched', len ( cg.tilesRead ) )
+
+    with queryStats.timer ( 'unpack' ):
+        resultDict = {}
+        resultDict ['ROUTES'] = [ _getResultDictFromNodesList ( r ) for r in routes ]
+
+    resultDict ['SEARCH_SECS']   = queryStats.phases ['search']
+    resultDict ['SETTLED_NODES'] = searchStats ['settled']
+    resultDict ['STATS']         = queryStats.toDict ()
+
+    with queryStats.timer ( 'json' ):
+        JSON_Result = json.dumps ( resultDict )
+
+    recordQuery ( queryStats )
+
+    return JSON_Result
+
+
+def findMatrix ( origins, destinations, engine = 'dijkstra', dataStore = None, 
+                 queryStats = None ):
+
+    '''
+
+    Travel time, distance and toll distance from every origin to every
+    destination, in one request.
+
+    @origins       list of (X, Y)
+    @destinations  list of (X, Y)
+
+    1. Load the tiles covering all of the points, once
+    2. Find the closest road to each point, once per point
+    3. engine 'ch': bucket based many-to-many search of the contraction
+       hierarchy.  engine 'dijkstra': one search per origin that stops
+       when all of the destinations are settled (algorithms.oneToMany).
+       Other engines raise an AppError (see MATRIX_ENGINES).
+    4. Return JSON with keys 'TIME_HRS', 'DIST_KM', 'TOLL_KM', each a list
+       (per origin) of lists (per destination).  None where no route.
+       'ENGINE' and 'METHOD' say how the table was computed, 'STATS' is
+       queryStats as findRoute.
+
+    '''
 
-def _getJSONResultFromNodesList (edgeList):
+    if engine not in MATRIX_ENGINES:
+        raise AppError (utils.timestampStr (), 'RoutingFacade.findMatrix', \
+                        'No matrix search for engine: %s (use %s)' %( engine,
+                        ' or '.join ( sorted ( MATRIX_ENGINES ) ) ), None )
 
     import json
 
+    origins      = [ ( float (X), float (Y) ) for X, Y in origins ]
+    destinations = [ ( float (X), float (Y) ) for X, Y in destinations ]
+
+    graphRepositoryRef = GraphRepository.getGraphRepository ()
+
+    if dataStore is None:
+        dataStore = getDefaultDataStore ()
+
+    if queryStats is None:
+        queryStats = QueryStats ( 'matrix' )
+
+    queryStats.info ['engine'] = engine
+
+    if engine == 'ch':
+
+        # the hierarchy covers the network, only the points' tiles are needed
+        tileSet = []
+
+    else:
+
+        allX = [ X for X, Y in origins + destinations ]
+        allY = [ Y for X, Y in origins + destinations ]
+
+        tileSet = _queryTileSet ( min (allX), min (allY), max (allX), max (allY) )
+
+    lstFetch = tileSet + [ Locator.getTileFromCoords ( X, Y ) for X, Y in origins + destinations ]
+
+    with graphRepositoryRef.pinned ( lstFetch ):
+
+        with queryStats.timer ( 'tileLoad' ):
+            tilesLoaded = _loadTileSet ( graphRepositoryRef, dataStore, lstFetch, queryStats )
+
+        if not tilesLoaded:
+            return
+
+        with queryStats.timer ( 'snap' ):
+            sources = [ _snapToRoad ( graphRepositoryRef, dataStore, X, Y, queryStats ).sourceNode \
+                        for X, Y in origins ]
+            targets = [ _snapToRoad ( graphRepositoryRef, dataStore, X, Y, queryStats ).sourceNode \
+                        for X, Y in destinations ]
+
+        searchStats = {}
+
+        if engine == 'ch':
+
+            with queryStats.timer ( 'search' ):
+                table = getContractionHierarchy ().manyToMany ( sources, targets, searchStats )
+
+        else:
+
+            cg = TileGraphView ( graphRepositoryRef, tileSet )
+
+            table = []
+            searchStats ['settled'] = 0
+
+            with queryStats.timer ( 'search' ):
+                for source in sources:
+                    originStats = {}
+                    reached = oneToMany ( cg, source, targets, originStats )
+                    table.append ( [ reached.get ( target ) for target in targets ] )
+                    searchStats ['settled'] += originStats ['settled']
+
+            queryStats.count ( 'graphLookups', cg.lookups )
+            queryStats.count ( 'tilesTouched', len ( cg.tilesRead ) )
+
+    queryStats.addCounters ( searchStats )
+
+    with queryStats.timer ( 'unpack' ):
+        resultDict = {}
+        resultDict ['TIME_HRS'] = [ [ _column (cell, 0) for cell in row ] for row in table ]
+        resultDict ['DIST_KM']  = [ [ _column (cell, 1) for cell in row ] for row in table ]
+        resultDict ['TOLL_KM']  = [ [ _column (cell, 2) for cell in row ] for row in table ]
+
+    resultDict ['ENGINE']        = engine
+    resultDict ['METHOD']        = MATRIX_ENGINES [engine]
+    resultDict ['SEARCH_SECS']   = queryStats.phases ['search']
+    resultDict ['SETTLED_NODES'] = searchStats.get ( 'settled' )
+    resultDict ['STATS']         = queryStats.toDict ()
+
+    with queryStats.timer ( 'json' ):
+        JSON_Result = json.dumps ( resultDict )
+
+    recordQuery ( queryStats )
+
+    return JSON_Result
+
+
+def findIsochrone ( X, Y, minutes, avoidToll = False, dataStore = None, queryStats = None ):
+
+    '''
+
+    Find everywhere that can be reached from a point within a time.
+
+    1. Find the closest road to the point
+    2. Search out from it until the time runs out, loading the tiles 
+       around each node before its roads are read (within the 
+       MEMORY_BUDGET_BYTES allowance).  The search only sees the tiles
+       it has loaded and pinned (a TileGraphView that grows with it).
+    3. Return JSON with keys 
+         'WKT'        the roads used (MULTILINESTRING) 
+         'POLYGON'    the area reached (convex hull of the point and the 
+                      road centroids)
+         'NUM_NODES'  the number of junctions reached
+         'TRUNCATED'  true if the area was cut short by the memory allowance
+         'STATS'      queryStats as findRoute.  The 'search' phase 
+                      includes the tile loads made during it, which are
+                      also in 'tileLoad'.
+
+    '''
+
+    import json
+
+    X = float (X)
+    Y = float (Y)
+    budgetHRS = float (minutes) / 60.0
+
+    graphRepositoryRef = GraphRepository.getGraphRepository ()
+
+    if dataStore is None:
+        dataStore = getDefaultDataStore ()
+
+    if queryStats is None:
+        queryStats = QueryStats ( 'isochrone' )
+
+    startTile = Locator.getTileFromCoords ( X, Y )
+
+    truncated = []
+
+    # tiles the search has used, pinned so that they are not evicted 
+    # while it runs
+    lstUsed = [ startTile.getID () ]
+    graphRepositoryRef.pin ( lstUsed )
+
+    try:
+
+        with queryStats.timer ( 'tileLoad' ):
+            tilesLoaded = _loadTileSet ( graphRepositoryRef, dataStore, [ startTile ], queryStats )
+
+        if not tilesLoaded:
+            return
+
+        with queryStats.timer ( 'snap' ):
+            startEdge = _snapToRoad ( graphRepositoryRef, dataStore, X, Y, queryStats )
+
+        cg = TileGraphView ( graphRepositoryRef, lstUsed )
+
+        def loadTilesNear ( node, viaEdge ):
+            # a node near a tile's edge has roads whose centroids are in the 
+            # next tile, so load the tiles around it, not just its own
+            if viaEdge is None:
+                viaEdge = startEdge
+            tileSet = [ aTile for aTile in _tilesAroundEdge ( viaEdge ) \
+                        if aTile.getID () not in lstUsed ]
+            if not tileSet:
+                return
+            with queryStats.timer ( 'tileLoad' ):
+                tilesLoaded = _loadTileSet ( graphRepositoryRef, dataStore, tileSet, queryStats )
+            if tilesLoaded:
+                lstNew = [ aTile.getID () for aTile in tileSet ]
+                graphRepositoryRef.pin ( lstNew )
+                lstUsed.extend ( lstNew )
+                cg.addTiles ( lstNew )
+            else:
+                truncated.append ( node )
+
+        searchStats = {}
+        with queryStats.timer ( 'search' ):
+            D, L = reachableWithin ( cg, startEdge.sourceNode, budgetHRS, avoidToll, 
+                                     loadTilesNear, searchStats )
+    finally:
+        graphRepositoryRef.unpin ( lstUsed )
+
+    queryStats.addCounters ( searchStats )
+    queryStats.count ( 'graphLookups', cg.lookups )
+    queryStats.count ( 'tilesTouched', len ( cg.tilesRead ) )
+
+    edgeList = L.values ()
+
+    with queryStats.timer ( 'unpack' ):
+        resultDict = {}
+        resultDict ['WKT']     = gis.multiLineStringWKT ( [ e.WKT for e in edgeList ] )
+        resultDict ['POLYGON'] = gis.polygonWKT ( gis.convexHull ( [ (X, Y) ] +
+                                     [ (e.CentroidX, e.CentroidY) for e in edgeList ] ) )
+
+    resultDict ['NUM_NODES'] = len (D)
+    resultDict ['TRUNCATED'] = len ( truncated ) > 0
+
+    resultDict ['SEARCH_SECS']   = queryStats.phases ['search']
+    resultDict ['SETTLED_NODES'] = searchStats ['settled']
+    resultDict ['STATS']         = queryStats.toDict ()
+
+    with queryStats.timer ( 'json' ):
+        JSON_Result = json.dumps ( resultDict )
+
+    recordQuery ( queryStats )
+
+    return JSON_Result
+
+
+def _tilesNearEdge ( anEdge ):
+
+    '''
+    The tiles that either end of anEdge may be in: those within half of 
+    its length of its centroid.
+    '''
+
+    halfKM = anEdge.lengthKM / 2.0
+    dY = halfKM / 111.0
+    dX = halfKM / ( 111.0 * max ( 0.01, math.cos ( math.radians ( anEdge.CentroidY ) ) ) )
+
+    tiles = {}
+    for X in ( anEdge.CentroidX - dX, anEdge.CentroidX + dX ):
+        for Y in ( anEdge.CentroidY - dY, anEdge.CentroidY + dY ):
+            aTile = Locator.getTileFromCoords ( X, Y )
+            tiles [ aTile.getID () ] = aTile
+
+    return tiles.values ()
+
+
+def _tilesAroundEdge ( anEdge ):
+
+    '''
+    The tiles that either end of anEdge may be in (_tilesNearEdge) and 
+    the 8 tiles around each of them: every tile that may hold the 
+    centroid of a road from either end, for roads shorter than a tile.
+    '''
+
+    tiles = {}
+    for nearTile in _tilesNearEdge ( anEdge ):
+        for dX in ( -1, 0, 1 ):
+            for dY in ( -1, 0, 1 ):
+                aTile = Tile ( nearTile.x1 + dX, nearTile.y1 + dY )
+                tiles [ aTile.getID () ] = aTile
+
+    return tiles.values ()
+
+
+def _column ( cell, i ):
+    if cell is None:
+        return None
+    return cell [i]
+
+
+def _getJSONResultFromNodesList (edgeList, searchStats = None):
+
+    import json
+
+    '''
+
+    @ edgeList    : list  DataStructures.GISEdge
+    @ searchStats : optional dict of extra keys to report (e.g. 'ENGINE')
+
+    returns a JSON result with keys : 'WKT', 'TIME_HRS', 'DIST_KM', 'TOLL_KM'
+
+    ''' 
+
+    resultDict = _getResultDictFromNodesList ( edgeList )
+
+    if searchStats:
+        resultDict.update ( searchStats )
+
+    return json.dumps ( resultDict )  
+
+
+def _getResultDictFromNodesList (edgeList):
+
     '''
 
     @ edgeList : list  DataStructures.GISEdge
 
-    returns a JSON result with keys : 'WKT', 'TIME_HRS', 'DIST_KM'
+    returns a dict with keys : 'WKT', 'TIME_HRS', 'DIST_KM', 'TOLL_KM'
 
     ''' 
     
     timeHRS = 0
     distKM  = 0
-    lastNode= None
+    tollKM  = 0
     WKT     = None  # Well known text repr of a geometry
 
     for thisEdge in edgeList:
 
         timeHRS += thisEdge.getCost ()
         distKM  += thisEdge.lengthKM
+        if thisEdge.isToll:
+            tollKM += thisEdge.lengthKM
         WKT = gis.mergeWKT (WKT, thisEdge.WKT )                 
 
     print "----------------"
@@ -144,7 +833,6 @@ def _getJSONResultFromNodesList (edgeList):
     resultDict ['WKT'] = WKT
     resultDict ['TIME_HRS'] = timeHRS
     resultDict ['DIST_KM'] = distKM
+    resultDict ['TOLL_KM'] = tollKM
 
-    return json.dumps ( resultDict )  
-
-
+    return resultDict
@@ -0,0 +1,183 @@
+
+'''
+
+Synthetic road networks for testing and benchmarking, written in the pipe
+delimited format read by DataStore (see GenericDataStore._createEdgeFromLine)
+so that they can be loaded with a FileDataStore.
+
+The network covers a rectangle of whole tiles.  It is a grid of local
+roads with a slightly jittered node position, overlaid with:
+
+  - A roads on every AROAD_EVERY-th grid line
+  - motorways on every MOTORWAY_EVERY-th grid line
+  - a toll motorway, faster than the others, along the middle row
+
+Node names are integers, as in the real data, and the grid runs across
+tile edges so that routes can cross tiles.  Each road is in the tile
+that holds its centroid.
+
+Functions in this module are:
+
+- generateNetwork     Write a network covering a list of tiles to a file
+
+- generateQueries     Fixed, repeatable random route queries over the tiles
+
+Run with:
+
+    python SyntheticNetwork.py <outFile> <nodesPerTileSide> <tileID> [<tileID> ..]
+
+'''
+
+import math
+import random
+
+import gis
+from gis import Locator
+
+
+LOCAL_SPEED_KMH    = 48
+AROAD_SPEED_KMH    = 80
+MOTORWAY_SPEED_KMH = 105
+TOLL_SPEED_KMH     = 112
+
+AROAD_EVERY    = 10
+MOTORWAY_EVERY = 40
+
+# Fraction of a grid step by which nodes are moved at random
+JITTER = 0.2
+
+
+def generateNetwork ( filePath, lstTileIDs, nodesPerTileSide = 100, seed = 1 ):
+
+    '''
+    @filePath          file to write
+    @lstTileIDs        tiles to cover e.g. ['m-2.52', 'm-1.52'].  The network
+                       fills the rectangle around them.
+    @nodesPerTileSide  grid lines per tile in each direction.  A tile has
+                       about 2 * nodesPerTileSide ^ 2 roads (100 -> 20,000)
+    @seed              random seed; the same seed gives the same network
+
+    Returns the number of roads written.
+    '''
+
+    rand = random.Random ( seed )
+
+    tiles = [ Locator.getTileFromID ( tileID ) for tileID in lstTileIDs ]
+
+    minX = min ( [ t.getX () for t in tiles ] )
+    minY = min ( [ t.getY () for t in tiles ] )
+    maxX = max ( [ t.getX () for t in tiles ] ) + 1
+    maxY = max ( [ t.getY () for t in tiles ] ) + 1
+
+    step = 1.0 / nodesPerTileSide
+    numCols = int ( round ( ( maxX - minX ) * nodesPerTileSide ) )
+    numRows = int ( round ( ( maxY - minY ) * nodesPerTileSide ) )
+
+    tollRow = numRows // 2
+
+    def position ( i, j ):
+        # nodes on the outside of the area are not moved, so that no
+        # road leaves it
+        dx, dy = 0.0, 0.0
+        if 0 < i < numCols and 0 < j < numRows:
+            r = random.Random ( seed * 1000003 + i * 7919 + j )
+            dx = r.uniform ( -JITTER, JITTER ) * step
+            dy = r.uniform ( -JITTER, JITTER ) * step
+        return minX + i * step + dx, minY + j * step + dy
+
+    def nodeID ( i, j ):
+        return str ( 1000000 + j * ( numCols + 1 ) + i )
+
+    def speed ( line, isRow ):
+        if isRow and line == tollRow:
+            return TOLL_SPEED_KMH, True
+        if line % MOTORWAY_EVERY == 0:
+            return MOTORWAY_SPEED_KMH, False
+        if line % AROAD_EVERY == 0:
+            return AROAD_SPEED_KMH, False
+        # a little variety in the local roads
+        return LOCAL_SPEED_KMH - rand.randint ( 0, 16 ), False
+
+    fs = open ( filePath, 'w' )
+    numRoads = 0
+
+    for j in range ( numRows + 1 ):
+        for i in range ( numCols + 1 ):
+
+            x1, y1 = position ( i, j )
+
+            for i2, j2, line, isRow in [ ( i + 1, j, j, True ), ( i, j + 1, i, False ) ]:
+
+                if i2 > numCols or j2 > numRows:
+                    continue
+
+                x2, y2 = position ( i2, j2 )
+                speedKMH, isToll = speed ( line, isRow )
+
+                fs.write ( _edgeLine ( nodeID (i, j), nodeID (i2, j2),
+                                       x1, y1, x2, y2, speedKMH, isToll ) )
+                numRoads += 1
+
+    fs.close ()
+
+    return numRoads
+
+
+def _edgeLine ( source, target, x1, y1, x2, y2, speedKMH, isToll ):
+
+    '''
+    One road in the format of GenericDataStore._createEdgeFromLine
+    '''
+
+    km      = gis.greatCircleDistanceKM ( x1, y1, x2, y2 )
+    costHRS = km / speedKMH
+
+    cx = ( x1 + x2 ) / 2.0
+    cy = ( y1 + y2 ) / 2.0
+
+    tollFlag = 'f'
+    if isToll:
+        tollFlag = 't'
+
+    return '%s|%s|%.10f|%.10f|%.9f|%s|%s|LINESTRING(%.7f %.7f,%.7f %.7f)|POINT(%.7f %.7f)|%s|%s\n' %(
+           source, target, costHRS, costHRS, km, speedKMH, tollFlag,
+           x1, y1, x2, y2, cx, cy, int ( math.floor (cx) ), int ( math.floor (cy) ) )
+
+
+def generateQueries ( lstTileIDs, numQueries, seed = 1, margin = 0.05 ):
+
+    '''
+    numQueries random (X1, Y1, X2, Y2) route queries between points in
+    the tiles, at least margin degrees inside the covered rectangle.  The
+    same seed gives the same queries.
+    '''
+
+    rand = random.Random ( seed )
+
+    tiles = [ Locator.getTileFromID ( tileID ) for tileID in lstTileIDs ]
+
+    def randomPoint ():
+        aTile = rand.choice ( tiles )
+        return ( aTile.getX () + rand.uniform ( margin, 1 - margin ),
+                 aTile.getY () + rand.uniform ( margin, 1 - margin ) )
+
+    queries = []
+    for n in range ( numQueries ):
+        X1, Y1 = randomPoint ()
+        X2, Y2 = randomPoint ()
+        queries.append ( ( X1, Y1, X2, Y2 ) )
+
+    return queries
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    if len ( sys.argv ) < 4:
+        print "usage: python SyntheticNetwork.py <outFile> <nodesPerTileSide> <tileID> [<tileID> ..]"
+        sys.exit (1)
+
+    numRoads = generateNetwork ( sys.argv[1], sys.argv[3:], int ( sys.argv[2] ) )
+
+    print "%s roads written to %s" %( numRoads, sys.argv[1] )
@@ -0,0 +1,133 @@
+'''
+
+Compiles text tiles (the '|' delimited lines read by DataStore, see
+GenericDataStore._createEdgeFromLine) into the binary format of
+DataStructures.SharedCSRGraph, for DataStore.CompiledDataStore to load.
+
+A compiled tile holds the node names, the arcs of each node (target,
+cost, edge row) behind an offset table, the edges' lengths, centroids
+and toll flags, and an offset indexed section of their WKT.  Loading it
+is one read and a struct.unpack per table, rather than splitting and
+parsing 200,000 lines.  The header carries a format version, so a file
+of another format is refused on load, and a crc32 of the tile's text,
+the text the file was compiled from.  Nothing checks a compiled tile 
+against the text: compile again when the text changes.
+
+Functions in this module are:
+
+- compileTile      The compiled bytes of one tile of a DataStore
+
+- compileTiles     Compile tiles of a DataStore to <outDir>/<tileID>.csr
+
+- tileIDsInFile    IDs of the tiles in a FileDataStore's edge file
+
+Compile from the command line with:
+
+    python TileCompiler.py <edgeFile|s3> <outDir> [<tileID> ..]
+
+With an edge file and no tile IDs every tile in the file is compiled.
+Upload the files to S3 as they are for AWS_S3CompiledDataStore.
+
+'''
+
+import os
+import sys
+import time
+import zlib
+
+from DataStructures import CSRGraph, SharedCSRGraph
+from DataStore import FileDataStore
+from gis import Locator
+from apperror import AppError
+import utils
+
+
+def compileTile (dataStore, aTile):
+
+    '''
+    @dataStore  DataStore.GenericDataStore holding aTile as text
+    @aTile      gis.Tile
+
+    Returns the tile in the SharedCSRGraph file format, as a string.
+    '''
+
+    try:
+
+        sourceCRC = [0]
+
+        def lines ():
+            for thisLine in dataStore._getLineStream ( aTile ):
+                sourceCRC [0] = zlib.crc32 ( thisLine, sourceCRC [0] )
+                yield thisLine
+
+        graph = CSRGraph.fromEdges ( ( dataStore._createEdgeFromLine (thisLine) \
+                                       for thisLine in lines () ) )
+
+        data = SharedCSRGraph.pack ( graph, sourceCRC [0] )
+
+    except Exception as e:
+        import traceback
+        utils.logError ( traceback.format_exc() )
+
+        raise AppError (utils.timestampStr (), 'TileCompiler', \
+                        'compileTile %s' %( str (aTile) ),   e )
+
+    return data
+
+
+def compileTiles (dataStore, lstTileIDs, outDir):
+
+    '''
+    Compile each of lstTileIDs to <outDir>/<tileID>.csr (the file names
+    DataStore.CompiledFileDataStore reads).  Returns { tileID: (bytes,
+    seconds) }.
+    '''
+
+    if not os.path.isdir ( outDir ):
+        os.makedirs ( outDir )
+
+    result = {}
+
+    for tileID in lstTileIDs:
+
+        startTime = time.time ()
+
+        data = compileTile ( dataStore, Locator.getTileFromID ( tileID ) )
+        SharedCSRGraph.writeBytes ( os.path.join ( outDir, '%s.csr' %( tileID ) ), data )
+
+        result [tileID] = ( len (data), time.time () - startTime )
+
+    return result
+
+
+def tileIDsInFile (filePath, hasHeader = False):
+
+    '''
+    Sorted IDs of the tiles that the edges of an edge file fall in (by
+    centroid, from the FileDataStore's index)
+    '''
+
+    return FileDataStore ( filePath, hasHeader ).getTileIDs ()
+
+
+if __name__ == "__main__":
+
+    from DataStore import AWS_S3DataStore
+
+    if len ( sys.argv ) < 3 or ( sys.argv[1] == 's3' and len ( sys.argv ) < 4 ):
+        print "usage: python TileCompiler.py <edgeFile|s3> <outDir> [<tileID> ..]"
+        sys.exit (1)
+
+    if sys.argv[1] == 's3':
+        dataStore = AWS_S3DataStore ()
+    else:
+        dataStore = FileDataStore ( sys.argv[1] )
+
+    lstTileIDs = sys.argv[3:]
+    if not lstTileIDs:
+        lstTileIDs = tileIDsInFile ( sys.argv[1] )
+
+    for tileID in lstTileIDs:
+        print "compiling tile %s" %(tileID)
+        nbytes, secs = compileTiles ( dataStore, [ tileID ], sys.argv[2] ) [tileID]
+        print "%-10s %10s bytes %8.2f secs" %( tileID, nbytes, secs )
@@ -1,6 +1,12 @@
 
 from DataStructures import d_priority_dict
-from DataStructures import priority_dict
+from DataStructures import IndexedHeap
+from DataStructures import CSRGraph
+from apperror import AppError
+from array import array
+from heapq import heappush, heappop
+import gis
+import utils
 
 '''
 
@@ -8,160 +14,935 @@ Routines for shortest path routing from A->B
 
 Contains
 
-Dijkstra2          Classic Dijkstra returning list of predecessors and 
-                   list of distances to source for each node
+Dijkstra2          Bidirectional Dijkstra returning the predecessors and 
+                   links of both searches and the node at which they meet.
+                   On a CSRGraph it searches the arrays by node index 
+                   (_searchTreesCSR).
 
 shortestPath2      Returns a set of GISEdges representing cost, distance 
                    and geometry from A-B
 
+tollAndTollFreePaths
+                   The shortest path from A-B and the shortest that
+                   avoids toll roads, sharing one pair of searches
+
+AStar              Goal directed search.  Returns list of predecessors, 
+                   links and distances to source for each settled node
+
+shortestPathAStar  As shortestPath2, but using AStar
+
+StraightLineHeuristic  
+                   Admissible remaining-time estimate used by AStar
+
+oneToMany          Cost, distance and toll distance from one node to 
+                   many nodes with a single search
+
+reachableWithin    Every node that can be reached within a cost budget
+
+alternativeRoutes  Up to k different routes from A-B from one pair of 
+                   search trees (the plateau method)
+
+Routines accept an optional 'stats' dictionary.  If given it is populated
+with search counters (e.g. stats['settled'], the number of settled nodes)
+so that the routines can be compared on the same queries.
+
 '''
 
+# Fastest speed (km/h) on any edge.  Used to convert a straight line 
+# distance into a lower bound on travel time.  Must not be less than 
+# the highest road speed in the data (70mph ~ 113 km/h).
+MAX_ROAD_SPEED_KMH = 120.0
+
+INFINITY = float ('inf')
+
+
+def Dijkstra2(G,start,end,stats=None,avoidToll=False):
+
+    """ Bidirectional Dijkstra returning P, P2, L, L2, midPoint - see _searchTrees """
+
+    if isinstance ( G, CSRGraph ) and not getattr ( G, 'isShared', False ):
+        return _searchTreesCSR ( G, start, end, stats, avoidToll )
+
+    D, D2, P, P2, L, L2, midPoint, mu = \
+        _searchTrees ( G, start, end, stats, avoidToll )
+
+    return P, P2, L, L2, midPoint
+
+
+def _searchTreesCSR(G,start,end,stats=None,avoidToll=False):
+
+    """
+        _searchTrees over a DataStructures.CSRGraph by node index.  Arcs 
+        are read straight from G.offsets, G.targets and G.costs, and the 
+        distances, predecessors and heap entries are ints into arrays, so 
+        no name is hashed and no edge is created while searching.  The 
+        heap holds (distance, index) pairs; a shorter distance to a node
+        already in the heap is a new entry ('decreaseKeys'), and the old 
+        entry is skipped when popped ('stalePops').  Few distances are 
+        lowered, and heapq's C heap is about twice as fast here as the 
+        IndexedHeap of _searchTrees, so stale entries are the cheaper way.
+
+        Names are only looked up for start and end, and GISEdges only 
+        created for the path found.  So P, P2, L and L2 hold just the 
+        nodes of the shortest path, which is all _pathFromTrees needs.
+    """
+
+    s = G.nodeIndex.get ( start )
+    t = G.nodeIndex.get ( end )
+
+    if s is None or t is None:
+        raise AppError (utils.timestampStr (), 'algorithms.Dijkstra2', \
+                        'No route found from %s to %s' %(start, end), None )
+
+    n        = len ( G.nodes )
+    offsets  = G.offsets
+    targets  = G.targets
+    costs    = G.costs
+    edgeRefs = G.edgeRefs
+    isToll   = G.isToll
+
+    dist    = ( array ( 'd', [INFINITY] ) * n, array ( 'd', [INFINITY] ) * n )
+    done    = ( bytearray ( n ), bytearray ( n ) )
+    pred    = ( array ( 'i', [-1] ) * n, array ( 'i', [-1] ) * n )
+    predArc = ( array ( 'i', [-1] ) * n, array ( 'i', [-1] ) * n )
+    heaps   = ( [ (0.0, s) ], [ (0.0, t) ] )
+    settled = [ 0, 0 ]
+
+    dist [0][s] = 0.0
+    dist [1][t] = 0.0
+
+    mu        = INFINITY
+    midPoint  = -1
+    pushes    = 2
+    decreases = 0
+    stale     = 0
+
+    if s == t:
+        mu       = 0.0
+        midPoint = s
+
+    while heaps [0] or heaps [1]:
+
+        for i in ( 0, 1 ):
+            while heaps [i] and done [i][ heaps [i][0][1] ]:
+                heappop ( heaps [i] )
+                stale += 1
 
-def Dijkstra2(G,start,end=None):
+        top  = heaps [0][0][0] if heaps [0] else INFINITY
+        top2 = heaps [1][0][0] if heaps [1] else INFINITY
+
+        if top + top2 >= mu:
+            break
+
+        if heaps [0] and ( len ( heaps [0] ) <= len ( heaps [1] ) or not heaps [1] ):
+            i = 0
+        else:
+            i = 1
+
+        heap   = heaps [i]
+        D      = dist [i]
+        Dother = dist [1 - i]
+        Di     = done [i]
+        Pi     = pred [i]
+        Ai     = predArc [i]
+
+        dv, v = heappop ( heap )
+        Di [v] = 1
+        settled [i] += 1
+
+        for arc in xrange ( offsets [v], offsets [v + 1] ):
+
+            w = targets [arc]
+
+            if Di [w]:
+                continue
+            if avoidToll and isToll [ edgeRefs [arc] ]:
+                continue
+
+            dw = dv + costs [arc]
+            if dw >= D [w]:
+                continue
+
+            # not settled, so a node with a distance is in the heap
+            if D [w] < INFINITY:
+                decreases += 1
+            else:
+                pushes += 1
+
+            D [w]  = dw
+            Pi [w] = v
+            Ai [w] = arc
+            heappush ( heap, (dw, w) )
+
+            if dw + Dother [w] < mu:
+                mu       = dw + Dother [w]
+                midPoint = w
+
+    if stats is not None:
+        stats ['settled']         = settled [0] + settled [1]
+        stats ['settledForward']  = settled [0]
+        stats ['settledBackward'] = settled [1]
+        stats ['heapPushes']      = pushes
+        stats ['heapPops']        = settled [0] + settled [1] + stale
+        stats ['decreaseKeys']    = decreases
+        stats ['stalePops']       = stale
+
+    if midPoint < 0:
+        raise AppError (utils.timestampStr (), 'algorithms.Dijkstra2', \
+                        'No route found from %s to %s' %(start, end), None )
+
+    nodes = G.nodes
+    trees = ( {}, {} ), ( {}, {} )     # (P, L), (P2, L2)
+
+    for i, root in ( (0, s), (1, t) ):
+        P, L = trees [i]
+        node = midPoint
+        while node != root:
+            arc = predArc [i][node]
+            P [ nodes [node] ] = nodes [ pred [i][node] ]
+            L [ nodes [node] ] = G.getEdge ( edgeRefs [arc], costs [arc] )
+            node = pred [i][node]
+
+    return trees [0][0], trees [1][0], trees [0][1], trees [1][1], nodes [midPoint]
+
+
+def _searchTrees(G,start,end,stats=None,avoidToll=False,stretch=None):
+
+    """
+        Bidirectional Dijkstra: one search out from start and one back 
+        from end, each expanding nodes in order of distance.  
 
-	"""
         Based on  David Eppstein, UC Irvine, 4 April 2002
         http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/117228
 
-        JS made two changes:
-        1. Allow G[v][w] to be of type EdgeCost, rather than float
-        2. Conduct the routing search at both ends. 
-           Based on fact that if   AreaImproved = 2 * pi * (r/2) ^ 2 
-                              and  AreaOriginal = 1 * pi *  r    ^ 2
-                              then AreaImproved < AreaOriginal
+        1. G[v][w] is of type EdgeCost, rather than float
+        2. The tile graphs hold each road in both directions, so the 
+           search back from end also follows G[v].
+        3. Searching from both ends covers less area than one search:
+              AreaImproved = 2 * pi * (r/2) ^ 2  <  AreaOriginal = pi * r ^ 2
+
+        mu, the cost of the best start->end path seen so far, is updated 
+        whenever an edge reaches a node already reached by the other 
+        search.  The first meeting of the searches is not necessarily on 
+        the shortest path, so the searches only stop when the sum of the 
+        two queue minima is no less than mu.  Each step expands the search 
+        with the smaller queue.
+
+        If avoidToll is set, edges with isToll set are not used.
+
+        If stats is given it is filled with 'settled', 'settledForward', 
+        'settledBackward', 'heapPushes', 'heapPops', 'decreaseKeys' and 
+        'stalePops'.
+
+        If stretch is set (e.g. 1.25) each search instead carries on 
+        until its queue minimum passes stretch * mu.  The two trees then 
+        hold every route of up to stretch times the best cost, which is 
+        what alternativeRoutes needs.
+
+        Returns D, D2, P, P2, L, L2, midPoint, mu: the final distances, 
+        predecessors and links of the forward and backward searches, the 
+        node at which the shortest path joins them and its cost.
     
-	"""
+    """
 
-	D = {}	# dictionary of final distances (float)
-	P = {}	# dictionary of predecessors (float)
-        L = {}  # dictionary of links to predessor of type EdgeCost 
+    D  = {}     # dictionary of final distances from start (float)
+    P  = {}     # dictionary of predecessors 
+    L  = {}     # dictionary of links to predecessor of type EdgeCost 
 
-        midPoint = None
+    D2 = {}     # dictionary of final distances to end (float)
+    P2 = {}     # dictionary of successors 
+    L2 = {}     # dictionary of links to successor of type EdgeCost 
 
-        end2     = start
-        start2   = end
+    Q  = IndexedHeap ()
+    Q2 = IndexedHeap ()
 
-	D2 = {}	# dictionary of final distances (float)
-	P2 = {}	# dictionary of predecessors (float)
-        L2 = {}  # dictionary of links to predessor of type EdgeCost 
-     
-	Q  = priority_dict()   
-	Q2 = priority_dict()   
+    Q [start] = 0.0
+    Q2[end]   = 0.0
 
-	Q [start]  = 0
-	Q2[start2] = 0
+    mu       = INFINITY
+    midPoint = None
 
-        last_v  = None
-        last_v2 = None
+    pushes    = 2
+    decreases = 0
 
-        while Q or Q2:
+    if start == end:
+        mu       = 0.0
+        midPoint = start
 
+    while Q or Q2:
 
-            # Search out from the start
-            v  = Q.smallest  ()
-   
-            if last_v == v: 
-                # This is a workaround for rare network inconsistencies.
-                Q.pop_smallest ()
-                v  = Q.smallest  () 
+        top  = Q  [Q.smallest  ()] if Q  else INFINITY
+        top2 = Q2 [Q2.smallest ()] if Q2 else INFINITY
 
-	    D[v]   = Q[v]
+        if stretch is None:
 
-	    if v == end: 
+            if top + top2 >= mu:
                 break
-            if v <> None and v in D2: 
-                midPoint = v
+
+            forward = Q and ( len (Q) <= len (Q2) or not Q2 )
+
+        else:
+
+            # until a route is found mu is infinite: an empty queue is closed
+            forwardOpen  = bool ( Q )  and top  <= stretch * mu
+            backwardOpen = bool ( Q2 ) and top2 <= stretch * mu
+
+            if not forwardOpen and not backwardOpen:
                 break
 
-            for w in G[v]:
-                vwLength = D[v] + (G[v][w]).getCost ()
-                if w in D:
-                    if vwLength < D[w]:
-		        raise ValueError, \
-                        "Dijkstra: found better path to already-final vertex"
-    	        elif w not in Q or vwLength < Q[w]:
-                    Q[w] = vwLength
-		    P[w] = v
-                    L[w] = G[v][w]
+            forward = forwardOpen and ( len (Q) <= len (Q2) or not backwardOpen )
+
+        if forward:
+            # Search out from the start
+            searchQ, searchD, searchP, searchL = Q,  D,  P,  L
+            otherQ,  otherD                    = Q2, D2
+        else:
+            # Search back from the end
+            searchQ, searchD, searchP, searchL = Q2, D2, P2, L2
+            otherQ,  otherD                    = Q,  D
 
-            # Search out from the end
+        v = searchQ.smallest ()
+        searchD[v] = searchQ[v]
+        searchQ.pop_smallest ()
 
-            v2 = Q2.smallest ()
+        for w, edge in G[v].iteritems ():
 
-            if last_v2 == v2: 
-                # This is a workaround rare network inconsistencies.
-                Q2.pop_smallest ()
-                v2  = Q2.smallest  () 
+            if w in searchD:
+                continue
+            if avoidToll and edge.isToll:
+                continue
 
+            vwLength = searchD[v] + edge.getCost ()
 
-            D2[v2] = Q2[v2]
+            if w in searchQ:
+                if vwLength >= searchQ[w]:
+                    continue
+                decreases += 1
+            else:
+                pushes += 1
 
-            if v2 == end2: 
-                break
-            if v2 <> None and v2 in D: 
-                midPoint = v2
+            searchQ[w] = vwLength
+            searchP[w] = v
+            searchL[w] = edge
+
+            if w in otherD:
+                other = otherD[w]
+            elif w in otherQ:
+                other = otherQ[w]
+            else:
+                continue
+
+            if vwLength + other < mu:
+                mu       = vwLength + other
+                midPoint = w
+
+    if stats is not None:
+        stats ['settled']         = len (D) + len (D2)
+        stats ['settledForward']  = len (D)
+        stats ['settledBackward'] = len (D2)
+        stats ['heapPushes']      = pushes
+        stats ['heapPops']        = len (D) + len (D2)
+        stats ['decreaseKeys']    = decreases
+        stats ['stalePops']       = 0     # IndexedHeap holds no stale entries
+
+    if midPoint is None:
+        raise AppError (utils.timestampStr (), 'algorithms.Dijkstra2', \
+                        'No route found from %s to %s' %(start, end), None )
+
+    return D, D2, P, P2, L, L2, midPoint, mu
+
+
+def shortestPath2(G,start,end,stats=None,avoidToll=False):
+
+    """
+    Find a single shortest path from the given start vertex
+    to the given end vertex.
+    The input has the same conventions as Dijkstra2().
+    The output is a list of the edges in order along
+    the shortest path.
+    """
+
+    P,P2,L,L2,midPoint = Dijkstra2(G,start,end,stats,avoidToll)
+
+    return _pathFromTrees ( P, P2, L, L2, start, end, midPoint )
+
+
+def _pathFromTrees(P,P2,L,L2,start,end,node):
+
+    """
+    The edges from start to node in the forward tree (P, L), then from
+    node to end in the backward tree (P2, L2)
+    """
+
+    Path = []
+
+    midPoint = node
+    while node != start:
+        Path.append ( L[node] )
+        node = P[node]
+
+    Path.reverse ()
+
+    node = midPoint
+    while node != end:
+        Path.append ( L2[node] )
+        node = P2[node]
+
+    return Path
+
+
+def tollAndTollFreePaths(G,start,end,stats=None):
+
+    """
+    The shortest path from start to end, and the shortest that uses no
+    edge with isToll set, from one pair of searches.
+
+    The search over every edge (as _searchTrees) notes which nodes have
+    a tree path with no toll edge.  Such a node costs the same without 
+    toll roads, so it is also settled for the toll free search, without
+    being expanded again.  The toll free search then starts from the 
+    toll free paths to the nodes next to them, which the first search 
+    saw as it read their edges, and only expands the nodes that toll 
+    roads made quicker to reach and those beyond the first search.
+
+    If the shortest path has no toll edge it is both paths, and there 
+    is no second search.
+
+    If stats is given it is filled with 'settled' (nodes expanded), 
+    'settledToll', 'settledTollFree' (by the toll free search) and 
+    'shared' (settled in both by one expansion).
+
+    Returns tollPath, freePath: lists of edges.  freePath is None if 
+    every path uses a toll edge.
+    """
+
+    # per direction: the search over every edge (Q, D, P, L), tollFree
+    # { node: its path in Q or D has no toll edge }, the nodes settled 
+    # by such a path, and freeLinks { node: (cost, predecessor, link) }
+    # for toll free paths to nodes whose path in Q or D is not
+    trees = []
+    for root in ( start, end ):
+        Q = IndexedHeap ()
+        Q [root] = 0.0
+        trees.append ( ( Q, {}, {}, {}, { root: True }, [], {} ) )
+
+    mu       = INFINITY
+    midPoint = None
+
+    if start == end:
+        mu       = 0.0
+        midPoint = start
+
+    # 1. search over every edge
+
+    while True:
+
+        Q, Q2 = trees [0][0], trees [1][0]
+
+        top  = Q  [Q.smallest  ()] if Q  else INFINITY
+        top2 = Q2 [Q2.smallest ()] if Q2 else INFINITY
+
+        if top + top2 >= mu:
+            break
+
+        if Q and ( len (Q) <= len (Q2) or not Q2 ):
+            search, other = trees [0], trees [1]
+        else:
+            search, other = trees [1], trees [0]
+
+        Q, D, P, L, tollFree, sharedNodes, freeLinks = search
+        otherQ, otherD = other [0], other [1]
+
+        v = Q.smallest ()
+        d = D[v] = Q[v]
+        Q.pop_smallest ()
+
+        isShared = tollFree [v]
+        if isShared:
+            sharedNodes.append ( v )
+
+        for w, edge in G[v].iteritems ():
+
+            vwLength = d + edge.getCost ()
+            wFree    = isShared and not edge.isToll
+
+            if w in D:
+                if wFree and not tollFree [w]:
+                    _keepFreeLink ( freeLinks, w, vwLength, v, edge )
+                continue
+
+            q = Q.get ( w )
+
+            if q is None or vwLength < q or ( vwLength == q and wFree and not tollFree [w] ):
+
+                if q is not None and tollFree [w] and not wFree:
+                    _keepFreeLink ( freeLinks, w, q, P[w], L[w] )
+
+                Q[w] = vwLength
+                P[w] = v
+                L[w] = edge
+                tollFree [w] = wFree
+
+                other = otherD.get ( w )
+                if other is None:
+                    other = otherQ.get ( w )
+                if other is not None and vwLength + other < mu:
+                    mu       = vwLength + other
+                    midPoint = w
+
+            elif wFree and not tollFree [w]:
+                _keepFreeLink ( freeLinks, w, vwLength, v, edge )
+
+    settledToll = len ( trees [0][1] ) + len ( trees [1][1] )
+    shared      = len ( trees [0][5] ) + len ( trees [1][5] )
+    settledFree = 0
+
+    if midPoint is None:
+        raise AppError (utils.timestampStr (), 'algorithms.tollAndTollFreePaths', \
+                        'No route found from %s to %s' %( start, end ), None )
+
+    tollPath = _pathFromTrees ( trees [0][2], trees [1][2], trees [0][3], trees [1][3],
+                                start, end, midPoint )
+
+    freePath = tollPath
+
+    if [ edge for edge in tollPath if edge.isToll ]:
+
+        # 2. toll free search, from the shared nodes
+
+        freeTrees = []
+
+        for Q, D, P, L, tollFree, sharedNodes, freeLinks in trees:
+
+            Df = {}
+            Pf = {}
+            Lf = {}
+
+            for v in sharedNodes:
+                Df[v] = D[v]
+                if v in P:
+                    Pf[v] = P[v]
+                    Lf[v] = L[v]
+
+            # the queue: nodes in Q by a toll free path, and freeLinks
+            seeds = {}
+
+            for w, isFree in tollFree.iteritems ():
+                if isFree and w not in Df:
+                    seeds[w] = Q[w]
+                    if w in P:
+                        Pf[w] = P[w]
+                        Lf[w] = L[w]
+
+            for w, ( cost, v, edge ) in freeLinks.iteritems ():
+                if w not in Df and cost < seeds.get ( w, INFINITY ):
+                    seeds[w] = cost
+                    Pf[w]    = v
+                    Lf[w]    = edge
+
+            Qf = IndexedHeap ()
+            for w, cost in seeds.iteritems ():
+                Qf[w] = cost
+
+            freeTrees.append ( ( Qf, Df, Pf, Lf, seeds ) )
+
+        # the best toll free path through a node reached from both ends
+        muFree       = INFINITY
+        midPointFree = None
+
+        forwardLabels  = [ freeTrees [0][1], freeTrees [0][4] ]
+        backwardLabels = [ freeTrees [1][1], freeTrees [1][4] ]
+
+        for labels in forwardLabels:
+            for w, cost in labels.iteritems ():
+                for otherLabels in backwardLabels:
+                    other = otherLabels.get ( w )
+                    if other is not None and cost + other < muFree:
+                        muFree       = cost + other
+                        midPointFree = w
+
+        while True:
+
+            Qf, Qf2 = freeTrees [0][0], freeTrees [1][0]
+
+            top  = Qf  [Qf.smallest  ()] if Qf  else INFINITY
+            top2 = Qf2 [Qf2.smallest ()] if Qf2 else INFINITY
+
+            if top + top2 >= muFree:
                 break
 
-            for w2 in G[v2]:
+            if Qf and ( len (Qf) <= len (Qf2) or not Qf2 ):
+                search, other = freeTrees [0], freeTrees [1]
+            else:
+                search, other = freeTrees [1], freeTrees [0]
+
+            Qf, Df, Pf, Lf = search [:4]
+            otherQf, otherDf = other [0], other [1]
+
+            v = Qf.smallest ()
+            d = Df[v] = Qf[v]
+            Qf.pop_smallest ()
+            settledFree += 1
+
+            for w, edge in G[v].iteritems ():
+
+                if w in Df or edge.isToll:
+                    continue
+
+                vwLength = d + edge.getCost ()
+
+                q = Qf.get ( w )
+                if q is not None and vwLength >= q:
+                    continue
+
+                Qf[w] = vwLength
+                Pf[w] = v
+                Lf[w] = edge
+
+                other = otherDf.get ( w )
+                if other is None:
+                    other = otherQf.get ( w )
+                if other is not None and vwLength + other < muFree:
+                    muFree       = vwLength + other
+                    midPointFree = w
+
+        freePath = None
+        if midPointFree is not None:
+            freePath = _pathFromTrees ( freeTrees [0][2], freeTrees [1][2], 
+                                        freeTrees [0][3], freeTrees [1][3], 
+                                        start, end, midPointFree )
+
+    if stats is not None:
+        stats ['settled']         = settledToll + settledFree
+        stats ['settledToll']     = settledToll
+        stats ['settledTollFree'] = settledFree
+        stats ['shared']          = shared
+
+    return tollPath, freePath
+
+
+def _keepFreeLink ( freeLinks, w, cost, v, edge ):
+
+    ''' Note a toll free path to w, via v, if it is the best yet '''
+
+    link = freeLinks.get ( w )
+    if link is None or cost < link [0]:
+        freeLinks [w] = ( cost, v, edge )
+
+
+class StraightLineHeuristic (object):
+
+    '''
+    Estimate of the travel time (hrs) from a node to the end node that 
+    never exceeds the true cost: the great circle distance covered at 
+    the maximum road speed.
+
+    Nodes hold no co-ordinates of their own, so a node is located by the 
+    centroid (mid-point) of an edge that touches it.  The node can be up 
+    to half of that edge's length from the centroid, so this slack is 
+    taken off the distance at both ends.
+
+    '''
+
+    def __init__ (self, G, end, maxSpeedKMH = MAX_ROAD_SPEED_KMH):
+
+        self.maxSpeedKMH = float (maxSpeedKMH)
+
+        # locate the end node by its shortest edge (the tightest slack)
+        endEdge = min ( G[end].itervalues (), key = lambda e: e.lengthKM )
+
+        self.endX       = endEdge.CentroidX
+        self.endY       = endEdge.CentroidY
+        self.endSlackKM = endEdge.lengthKM / 2.0
+
+    def estimate (self, node, viaEdge):
+
+        '''
+        @node     the node to estimate from
+        @viaEdge  DataStructures.GISEdge touching node
+        '''
+
+        distKM = gis.greatCircleDistanceKM ( viaEdge.CentroidX, viaEdge.CentroidY, 
+                                             self.endX, self.endY ) \
+                 - viaEdge.lengthKM / 2.0 - self.endSlackKM
+
+        if distKM <= 0:
+            return 0.0
+
+        return distKM / self.maxSpeedKMH
+
+
+def AStar(G,start,end,heuristic=None,stats=None):
+
+    '''
+    Goal directed variant of Dijkstra.  The queue is ordered by the 
+    distance from start plus heuristic.estimate () of the distance to 
+    end, so nodes leading away from the end are rarely expanded.
+
+    The estimate of a node is computed once, from the edge that first 
+    reaches it.  Such estimates are admissible but not necessarily 
+    consistent, so a settled node is re-opened if a shorter path to it 
+    is found later.
+
+    Returns P, L, D as Dijkstra2 (predecessors, links, distances), for 
+    the settled nodes.
+
+    '''
+
+    if heuristic is None:
+        heuristic = StraightLineHeuristic ( G, end )
+
+    D = {}      # dictionary of final distances (float)
+    P = {}      # dictionary of predecessors
+    L = {}      # dictionary of links to predecessor of type EdgeCost
+    g = {}      # best known distance from start (float)
+    H = {}      # dictionary of estimates to end (float)
+
+    Q = IndexedHeap ()
+    Q [start] = 0
+    g [start] = 0
+
+    settled = 0
+
+    while Q:
+
+        v = Q.pop_smallest ()
+        D[v] = g[v]
+        settled += 1
+
+        if v == end:
+            break
+
+        for w, edge in G[v].iteritems ():
+
+            vwLength = D[v] + edge.getCost ()
+
+            if w in g and vwLength >= g[w]:
+                continue
+
+            if w not in H:
+                H[w] = heuristic.estimate ( w, edge )
+
+            g[w] = vwLength
+            P[w] = v
+            L[w] = edge
 
-                vwLength = D2[v2] + (G[v2][w2]).getCost ()
-                if w2 in D2:
-                    if vwLength < D2[w2]:
-		        raise ValueError, \
-                        "Dijkstra: found better path to already-final vertex"
-    	        elif w2 not in Q2 or vwLength < Q2[w2]:
+            D.pop ( w, None )   # re-open w if it was settled
+            Q[w] = vwLength + H[w]
 
-                    Q2[w2] = vwLength
+    if stats is not None:
+        stats ['settled'] = settled
 
-		    P2[w2] = v2
-                    L2[w2] = G[v2][w2]
+    if end not in D:
+        raise AppError (utils.timestampStr (), 'algorithms.AStar', \
+                        'No route found from %s to %s' %(start, end), None )
 
-            last_v  = v
-            last_v2 = v2
+    return P, L, D
 
-            Q.pop_smallest ()
-            Q2.pop_smallest ()
 
-        print "returning"
+def shortestPathAStar(G,start,end,stats=None,heuristic=None):
 
-        return P, P2, L, L2, midPoint
+    '''
+    As shortestPath2, but using AStar.  The edges are returned in order 
+    from start to end.
+    '''
 
+    P, L, D = AStar ( G, start, end, heuristic, stats )
 
-def shortestPath2(G,start,end):
-	"""
-	Find a single shortest path from the given start vertex
-	to the given end vertex.
-	The input has the same conventions as Dijkstra().
-	The output is a list of the vertices in order along
-	the shortest path.
-	"""
+    Path = []
 
-	P,P2,L,L2,midPoint = Dijkstra2(G,start,end)
+    node = end
+    while node != start:
+        Path.append ( L[node] )
+        node = P[node]
 
-	Path = []
+    Path.reverse ()
 
-        tmpMidPoint = midPoint
-	while 1:
-                try:
-    		    Path.append( L[tmpMidPoint] )
-                except:
-                    pass
-		if tmpMidPoint == start: break
-		tmpMidPoint = P[tmpMidPoint]
+    return Path
 
-        Path2 = []
 
-        tmpMidPoint = midPoint
-	while 1:
-                try:
-    		    Path2.append( L2[tmpMidPoint] )
-                except:
-                    pass
+def oneToMany(G,start,targets,stats=None):
 
-		if tmpMidPoint == end: break
-		tmpMidPoint = P2[tmpMidPoint]
+    '''
+    Dijkstra from start, stopping once every node in targets is settled
+    (or nothing more can be reached).  Distance and toll distance are 
+    carried along each path with its cost.
 
-	return Path + Path2
+    Returns { target: (costHRS, lengthKM, tollKM) } for the targets reached.
+    '''
+
+    remaining = set ( targets )
+    result    = {}
+
+    D  = {}                 # dictionary of final distances (float)
+    KM = { start: 0.0 }     # length of the path to each node
+    TK = { start: 0.0 }     # toll length of the path to each node
+
+    Q = IndexedHeap ()
+    Q [start] = 0.0
+
+    while Q and remaining:
+
+        v = Q.smallest ()
+        D[v] = Q[v]
+        Q.pop_smallest ()
+
+        if v in remaining:
+            remaining.discard ( v )
+            result [v] = ( D[v], KM[v], TK[v] )
+
+        for w, edge in G[v].iteritems ():
+
+            if w in D:
+                continue
+
+            vwLength = D[v] + edge.getCost ()
+
+            if w not in Q or vwLength < Q[w]:
+                Q[w]  = vwLength
+                KM[w] = KM[v] + edge.lengthKM
+                TK[w] = TK[v]
+                if edge.isToll:
+                    TK[w] += edge.lengthKM
+
+    if stats is not None:
+        stats ['settled'] = len (D)
+
+    return result
+
+
+def reachableWithin(G,start,budget,avoidToll=False,beforeExpand=None,stats=None):
+
+    '''
+    Dijkstra from start to every node that can be reached at a cost of 
+    no more than budget (e.g. hrs).
+
+    @avoidToll      do not use edges with isToll set
+    @beforeExpand   optional function (node, viaEdge) called before the 
+                    edges of each node are read, e.g. to load the tile 
+                    graphs that the search has just reached.  viaEdge is 
+                    None for start.
+
+    Returns D, L: the cost to each node and the link used to reach it.
+    '''
+
+    D = {}      # dictionary of final distances (float)
+    L = {}      # dictionary of links to predecessor of type EdgeCost
+
+    Q = IndexedHeap ()
+    Q [start] = 0.0
+
+    while Q:
+
+        v = Q.smallest ()
+        if Q[v] > budget:
+            break
+
+        D[v] = Q[v]
+        Q.pop_smallest ()
+
+        if beforeExpand is not None:
+            beforeExpand ( v, L.get ( v ) )
+
+        for w, edge in G[v].iteritems ():
+
+            if w in D:
+                continue
+            if avoidToll and edge.isToll:
+                continue
+
+            vwLength = D[v] + edge.getCost ()
+
+            if vwLength <= budget and ( w not in Q or vwLength < Q[w] ):
+                Q[w] = vwLength
+                L[w] = edge
+
+    if stats is not None:
+        stats ['settled'] = len (D)
+
+    return D, L
+
+
+def alternativeRoutes(G,start,end,k=3,stretch=1.25,minPlateau=0.1,maxShared=0.8,
+                      stats=None,avoidToll=False):
+
+    '''
+    Up to k meaningfully different routes from start to end, best first, 
+    e.g. via the M6 Toll, via the M6 and via the M42/A5.  
+
+    Uses the plateau method: one forward and one backward search tree 
+    (_searchTrees run on to stretch times the best cost) rather than k
+    searches.  A plateau is a run of edges that is in both trees.  Each 
+    plateau gives a route: from start along the forward tree to the end 
+    of the plateau, then along the backward tree to end.  A long plateau 
+    marks a route that is the best way between its own points.
+
+    The shortest route comes first.  Then routes are chosen in order of
+    plateau length if they 
+      - cost no more than stretch times the shortest route 
+      - have a plateau of at least minPlateau times its cost
+      - share no more than maxShared of their cost with any route 
+        already taken
+
+    and returned in order of cost.
+
+    Returns a list of lists of GISEdges.
+    '''
+
+    D, D2, P, P2, L, L2, midPoint, mu = \
+        _searchTrees ( G, start, end, stats, avoidToll, stretch )
+
+    plateaus = []
+    seen     = set ()
+
+    for v in D:
+
+        if v in seen or v not in D2 or D[v] + D2[v] > stretch * mu:
+            continue
+
+        # follow the edges that are in both trees back, then forward, from v
+        first = v
+        while first in P and P2.get ( P[first] ) == first:
+            first = P[first]
+
+        last = v
+        while last in P2 and P.get ( P2[last] ) == last:
+            last = P2[last]
+
+        node = last
+        seen.add ( node )
+        while node != first:
+            node = P[node]
+            seen.add ( node )
+
+        plateaus.append ( ( D[last] - D[first], last ) )
+
+    plateaus.sort ( reverse = True )
+
+    routes = [ _pathFromTrees ( P, P2, L, L2, start, end, midPoint ) ]
+
+    for plateauCost, last in plateaus:
+
+        if len ( routes ) >= k:
+            break
+
+        if plateauCost < minPlateau * mu:
+            break
+
+        route = _pathFromTrees ( P, P2, L, L2, start, end, last )
+        routeCost = sum ( [ e.getCost () for e in route ] )
+
+        distinct = True
+        for other in routes:
+            otherIDs = set ( [ e.edgeID for e in other ] )
+            shared = sum ( [ e.getCost () for e in route if e.edgeID in otherIDs ] )
+            if shared > maxShared * routeCost:
+                distinct = False
+                break
 
+        if distinct:
+            routes.append ( route )
 
+    routes.sort ( key = lambda r: sum ( [ e.getCost () for e in r ] ) )
 
+    return routes
@@ -0,0 +1,400 @@
+
+'''
+
+Benchmarks for the routing code.  Run from the command line, not part
+of the web app.
+
+Functions in this module are:
+
+- queueBenchmark      Time one to all Dijkstra searches over the same graph
+                      with each priority queue class (e.g. priority_dict
+                      and IndexedHeap)
+
+- edgeSizeBenchmark   Bytes per edge of a tile loaded as GISEdges, as 
+                      CompactEdges and as CompactEdges with memory mapped 
+                      geometry
+
+- tileLoadBenchmark   Seconds to load a tile as a CSRGraph from text and
+                      from its compiled file (TileCompiler)
+
+- routingBenchmark    Run a fixed set of route queries through the
+                      DataStore, GraphRepository and each routing engine
+                      (RoutingFacade.findRoute).  Reports latency 
+                      percentiles, settled nodes and peak memory.
+
+Run with:
+
+    python benchmarks.py heap <edgeFile|s3> <numSearches> <tileID> [<tileID> ..]
+
+    python benchmarks.py edges <edgeFile|s3> <tileID>
+
+    python benchmarks.py route <edgeFile> <numQueries> <outFile.json> <tileID> [<tileID> ..]
+
+    python benchmarks.py load <edgeFile> <compiledDir> <tileID>
+
+The route benchmark can be run on a network from SyntheticNetwork.py.
+Set env TOLL_BENCHMARK_ENGINES (e.g. 'dijkstra,astar') to run only some
+engines.  Results are saved as JSON so that runs can be compared.
+
+'''
+
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+from DataStructures import priority_dict, IndexedHeap
+from Instrumentation import QueryStats, StatsAggregate
+
+
+def _oneToAll (G, source, queueClass):
+
+    '''
+    Dijkstra from source over the whole of G, as in the engines' hot loop.
+    Returns the number of settled nodes.
+    '''
+
+    D = {}
+    Q = queueClass ()
+    Q [source] = 0.0
+
+    while Q:
+        v = Q.smallest ()
+        D [v] = Q [v]
+        Q.pop_smallest ()
+
+        for w, edge in G[v].iteritems ():
+            if w in D:
+                continue
+            dw = D[v] + edge.getCost ()
+            if w not in Q or dw < Q[w]:
+                Q [w] = dw
+
+    return len (D)
+
+
+def queueBenchmark (G, sources, queueClasses = None):
+
+    '''
+    @G             graph (or CompositeGraph) to search
+    @sources       list of start nodes, one search each
+    @queueClasses  list of priority queue classes.  Default priority_dict
+                   and IndexedHeap
+
+    Returns { class name: (seconds, settled nodes) } totalled over sources.
+    '''
+
+    if queueClasses is None:
+        queueClasses = [ priority_dict, IndexedHeap ]
+
+    results = {}
+
+    for queueClass in queueClasses:
+
+        settled   = 0
+        startTime = time.time ()
+
+        for source in sources:
+            settled += _oneToAll ( G, source, queueClass )
+
+        results [queueClass.__name__] = ( time.time () - startTime, settled )
+
+    return results
+
+
+def edgeSizeBenchmark (dataStore, aTile):
+
+    '''
+    Load aTile as a dict of dicts of GISEdges (loadEdgeGraphForTile), of
+    CompactEdges (loadCompactGraphForTile) and of CompactEdges with memory 
+    mapped geometry (loadMappedGraphForTile).  Returns { format: bytes per
+    edge } where the bytes are everything reachable from the graph in the
+    heap: the dicts, edges, node names, numbers and geometry.
+    '''
+
+    result = {}
+
+    for name, loader in [ ( 'GISEdge',     dataStore.loadEdgeGraphForTile ),
+                          ( 'CompactEdge', dataStore.loadCompactGraphForTile ),
+                          ( 'mapped',      dataStore.loadMappedGraphForTile ) ]:
+
+        graph = loader ( aTile )
+
+        numEdges = len ( set ( [ id (e) for v in graph for e in graph[v].itervalues () ] ) )
+
+        result [name] = _deepSize ( graph ) / float ( max ( numEdges, 1 ) )
+
+    return result
+
+
+def _deepSize (obj):
+
+    '''
+    sys.getsizeof of obj and everything reachable from it, each object
+    counted once
+    '''
+
+    seen  = set ()
+    total = 0
+    stack = [ obj ]
+
+    while stack:
+
+        o = stack.pop ()
+        if id (o) in seen:
+            continue
+        seen.add ( id (o) )
+
+        total += sys.getsizeof ( o )
+
+        if isinstance ( o, dict ):
+            stack.extend ( o.iterkeys () )
+            stack.extend ( o.itervalues () )
+        elif isinstance ( o, (list, tuple, set) ):
+            stack.extend ( o )
+        else:
+            if hasattr ( o, '__dict__' ):
+                stack.append ( o.__dict__ )
+            for cls in type (o).__mro__:
+                for slot in cls.__dict__.get ( '__slots__', () ):
+                    if hasattr ( o, slot ):
+                        stack.append ( getattr ( o, slot ) )
+
+    return total
+
+
+def tileLoadBenchmark (textStore, compiledStore, aTile, repeats = 3):
+
+    '''
+    Best of repeats seconds for loadCSRGraphForTile of aTile from
+    textStore and from compiledStore (a DataStore.CompiledDataStore).
+    Returns { 'text': seconds, 'compiled': seconds }.
+    '''
+
+    result = {}
+
+    for name, dataStore in [ ( 'text', textStore ), ( 'compiled', compiledStore ) ]:
+
+        best = None
+
+        for n in range ( repeats ):
+            startTime = time.time ()
+            dataStore.loadCSRGraphForTile ( aTile )
+            secs = time.time () - startTime
+            if best is None or secs < best:
+                best = secs
+
+        result [name] = best
+
+    return result
+
+
+def routingBenchmark (dataStore, lstTileIDs, queries, engines = None):
+
+    '''
+    @dataStore     DataStore.GenericDataStore holding the tiles
+    @lstTileIDs    tiles the queries need.  Loaded into the GraphRepository
+                   first, so that tile loading is timed apart from routing.
+    @queries       list of (X1, Y1, X2, Y2)
+    @engines       names from RoutingFacade.ROUTING_ENGINES.  Default all.
+                   The 'ch' and 'alt' data are built from the tiles unless 
+                   env TOLL_CH_FILE / TOLL_LANDMARK_FILE name a file.
+
+    Returns a dict (saved as JSON by the command line) of
+
+        'tileLoadSecs'   { tileID: seconds }
+        'buildSecs'      { engine: seconds to build its preprocessed data }
+        'peakRSSKB'      peak resident memory after loading / after routing
+        'engines'        { engine: Instrumentation.StatsAggregate.summary ()
+                           for the queries, plus 'failures' }
+    '''
+
+    import RoutingFacade
+    import ContractionHierarchy
+    import Landmarks
+    from gis import Locator
+    from apperror import AppError
+
+    if engines is None:
+        engines = sorted ( RoutingFacade.ROUTING_ENGINES )
+
+    result = { 'numQueries'  : len (queries),
+               'tiles'       : list (lstTileIDs),
+               'tileLoadSecs': {},
+               'buildSecs'   : {},
+               'peakRSSKB'   : {},
+               'engines'     : {} }
+
+    repo = RoutingFacade.GraphRepository.getGraphRepository ()
+
+    for tileID in lstTileIDs:
+        startTime = time.time ()
+        repo [tileID] = RoutingFacade._loadTileGraph ( dataStore, Locator.getTileFromID ( tileID ) )
+        result ['tileLoadSecs'][tileID] = time.time () - startTime
+
+    result ['peakRSSKB']['loaded'] = _peakRSSKB ()
+
+    lstGraphs = [ repo [tileID] for tileID in lstTileIDs ]
+
+    if 'ch' in engines and 'TOLL_CH_FILE' not in os.environ:
+        startTime = time.time ()
+        ContractionHierarchy.aContractionHierarchy = \
+            ContractionHierarchy.ContractionHierarchy.build ( lstGraphs )
+        result ['buildSecs']['ch'] = time.time () - startTime
+
+    if 'alt' in engines and 'TOLL_LANDMARK_FILE' not in os.environ:
+        startTime = time.time ()
+        Landmarks.aLandmarkTable = Landmarks.LandmarkTable.build ( lstGraphs )
+        result ['buildSecs']['alt'] = time.time () - startTime
+
+    for engine in engines:
+
+        aggregate = StatsAggregate ( maxSamples = len (queries) )
+        failures  = 0
+
+        for X1, Y1, X2, Y2 in queries:
+
+            queryStats = QueryStats ( engine )
+            try:
+                if RoutingFacade.findRoute ( X1, Y1, X2, Y2, engine, dataStore, 
+                                             queryStats ) is None:
+                    failures += 1
+                    continue
+            except AppError:
+                failures += 1
+                continue
+
+            aggregate.record ( queryStats )
+
+        summary = aggregate.summary ().get ( engine, { 'queries': 0 } )
+        summary ['failures'] = failures
+        result ['engines'][engine] = summary
+
+    result ['peakRSSKB']['routed'] = _peakRSSKB ()
+
+    return result
+
+
+def _peakRSSKB ():
+
+    '''
+    Peak resident memory of this process so far (KB on Linux)
+    '''
+
+    return resource.getrusage ( resource.RUSAGE_SELF ).ru_maxrss
+
+
+def _loadGraph (dataStoreName, lstTileIDs):
+
+    '''
+    Load the tiles into a private GraphRepository and return a CompositeGraph
+    over them and a list of their nodes
+    '''
+
+    from gis import Locator
+    from DataStore import FileDataStore, AWS_S3DataStore
+    from DataStructures import CompositeGraph
+    from GraphRepository import GraphRepository
+
+    if dataStoreName == 's3':
+        dataStore = AWS_S3DataStore ()
+    else:
+        dataStore = FileDataStore ( dataStoreName )
+
+    repo  = GraphRepository ( [] )
+    nodes = []
+
+    for tileID in lstTileIDs:
+        print "loading tile %s" %(tileID)
+        graph = dataStore.loadEdgeGraphForTile ( Locator.getTileFromID ( tileID ) )
+        repo [tileID] = graph
+        nodes.extend ( graph.iterkeys () )
+
+    return CompositeGraph ( repo ), nodes
+
+
+def _printRoutingResult (result):
+
+    print "%-10s %8s %8s %10s %10s %10s %10s" %( 'engine', 'queries', 'failed', 
+                                                'p50 secs', 'p95 secs', 'p99 secs', 'settled' )
+
+    for engine, summary in sorted ( result ['engines'].iteritems () ):
+        if not summary ['queries']:
+            print "%-10s %8s %8s" %( engine, 0, summary ['failures'] )
+            continue
+        total = summary ['phaseSecs']['total']
+        print "%-10s %8s %8s %10.4f %10.4f %10.4f %10.0f" %( engine, summary ['queries'], 
+              summary ['failures'], total ['p50'], total ['p95'], total ['p99'],
+              summary ['meanCounters'].get ( 'settled', 0 ) )
+
+    print "peak memory %s KB" %( result ['peakRSSKB']['routed'] )
+
+
+if __name__ == "__main__":
+
+    if len ( sys.argv ) >= 6 and sys.argv[1] == 'route':
+
+        from DataStore import FileDataStore
+        from SyntheticNetwork import generateQueries
+
+        lstTileIDs = sys.argv[5:]
+        queries    = generateQueries ( lstTileIDs, int ( sys.argv[3] ) )
+
+        engines = None
+        if os.environ.get ( 'TOLL_BENCHMARK_ENGINES' ):
+            engines = os.environ ['TOLL_BENCHMARK_ENGINES'].split (',')
+
+        result = routingBenchmark ( FileDataStore ( sys.argv[2] ), lstTileIDs, 
+                                    queries, engines )
+
+        fs = open ( sys.argv[4], 'w' )
+        json.dump ( result, fs, indent = 2, sort_keys = True )
+        fs.close ()
+
+        _printRoutingResult ( result )
+        sys.exit (0)
+
+    if len ( sys.argv ) == 5 and sys.argv[1] == 'load':
+
+        from gis import Locator
+        from DataStore import FileDataStore, CompiledFileDataStore
+
+        for name, secs in sorted ( tileLoadBenchmark ( FileDataStore ( sys.argv[2] ),
+                                       CompiledFileDataStore ( sys.argv[3] ),
+                                       Locator.getTileFromID ( sys.argv[4] ) ).iteritems () ):
+            print "%-10s %8.3f secs" %( name, secs )
+        sys.exit (0)
+
+    if len ( sys.argv ) == 4 and sys.argv[1] == 'edges':
+
+        from gis import Locator
+        from DataStore import FileDataStore, AWS_S3DataStore
+
+        if sys.argv[2] == 's3':
+            dataStore = AWS_S3DataStore ()
+        else:
+            dataStore = FileDataStore ( sys.argv[2] )
+
+        for name, size in sorted ( edgeSizeBenchmark ( dataStore, 
+                                       Locator.getTileFromID ( sys.argv[3] ) ).iteritems () ):
+            print "%-12s %6.0f bytes per edge" %( name, size )
+        sys.exit (0)
+
+    if len ( sys.argv ) < 5 or sys.argv[1] != 'heap':
+        print "usage: python benchmarks.py heap <edgeFile|s3> <numSearches> <tileID> [<tileID> ..]"
+        print "       python benchmarks.py edges <edgeFile|s3> <tileID>"
+        print "       python benchmarks.py route <edgeFile> <numQueries> <outFile.json> <tileID> [<tileID> ..]"
+        print "       python benchmarks.py load <edgeFile> <compiledDir> <tileID>"
+        sys.exit (1)
+
+    G, nodes = _loadGraph ( sys.argv[2], sys.argv[4:] )
+
+    random.seed ( 1 )
+    sources = random.sample ( nodes, min ( int ( sys.argv[3] ), len (nodes) ) )
+
+    print "%s nodes, %s searches" %( len (nodes), len (sources) )
+
+    for name, (secs, settled) in sorted ( queueBenchmark ( G, sources ).iteritems () ):
+        print "%-15s %8.3f secs  %8.1f settled nodes/ms" %( name, secs, settled / ( 1000.0 * secs ) )
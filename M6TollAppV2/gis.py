@@ -16,8 +16,16 @@ Also, module functions:
 
 _pythagorasDistance               
 
+greatCircleDistanceKM  Distance in km between two (longitude, latitude) points
+
 MergeWKT          Adds two or more LINESTRINGs together to produce a MULTILINESTRING
 
+multiLineStringWKT  Joins a list of LINESTRINGs into one MULTILINESTRING
+
+convexHull        Smallest convex polygon around a set of points
+
+polygonWKT        POLYGON well known text for a list of points
+
 '''
 import math
 
@@ -116,6 +124,16 @@ class Locator ():
 
         return Tile ( xVal , yVal)
 
+    @classmethod
+    def getTileFromID (cls, tileID):
+        '''
+        Inverse of Tile.getID () e.g. "m-1.51" is Tile (-1, 51)
+        '''
+
+        xStr, yStr = str (tileID).replace ('m','').split ('.')
+
+        return Tile ( int (xStr), int (yStr) )
+
     @classmethod
     def closestEdgeInGraph (cls, X, Y, aGraph ):
 
@@ -134,16 +152,23 @@ class Locator ():
         maxDist = 10000000000
         closestEdge = None
 
-        for i in aGraph.iterkeys ():
-            for thisEdge in (aGraph[i]).itervalues ():
+        if hasattr ( aGraph, 'closestEdge' ):
+
+            # e.g. DataStructures.CSRGraph searches its own arrays
+            closestEdge = aGraph.closestEdge ( X, Y )
+
+        else:
+
+            for i in aGraph.iterkeys ():
+                for thisEdge in (aGraph[i]).itervalues ():
 
-                dist = _pythagorasDistance ( X, Y , \
-                                    thisEdge.CentroidX, \
-                                    thisEdge.CentroidY )
+                    dist = _pythagorasDistance ( X, Y , \
+                                        thisEdge.CentroidX, \
+                                        thisEdge.CentroidY )
 
-                if dist < maxDist:
-                    maxDist = dist
-                    closestEdge = thisEdge
+                    if dist < maxDist:
+                        maxDist = dist
+                        closestEdge = thisEdge
 
         if (not closestEdge ):
             raise AppError (utils.timestampStr (), 'gis.Locator.locateEdgeInGraph', \
@@ -185,6 +210,20 @@ class Locator ():
 
         return resultList
 
+    @classmethod
+    def getTileCorridorSet (cls, X1, Y1, X2, Y2, marginDeg ):
+    
+        '''
+
+        The bounding set of the rectangle around point 1 and point 2
+        widened by marginDeg degrees on every side, so that a route 
+        may run a little outside the tiles of the two points.
+
+        '''
+
+        return Locator.getTileBoundingSet ( min (X1, X2) - marginDeg, min (Y1, Y2) - marginDeg,
+                                            max (X1, X2) + marginDeg, max (Y1, Y2) + marginDeg )
+
 def _pythagorasDistance ( X1, Y1, X2, Y2 ):
  
     side1 = abs( float (Y2) - float (Y1)  )
@@ -193,6 +232,28 @@ def _pythagorasDistance ( X1, Y1, X2, Y2 ):
     return math.sqrt ( math.pow ( side1, 2 ) + math.pow ( side2, 2 ) ) 
 
 
+EARTH_RADIUS_KM = 6371.0
+
+def greatCircleDistanceKM ( X1, Y1, X2, Y2 ):
+
+    '''
+    Haversine distance in km between (X1,Y1) and (X2,Y2), where X is 
+    longitude and Y is latitude in degrees (as in the edge centroids).
+
+    No road between the two points can be shorter than this.
+    '''
+
+    lon1 = math.radians ( float (X1) )
+    lat1 = math.radians ( float (Y1) )
+    lon2 = math.radians ( float (X2) )
+    lat2 = math.radians ( float (Y2) )
+
+    a = math.sin ( (lat2 - lat1) / 2 ) ** 2 + \
+        math.cos ( lat1 ) * math.cos ( lat2 ) * math.sin ( (lon2 - lon1) / 2 ) ** 2
+
+    return 2 * EARTH_RADIUS_KM * math.asin ( min ( 1.0, math.sqrt ( a ) ) )
+
+
 
 def mergeWKT ( firstWKT , secondWKT ): 
   def extractCoords( inWKT ):
@@ -211,3 +272,57 @@ def mergeWKT ( firstWKT , secondWKT ):
            extractCoords (firstWKT) + ")"
 
 
+def multiLineStringWKT ( lstWKT ):
+
+  '''
+  As repeated mergeWKT, but in a single pass for a long list of LINESTRINGs
+  '''
+
+  lstCoords = [ aWKT [ len ('LINESTRING') : ] for aWKT in lstWKT \
+                if aWKT and aWKT[0:len('LINESTRING')] == "LINESTRING" ]
+
+  if len ( lstCoords ) == 0: return None
+
+  return "MULTILINESTRING(" + ','.join ( lstCoords ) + ")"
+
+
+def convexHull ( points ):
+
+  '''
+  Andrew's monotone chain. Returns the hull of a list of (x, y), 
+  anti-clockwise from the lowest point.
+  '''
+
+  points = sorted ( set ( points ) )
+
+  if len ( points ) <= 2: return points
+
+  def cross ( o, a, b ):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+  lower = []
+  for p in points:
+    while len (lower) >= 2 and cross ( lower[-2], lower[-1], p ) <= 0:
+      lower.pop ()
+    lower.append ( p )
+
+  upper = []
+  for p in reversed ( points ):
+    while len (upper) >= 2 and cross ( upper[-2], upper[-1], p ) <= 0:
+      upper.pop ()
+    upper.append ( p )
+
+  return lower[:-1] + upper[:-1]
+
+
+def polygonWKT ( points ):
+
+  '''
+  e.g. [(0,0), (1,0), (1,1)] -> "POLYGON((0 0,1 0,1 1,0 0))"
+  '''
+
+  if len ( points ) < 3: return None
+
+  ring = list ( points ) + [ points[0] ]
+
+  return "POLYGON((" + ','.join ( [ "%s %s" %(x, y) for x, y in ring ] ) + "))"
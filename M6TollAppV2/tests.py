@@ -573,6 +573,2343 @@ class Test_gisLocator (unittest.TestCase):
         result = RoutingFacade.findRoute ( -0.881398612739, 51.6060585561, 0.41067037805, 51.6029081682 )
 
 
+import gis
+from algorithms import shortestPathAStar, AStar
+
+def _makeGridGraph (size, spacing = 0.01, speedKMH = 50.0, fastRow = None, 
+                    origin = (-2, 52) ):
+
+    '''
+    Helper: a size x size grid of GISEdges from origin with node names 
+    'i.j'.  Edges in row fastRow run at twice speedKMH (a motorway).
+    '''
+
+    G = {}
+
+    def addEdge ( a, b ):
+        x1, y1 = origin[0] + a[0] * spacing, origin[1] + a[1] * spacing
+        x2, y2 = origin[0] + b[0] * spacing, origin[1] + b[1] * spacing
+        km = gis.greatCircleDistanceKM ( x1, y1, x2, y2 )
+        speed = speedKMH
+        if fastRow is not None and a[1] == fastRow and b[1] == fastRow:
+            speed = speedKMH * 2
+        source = '%s.%s' %a
+        target = '%s.%s' %b
+        e = GISEdge ( edgeID = source + '-' + target, sourceNode = source,
+                      targetNode = target, WKT = "LINESTRING(%s %s,%s %s)" %(x1,y1,x2,y2), 
+                      lengthKM = km, edgeCost = km / speed, 
+                      centroidWKT = "POINT(%s %s)" %( (x1+x2)/2, (y1+y2)/2 ), 
+                      isToll = False )
+        G.setdefault ( source, {} ) [target] = e
+        G.setdefault ( target, {} ) [source] = e
+
+    for i in range ( size ):
+        for j in range ( size ):
+            if i + 1 < size: addEdge ( (i,j), (i+1,j) )
+            if j + 1 < size: addEdge ( (i,j), (i,j+1) )
+
+    return G
+
+def _pathCost ( edgeList ):
+    return sum ( [ e.getCost () for e in edgeList ] )
+
+class Test_AStar (unittest.TestCase):
+
+    def setUp(self):
+        self.G = _makeGridGraph ( 12, fastRow = 5 )
+
+    def testAStarMatchesDijkstra (self):
+
+        '''
+        A* must find a path of the same cost as a plain Dijkstra, 
+        while settling fewer nodes
+        '''
+
+        stats = {}
+        edgeList = shortestPathAStar ( self.G, '0.2', '11.3', stats )
+
+        P, L, D = AStar ( self.G, '0.2', '11.3', heuristic = _ZeroHeuristic () )
+
+        self.failUnless ( abs ( _pathCost (edgeList) - D['11.3'] ) < 1e-9 )
+        self.failUnless ( stats ['settled'] < len (D) )
+
+    def testPathIsConnected (self):
+
+        edgeList = shortestPathAStar ( self.G, '0.0', '4.4' )
+
+        self.failUnless ( len (edgeList) == 8 )
+
+        node = '0.0'
+        for e in edgeList:
+            self.failUnless ( node in (e.sourceNode, e.targetNode) )
+            if node == e.sourceNode: node = e.targetNode
+            else:                    node = e.sourceNode
+        self.failUnless ( node == '4.4' )
+
+    def testNoRoute (self):
+
+        G = _makeGridGraph ( 3 )
+        G.update ( { 'x': { 'y': G['0.0']['1.0'] }, 'y': { 'x': G['0.0']['1.0'] } } )
+
+        self.failUnlessRaises ( AppError, AStar, G, '0.0', 'x', _ZeroHeuristic () )
+
+class _ZeroHeuristic (object):
+
+    ''' A* with a zero estimate is a plain Dijkstra '''
+
+    def estimate (self, node, viaEdge):
+        return 0.0
+
+
+from ContractionHierarchy import ContractionHierarchy
+
+class Test_ContractionHierarchy (unittest.TestCase):
+
+    def setUp(self):
+        self.G = _makeGridGraph ( 8, fastRow = 3 )
+        self.CH = ContractionHierarchy.build ( [ self.G ] )
+
+    def _checkQuery (self, ch, start, end):
+
+        P, L, D = AStar ( self.G, start, end, heuristic = _ZeroHeuristic () )
+
+        cost, edgeList = ch.query ( start, end )
+
+        self.failUnless ( abs ( cost - D[end] ) < 1e-9 )
+        self.failUnless ( abs ( _pathCost (edgeList) - D[end] ) < 1e-9 )
+
+        # the unpacked shortcuts form a connected path of original edges
+        node = start
+        for e in edgeList:
+            self.failUnless ( node in (e.sourceNode, e.targetNode) )
+            if node == e.sourceNode: node = e.targetNode
+            else:                    node = e.sourceNode
+        self.failUnless ( node == end )
+
+    def testQueryMatchesDijkstra (self):
+
+        '''
+        Every route through the hierarchy must cost the same as a plain
+        Dijkstra, and unpack to the original edges
+        '''
+
+        self.failUnless ( len ( self.CH.rank ) == 64 )
+
+        for start, end in [ ('0.0','7.7'), ('7.0','0.7'), ('2.3','6.3'), 
+                            ('5.1','5.2'), ('4.4','4.4') ]:
+            self._checkQuery ( self.CH, start, end )
+
+    def testSaveLoad (self):
+
+        import tempfile, os
+        fd, path = tempfile.mkstemp ()
+        os.close ( fd )
+
+        try:
+            self.CH.save ( path )
+            ch = ContractionHierarchy.load ( path )
+        finally:
+            os.remove ( path )
+
+        self.failUnless ( ch.rank == self.CH.rank )
+
+        cost, edgeList = ch.query ( '0.0', '7.7' )
+        self.failUnless ( abs ( cost - self.CH.query ( '0.0', '7.7' )[0] ) < 1e-9 )
+        self.failUnless ( len ( edgeList ) == 14 )
+
+    def testUnknownNode (self):
+        self.failUnlessRaises ( AppError, self.CH.query, '0.0', 'nowhere' )
+
+
+from Landmarks import LandmarkTable, LandmarkHeuristic
+
+class Test_Landmarks (unittest.TestCase):
+
+    def setUp(self):
+        self.G = _makeGridGraph ( 10, fastRow = 4 )
+        self.table = LandmarkTable.build ( [ self.G ], 4 )
+
+    def testLandmarksOnEdge (self):
+
+        '''
+        The first landmarks of a grid are its corners
+        '''
+
+        corners = set ( [ '0.0', '0.9', '9.0', '9.9' ] )
+        chosen  = set ( [ self.table.nodes[i] for i in self.table.landmarks ] )
+        self.failUnless ( len ( chosen & corners ) >= 2 )
+
+    def testALTMatchesDijkstra (self):
+
+        stats = {}
+        edgeList = shortestPathAStar ( self.G, '1.1', '8.7', stats,
+                                       LandmarkHeuristic ( self.table, '8.7' ) )
+
+        P, L, D = AStar ( self.G, '1.1', '8.7', heuristic = _ZeroHeuristic () )
+
+        self.failUnless ( abs ( _pathCost (edgeList) - D['8.7'] ) < 1e-9 )
+        self.failUnless ( stats ['settled'] < len (D) )
+
+    def testBoundIsAdmissible (self):
+
+        h = LandmarkHeuristic ( self.table, '3.3' )
+        for node in [ '0.0', '9.9', '5.2', '3.3' ]:
+            P, L, D = AStar ( self.G, node, '3.3', heuristic = _ZeroHeuristic () )
+            self.failUnless ( h.estimate ( node, None ) <= D['3.3'] )
+
+    def testSaveLoad (self):
+
+        import tempfile, os
+        fd, path = tempfile.mkstemp ()
+        os.close ( fd )
+
+        try:
+            self.table.save ( path )
+            table = LandmarkTable.load ( path )
+        finally:
+            os.remove ( path )
+
+        self.failUnless ( table.nodes     == self.table.nodes )
+        self.failUnless ( table.landmarks == self.table.landmarks )
+        self.failUnless ( table.distances == self.table.distances )
+
+
+from DataStructures import CSRGraph
+
+class Test_CSRGraph (unittest.TestCase):
+
+    def setUp(self):
+        self.G   = _makeGridGraph ( 6, fastRow = 2 )
+        self.CSR = CSRGraph.fromGraph ( self.G )
+
+    def testMappingProtocol (self):
+
+        '''
+        The CSR graph must look exactly like the dict of dicts
+        '''
+
+        self.failUnless ( len (self.CSR) == len (self.G) )
+        self.failUnless ( sorted ( self.CSR.keys () ) == sorted ( self.G.keys () ) )
+        self.failUnless ( '0.0' in self.CSR and 'x' not in self.CSR )
+
+        for v in self.G:
+            row = self.CSR [v]
+            self.failUnless ( sorted (row) == sorted (self.G[v]) )
+            for w, edge in row.iteritems ():
+                original = self.G[v][w]
+                self.failUnless ( edge.getCost ()  == original.getCost () )
+                self.failUnless ( edge.sourceNode  == original.sourceNode )
+                self.failUnless ( edge.targetNode  == original.targetNode )
+                self.failUnless ( edge.WKT         == original.WKT )
+                self.failUnless ( edge.CentroidX   == original.CentroidX )
+                self.failUnless ( edge.isToll      == original.isToll )
+
+        # one edge table row per road, shared by both directions
+        self.failUnless ( len ( self.CSR.WKT ) == 60 )
+        self.failUnless ( len ( self.CSR.targets ) == 120 )
+
+    def testRoutingOnCSR (self):
+
+        '''
+        Dijkstra2 / A* and the CompositeGraph run on CSR graphs
+        '''
+
+        P, L, D = AStar ( self.G, '0.0', '5.4', heuristic = _ZeroHeuristic () )
+
+        edgeList = shortestPathAStar ( self.CSR, '0.0', '5.4' )
+        self.failUnless ( abs ( _pathCost (edgeList) - D['5.4'] ) < 1e-9 )
+
+        GR = GraphRepository ([])
+        GR [ Tile (1,1) ] = self.CSR
+        edgeList = shortestPath2 ( CompositeGraph ( GR ), '0.0', '5.4' )
+        self.failUnless ( len ( edgeList ) == 9 )
+
+    def testIndexedSearch (self):
+
+        '''
+        Dijkstra2 on a CSRGraph searches by node index, and finds the 
+        same routes as on the dict of dicts
+        '''
+
+        G   = _makeGridGraph ( 9, fastRow = 6 )
+        CSR = CSRGraph.fromGraph ( G )
+
+        decreases = 0
+
+        for start, end in [ ('0.0','8.8'), ('1.7','7.1'), ('3.3','3.4'), ('2.2','2.2') ]:
+
+            stats    = {}
+            expected = shortestPath2 ( G, start, end )
+            edgeList = shortestPath2 ( CSR, start, end, stats )
+
+            self.failUnless ( abs ( _pathCost (edgeList) - _pathCost (expected) ) < 1e-9 )
+            self.failUnless ( len ( edgeList ) == len ( expected ) )
+            self.failUnless ( stats ['heapPops'] == stats ['settled'] + stats ['stalePops'] )
+
+            # each stale entry was left by a lowered distance
+            self.failUnless ( stats ['decreaseKeys'] >= stats ['stalePops'] )
+            decreases += stats ['decreaseKeys']
+
+            # a connected path from start to end
+            node = start
+            for edge in edgeList:
+                self.failUnless ( node in ( edge.sourceNode, edge.targetNode ) )
+                node = edge.targetNode if node == edge.sourceNode else edge.sourceNode
+            self.failUnless ( node == end )
+
+        self.failUnless ( decreases > 0 )
+
+        # only the nodes of the path are in the trees
+        P, P2, L, L2, midPoint = Dijkstra2 ( CSR, '0.0', '8.8' )
+        self.failUnless ( len (P) + len (P2) == len ( shortestPath2 ( G, '0.0', '8.8' ) ) )
+
+        self.failUnlessRaises ( AppError, Dijkstra2, CSR, '0.0', 'x' )
+
+    def testIndexedSearchAvoidsTolls (self):
+
+        G = _makeGridGraph ( 6, fastRow = 2 )
+        for v in G:
+            for w, edge in G[v].iteritems ():
+                if v.split ('.') [0] == '2' and w.split ('.') [0] == '2':
+                    edge.isToll = True
+        CSR = CSRGraph.fromGraph ( G )
+
+        for avoidToll in ( False, True ):
+            expected = shortestPath2 ( G, '2.0', '2.5', None, avoidToll )
+            edgeList = shortestPath2 ( CSR, '2.0', '2.5', None, avoidToll )
+            self.failUnless ( abs ( _pathCost (edgeList) - _pathCost (expected) ) < 1e-9 )
+            self.failUnless ( any ( [ e.isToll for e in edgeList ] ) != avoidToll )
+
+    def testFromDataStore (self):
+
+        DS = DataStore.TestDataStore ()
+        DS.addEdgeString ( "1911086|1911202|0.0011870678|0.0011870678|0.083094746|70|f|"\
+                           "LINESTRING(-702231.879109461 6431264.28019654,-702291.746731609"\
+                           " 6431378.7559089)|POINT(-6.3085252 49.9135723)|-6|50" )
+        DS.addEdgeString ( "1911202|1892488|0.0060791424|0.0060791424|0.42553997|70|t|"\
+                           "LINESTRING(-635277.602517193 6457741.32494093,-634614.004768676"\
+                           " 6457750.93247799)|POINT(-5.70381517192721 50.0661856778543)|-6|50" )
+
+        G = DS.loadCSRGraphForTile ( Tile (-6,50) )
+
+        self.failUnless ( len (G) == 3 )
+        self.failUnless ( len ( G['1911202'] ) == 2 )
+        self.failUnless ( G['1911202']['1892488'].isToll )
+
+        self.failUnless ( Locator.closestEdgeInGraph ( -6.3, 49.9, G ).edgeID == '1911086-1911202' )
+
+
+from algorithms import Dijkstra2
+
+class Test_Dijkstra2 (unittest.TestCase):
+
+    def _edge (self, a, b, cost):
+        return GISEdge ( edgeID = a + '-' + b, sourceNode = a, targetNode = b,
+                         WKT = None, lengthKM = cost, edgeCost = cost,
+                         centroidWKT = "POINT(0 0)", isToll = False )
+
+    def setUp(self):
+
+        # s-v-t costs 4.0 and is where the two searches first meet, 
+        # but s-x-y-t costs 3.8
+        self.G = {}
+        for a, b, cost in [ ('s','v',2.0), ('v','t',2.0), ('s','x',1.5), 
+                            ('x','y',0.8), ('y','t',1.5) ]:
+            e = self._edge ( a, b, cost )
+            self.G.setdefault ( a, {} ) [b] = e
+            self.G.setdefault ( b, {} ) [a] = e
+
+    def testBestMeetingPoint (self):
+
+        stats = {}
+        edgeList = shortestPath2 ( self.G, 's', 't', stats )
+
+        self.failUnless ( [ e.edgeID for e in edgeList ] == [ 's-x', 'x-y', 'y-t' ] )
+        self.failUnless ( abs ( _pathCost (edgeList) - 3.8 ) < 1e-9 )
+        self.failUnless ( stats ['settled'] == stats ['settledForward'] + 
+                                               stats ['settledBackward'] )
+
+    def testMatchesDijkstraOnGrid (self):
+
+        G = _makeGridGraph ( 9, fastRow = 6 )
+
+        for start, end in [ ('0.0','8.8'), ('1.7','7.1'), ('3.3','3.4'), ('2.2','2.2') ]:
+            P, L, D = AStar ( G, start, end, heuristic = _ZeroHeuristic () )
+            edgeList = shortestPath2 ( G, start, end )
+            self.failUnless ( abs ( _pathCost (edgeList) - D[end] ) < 1e-9 )
+
+    def testNoRoute (self):
+
+        self.G ['z'] = { 'q': self._edge ( 'z', 'q', 1 ) }
+        self.G ['q'] = { 'z': self.G ['z']['q'] }
+
+        self.failUnlessRaises ( AppError, Dijkstra2, self.G, 's', 'z' )
+
+
+def _writeEdgeFile ( G, path, speedKMH = 50 ):
+
+    '''
+    Helper: write the edges of a graph in the pipe delimited format read
+    by DataStore.FileDataStore
+    '''
+
+    fs = open ( path, 'w' )
+    written = set ()
+    for v in G:
+        for w, e in G[v].iteritems ():
+            if id (e) in written: continue
+            written.add ( id (e) )
+            tollFlag = 'f'
+            if e.isToll: tollFlag = 't'
+            fs.write ( '%s|%s|%r|%r|%r|%s|%s|%s|POINT(%r %r)|%s|%s\n' %( 
+                       e.sourceNode, e.targetNode, e.getCost (), e.getCost (), 
+                       e.lengthKM, speedKMH, tollFlag, e.WKT, e.CentroidX, e.CentroidY, 
+                       int ( math.floor ( e.CentroidX ) ), int ( math.floor ( e.CentroidY ) ) ) )
+    fs.close ()
+
+import math
+import json
+import random
+import hashlib
+import os
+import tempfile
+
+class _EdgeFileTestCase (unittest.TestCase):
+
+    '''
+    Helper: writes self.G (from makeGraph) to the edge file self.path 
+    for a FileDataStore, and empties the tile repository before and 
+    after each test
+    '''
+
+    def makeGraph (self):
+        return _makeGridGraph ( 6 )
+
+    def setUp(self):
+
+        self.G = self.makeGraph ()
+
+        fd, self.path = tempfile.mkstemp ()
+        os.close ( fd )
+        _writeEdgeFile ( self.G, self.path )
+
+        RoutingFacade.GraphRepository.getGraphRepository ().clear ()
+
+    def tearDown(self):
+        os.remove ( self.path )
+        RoutingFacade.GraphRepository.getGraphRepository ().clear ()
+
+
+class Test_Matrix (_EdgeFileTestCase):
+
+    def makeGraph (self):
+        return _makeGridGraph ( 8, fastRow = 3 )
+
+    def testOneToMany (self):
+
+        from algorithms import oneToMany
+
+        result = oneToMany ( self.G, '0.0', [ '7.7', '3.2', '0.0' ] )
+
+        for target in [ '7.7', '3.2', '0.0' ]:
+            P, L, D = AStar ( self.G, '0.0', target, heuristic = _ZeroHeuristic () )
+            edgeList = shortestPathAStar ( self.G, '0.0', target )
+            self.failUnless ( abs ( result [target][0] - D[target] ) < 1e-9 )
+            self.failUnless ( abs ( result [target][1] - 
+                                    sum ( [ e.lengthKM for e in edgeList ] ) ) < 1e-9 )
+            self.failUnless ( result [target][2] == 0 )
+
+    def testBucketManyToMany (self):
+
+        ch = ContractionHierarchy.build ( [ self.G ] )
+
+        sources = [ '0.0', '4.5', '7.1' ]
+        targets = [ '7.7', '0.6', '4.5' ]
+
+        table = ch.manyToMany ( sources, targets )
+
+        for i, source in enumerate ( sources ):
+            for j, target in enumerate ( targets ):
+                cost, edgeList = ch.query ( source, target )
+                self.failUnless ( abs ( table[i][j][0] - cost ) < 1e-9 )
+                self.failUnless ( abs ( table[i][j][1] - 
+                                        sum ( [ e.lengthKM for e in edgeList ] ) ) < 1e-9 )
+
+    def testFindMatrix (self):
+
+        '''
+        The matrix from the facade matches individual searches
+        '''
+
+        origins      = [ (-2.0, 52.0), (-1.96, 52.05) ]
+        destinations = [ (-1.93, 52.07), (-2.0, 52.02), (-1.97, 52.0) ]
+
+        result = json.loads ( RoutingFacade.findMatrix ( origins, destinations, 
+                                  dataStore = DataStore.FileDataStore ( self.path ) ) )
+
+        self.failUnless ( len ( result ['TIME_HRS'] ) == 2 )
+        self.failUnless ( len ( result ['TIME_HRS'][0] ) == 3 )
+
+        for i, (X1, Y1) in enumerate ( origins ):
+            for j, (X2, Y2) in enumerate ( destinations ):
+                route = json.loads ( RoutingFacade.findRoute ( X1, Y1, X2, Y2, 
+                                        dataStore = DataStore.FileDataStore ( self.path ) ) )
+                self.failUnless ( abs ( route ['TIME_HRS'] - result ['TIME_HRS'][i][j] ) < 1e-9 )
+                self.failUnless ( abs ( route ['DIST_KM']  - result ['DIST_KM'][i][j] ) < 1e-9 )
+
+        self.failUnless ( result ['ENGINE'] == 'dijkstra' and result ['METHOD'] == 'oneToMany' )
+
+        # goal directed engines have no matrix search
+        self.failUnlessRaises ( AppError, RoutingFacade.findMatrix, origins, destinations, 
+                                'astar', DataStore.FileDataStore ( self.path ) )
+
+
+from algorithms import reachableWithin
+
+class Test_Isochrone (_EdgeFileTestCase):
+
+    def makeGraph (self):
+
+        # a grid that crosses from tile m-3.52 into m-2.52
+        return _makeGridGraph ( 8, fastRow = 0, origin = (-2.04, 52.01) )
+
+    def testBudget (self):
+
+        '''
+        Exactly the nodes within the budget are reached
+        '''
+
+        budget = 0.02
+        D, L = reachableWithin ( self.G, '0.0', budget )
+
+        for node in self.G:
+            P, L2, D2 = AStar ( self.G, '0.0', node, heuristic = _ZeroHeuristic () )
+            self.failUnless ( ( node in D ) == ( D2[node] <= budget ) )
+
+    def testAvoidToll (self):
+
+        for v in self.G:
+            for w, e in self.G[v].iteritems ():
+                e.isToll = ( v.endswith ('.0') and w.endswith ('.0') )
+
+        D, L = reachableWithin ( self.G, '0.0', 1.0 )
+        self.failUnless ( [ e for e in L.values () if e.isToll ] )
+
+        D, L = reachableWithin ( self.G, '0.0', 1.0, avoidToll = True )
+        self.failUnless ( len (D) == 64 )
+        self.failUnless ( not [ e for e in L.values () if e.isToll ] )
+
+    def testFindIsochrone (self):
+
+        '''
+        The tiles around the search are loaded as it reaches them
+        '''
+
+        GR = RoutingFacade.GraphRepository.getGraphRepository ()
+
+        result = json.loads ( RoutingFacade.findIsochrone ( -2.04, 52.01, 1.5, 
+                                  dataStore = DataStore.FileDataStore ( self.path ) ) )
+
+        self.failUnless ( 0 < result ['NUM_NODES'] < 64 )
+        self.failUnless ( 'm-3.52' in GR.getKeys () and len ( GR.getKeys () ) == 9 )
+        self.failUnless ( result ['POLYGON'].startswith ( 'POLYGON((' ) )
+
+        result = json.loads ( RoutingFacade.findIsochrone ( -2.04, 52.01, 60, 
+                                  dataStore = DataStore.FileDataStore ( self.path ) ) )
+
+        self.failUnless ( result ['NUM_NODES'] == 64 )
+        self.failUnless ( 'm-2.52' in GR.getKeys () and 'm-3.52' in GR.getKeys () )
+        self.failUnless ( not result ['TRUNCATED'] )
+        self.failUnless ( result ['WKT'].count ( '(' ) == 64 )
+
+    def testTilesPinned (self):
+
+        '''
+        The tiles an isochrone uses stay pinned until its search ends
+        '''
+
+        GR = RoutingFacade.GraphRepository.getGraphRepository ()
+        pinned = []
+
+        def spy ( G, start, budget, avoidToll, beforeExpand, stats ):
+            def checkPins ( node, viaEdge ):
+                beforeExpand ( node, viaEdge )
+                # the search sees just the pinned tiles
+                pinned.append ( set ( GR.pinCounts ) == set ( GR.getKeys () ) == G.tileIDs )
+            return reachableWithin ( G, start, budget, avoidToll, checkPins, stats )
+
+        RoutingFacade.reachableWithin = spy
+        try:
+            RoutingFacade.findIsochrone ( -2.04, 52.01, 60, 
+                                          dataStore = DataStore.FileDataStore ( self.path ) )
+        finally:
+            RoutingFacade.reachableWithin = reachableWithin
+
+        self.failUnless ( pinned and all ( pinned ) )
+        self.failUnless ( not GR.pinCounts )
+
+    def testTileBorder (self):
+
+        '''
+        A road from a node near a tile's edge whose centroid is in the 
+        next tile is used
+        '''
+
+        def edge ( v, w, x1, x2, hrs ):
+            return GISEdge ( edgeID = v + '-' + w, sourceNode = v, targetNode = w,
+                             WKT = "LINESTRING(%s 52.5,%s 52.5)" %( x1, x2 ), 
+                             lengthKM = 1.0, edgeCost = hrs, 
+                             centroidWKT = "POINT(%s 52.5)" %( ( x1 + x2 ) / 2 ),
+                             isToll = False )
+
+        av = edge ( 'a', 'v', -1.9, -1.01, 0.5 )
+        vw = edge ( 'v', 'w', -1.01, -0.5, 0.3 )
+        G = { 'a': { 'v': av }, 'v': { 'a': av, 'w': vw }, 'w': { 'v': vw } }
+
+        _writeEdgeFile ( G, self.path )
+
+        result = json.loads ( RoutingFacade.findIsochrone ( -1.9, 52.5, 60, 
+                                  dataStore = DataStore.FileDataStore ( self.path ) ) )
+
+        self.failUnless ( result ['NUM_NODES'] == 3 )
+
+
+from algorithms import tollAndTollFreePaths
+
+class Test_TollComparison (_EdgeFileTestCase):
+
+    def makeGraph (self):
+
+        # row 0 is a fast toll road
+        G = _makeGridGraph ( 8, fastRow = 0, origin = (-2.0, 52.01) )
+        for v in G:
+            for w, e in G[v].iteritems ():
+                e.isToll = ( v.endswith ('.0') and w.endswith ('.0') )
+
+        return G
+
+    def testAvoidToll (self):
+
+        edgeList = shortestPath2 ( self.G, '0.0', '7.0', avoidToll = True )
+        self.failUnless ( len (edgeList) == 9 )
+        self.failUnless ( not [ e for e in edgeList if e.isToll ] )
+
+    def testSharedSearch (self):
+
+        '''
+        One pair of searches finds both routes, and settles fewer nodes 
+        than two
+        '''
+
+        for start, end in [ ('0.0', '7.0'), ('0.0', '7.7'), ('3.4', '3.4'), ('0.5', '7.1') ]:
+
+            stats     = {}
+            tollStats = {}
+            freeStats = {}
+
+            tollPath, freePath = tollAndTollFreePaths ( self.G, start, end, stats )
+
+            expected = shortestPath2 ( self.G, start, end, tollStats )
+            self.failUnless ( abs ( _pathCost (tollPath) - _pathCost (expected) ) < 1e-9 )
+
+            expected = shortestPath2 ( self.G, start, end, freeStats, avoidToll = True )
+            self.failUnless ( abs ( _pathCost (freePath) - _pathCost (expected) ) < 1e-9 )
+            self.failUnless ( not [ e for e in freePath if e.isToll ] )
+
+            self.failUnless ( stats ['settled'] <= tollStats ['settled'] + freeStats ['settled'] )
+
+        tollPath, freePath = tollAndTollFreePaths ( self.G, '0.0', '7.0', stats )
+        self.failUnless ( stats ['shared'] > 0 and stats ['settledTollFree'] < freeStats ['settled'] )
+
+        # every route from a node with only toll roads uses one
+        for e in self.G ['0.0'].values ():
+            e.isToll = True
+
+        tollPath, freePath = tollAndTollFreePaths ( self.G, '0.0', '7.7' )
+        self.failUnless ( tollPath and freePath is None )
+
+    def testCompare (self):
+
+        queryStats = Instrumentation.QueryStats ( 'toll' )
+
+        result = json.loads ( RoutingFacade.compareTollRoute ( -2.0, 52.01, -1.93, 52.01, 
+                                  dataStore = DataStore.FileDataStore ( self.path ),
+                                  queryStats = queryStats ) )
+
+        for phase in [ 'tileLoad', 'snap', 'search', 'unpack' ]:
+            self.failUnless ( phase in result ['STATS']['phaseSecs'] )
+        self.failUnless ( 'json' in queryStats.phases )
+        self.failUnless ( result ['STATS']['counters']['settled'] > 0 )
+
+        self.failUnless ( result ['TOLL']['TOLL_KM'] > 0 )
+        self.failUnless ( result ['TOLL_FREE']['TOLL_KM'] == 0 )
+        self.failUnless ( result ['HRS_SAVED'] > 0 )
+        self.failUnless ( abs ( result ['MINS_SAVED_PER_TOLL_KM'] - result ['HRS_SAVED'] * 60 / 
+                                result ['TOLL']['TOLL_KM'] ) < 1e-9 )
+
+    def testNoTollOnRoute (self):
+
+        '''
+        The toll free search is skipped when the fastest route has no toll
+        '''
+
+        result = json.loads ( RoutingFacade.compareTollRoute ( -2.0, 52.06, -1.93, 52.07, 
+                                  dataStore = DataStore.FileDataStore ( self.path ) ) )
+
+        self.failUnless ( result ['TOLL'] == result ['TOLL_FREE'] )
+        self.failUnless ( result ['HRS_SAVED'] == 0 )
+        self.failUnless ( result ['MINS_SAVED_PER_TOLL_KM'] is None )
+
+
+from algorithms import alternativeRoutes
+
+class Test_AlternativeRoutes (unittest.TestCase):
+
+    def _edge (self, a, b, cost):
+        return GISEdge ( edgeID = a + '-' + b, sourceNode = a, targetNode = b,
+                         WKT = None, lengthKM = cost, edgeCost = cost,
+                         centroidWKT = "POINT(0 0)", isToll = False )
+
+    def setUp(self):
+
+        # four separate ways from s to t, of cost 3.0, 3.3, 3.6 and 4.5
+        self.G = {}
+        for name, cost in [ ('a', 1.0), ('b', 1.1), ('c', 1.2), ('d', 1.5) ]:
+            path = [ 's', name + '1', name + '2', 't' ]
+            for i in range (3):
+                e = self._edge ( path[i], path[i+1], cost )
+                self.G.setdefault ( path[i],   {} ) [path[i+1]] = e
+                self.G.setdefault ( path[i+1], {} ) [path[i]]   = e
+
+    def testNoRoute (self):
+
+        e = self._edge ( 'x', 'y', 1.0 )
+        self.G ['x'] = { 'y': e }
+        self.G ['y'] = { 'x': e }
+
+        self.failUnlessRaises ( AppError, alternativeRoutes, self.G, 's', 'x' )
+
+    def testPlateaus (self):
+
+        routes = alternativeRoutes ( self.G, 's', 't', k = 5, stretch = 1.25 )
+
+        costs = [ _pathCost (r) for r in routes ]
+        self.failUnless ( len (routes) == 3 )
+        self.failUnless ( abs ( costs[0] - 3.0 ) < 1e-9 )
+        self.failUnless ( abs ( costs[1] - 3.3 ) < 1e-9 )
+        self.failUnless ( abs ( costs[2] - 3.6 ) < 1e-9 )
+
+        routes = alternativeRoutes ( self.G, 's', 't', k = 2 )
+        self.failUnless ( len (routes) == 2 )
+
+    def testGridRoutesAreValid (self):
+
+        G = _makeGridGraph ( 10, fastRow = 2 )
+
+        P, L, D = AStar ( G, '0.0', '9.9', heuristic = _ZeroHeuristic () )
+
+        routes = alternativeRoutes ( G, '0.0', '9.9', k = 3, stretch = 1.3 )
+
+        self.failUnless ( abs ( _pathCost ( routes[0] ) - D['9.9'] ) < 1e-9 )
+
+        for route in routes:
+            self.failUnless ( _pathCost ( route ) <= 1.3 * D['9.9'] + 1e-9 )
+            node = '0.0'
+            for e in route:
+                self.failUnless ( node in (e.sourceNode, e.targetNode) )
+                if node == e.sourceNode: node = e.targetNode
+                else:                    node = e.sourceNode
+            self.failUnless ( node == '9.9' )
+
+
+from DataStructures import IndexedHeap
+import benchmarks
+
+class Test_IndexedHeap (unittest.TestCase):
+
+    def testOrder (self):
+
+        import random
+        random.seed ( 7 )
+
+        Q = IndexedHeap ()
+        expected = {}
+
+        for i in range ( 500 ):
+            key = random.randint ( 0, 100 )
+            val = random.random ()
+            Q [key] = val
+            expected [key] = val
+
+        # remove some keys from the middle of the heap
+        for key in expected.keys ()[:10]:
+            del Q [key]
+            del expected [key]
+
+        self.failUnless ( len (Q) == len (expected) )
+        self.failUnless ( Q.get ( -1 ) is None )
+
+        popped = []
+        while Q:
+            key = Q.smallest ()
+            self.failUnless ( Q [key] == expected [key] )
+            popped.append ( expected [ Q.pop_smallest () ] )
+
+        self.failUnless ( popped == sorted ( expected.values () ) )
+
+    def testBenchmarkQueuesAgree (self):
+
+        G = _makeGridGraph ( 8 )
+
+        results = benchmarks.queueBenchmark ( G, [ '0.0', '3.4' ] )
+
+        self.failUnless ( results ['priority_dict'][1] == 128 )
+        self.failUnless ( results ['IndexedHeap'][1]   == 128 )
+
+
+import Instrumentation
+
+class Test_Instrumentation (_EdgeFileTestCase):
+
+    def makeGraph (self):
+        return _makeGridGraph ( 8, origin = (-2.0, 52.01) )
+
+    def testSearchCounters (self):
+
+        stats = {}
+        shortestPath2 ( self.G, '0.0', '7.7', stats )
+
+        self.failUnless ( stats ['heapPops'] == stats ['settled'] )
+        self.failUnless ( stats ['settled'] == stats ['settledForward'] + 
+                                               stats ['settledBackward'] )
+        self.failUnless ( stats ['heapPushes'] >= stats ['heapPops'] )
+
+    def testFindRouteStats (self):
+
+        queryStats = Instrumentation.QueryStats ()
+
+        result = json.loads ( RoutingFacade.findRoute ( -2.0, 52.01, -1.93, 52.08, 
+                                  dataStore = DataStore.FileDataStore ( self.path ),
+                                  queryStats = queryStats ) )
+
+        for phase in [ 'snap', 'tileLoad', 'search', 'unpack' ]:
+            self.failUnless ( phase in result ['STATS']['phaseSecs'] )
+        self.failUnless ( 'json' in queryStats.phases )
+
+        counters = result ['STATS']['counters']
+        self.failUnless ( counters ['tilesLoaded']  == 1 )
+        self.failUnless ( counters ['tilesTouched'] == 1 )
+        self.failUnless ( counters ['graphLookups'] >= counters ['settled'] )
+        self.failUnless ( result ['STATS']['engine'] == 'dijkstra' )
+
+    def testFacadeStats (self):
+
+        '''
+        Every request pins its tiles before snapping to them, and times 
+        its phases as findRoute does
+        '''
+
+        GR = RoutingFacade.GraphRepository.getGraphRepository ()
+        pinnedAtSnap = []
+
+        def spy ( graphRepositoryRef, dataStore, X, Y, queryStats = None ):
+            aTile = Locator.getTileFromCoords ( X, Y )
+            pinnedAtSnap.append ( aTile.getID () in GR.pinCounts )
+            return snapToRoad ( graphRepositoryRef, dataStore, X, Y, queryStats )
+
+        requests = [ lambda dataStore: RoutingFacade.compareTollRoute ( 
+                                           -2.0, 52.01, -1.93, 52.08, dataStore ),
+                     lambda dataStore: RoutingFacade.findAlternatives ( 
+                                           -2.0, 52.01, -1.93, 52.08, 2, dataStore ),
+                     lambda dataStore: RoutingFacade.findMatrix ( 
+                                           [ (-2.0, 52.01) ], [ (-1.93, 52.08) ], 'dijkstra', dataStore ),
+                     lambda dataStore: RoutingFacade.findIsochrone ( 
+                                           -2.0, 52.01, 5, False, dataStore ) ]
+
+        snapToRoad = RoutingFacade._snapToRoad
+        RoutingFacade._snapToRoad = spy
+        try:
+            for request in requests:
+                GR.clear ()
+                result = json.loads ( request ( DataStore.FileDataStore ( self.path ) ) )
+                for phase in [ 'tileLoad', 'snap', 'search', 'unpack' ]:
+                    self.failUnless ( phase in result ['STATS']['phaseSecs'] )
+                self.failUnless ( result ['STATS']['counters']['graphLookups'] > 0 )
+        finally:
+            RoutingFacade._snapToRoad = snapToRoad
+
+        self.failUnless ( len ( pinnedAtSnap ) == 7 and all ( pinnedAtSnap ) )
+        self.failUnless ( not GR.pinCounts )
+
+    def testAggregate (self):
+
+        aggregate = Instrumentation.StatsAggregate ( maxSamples = 50 )
+
+        for i in range ( 100 ):
+            queryStats = Instrumentation.QueryStats ( 'route' )
+            queryStats.count ( 'settled', 10 )
+            queryStats.addTime ( 'search', i / 100.0 )
+            aggregate.record ( queryStats )
+
+        summary = aggregate.summary () ['route']
+
+        self.failUnless ( summary ['queries'] == 100 )
+        self.failUnless ( summary ['counters']['settled'] == 1000 )
+        self.failUnless ( summary ['meanCounters']['settled'] == 10 )
+
+        # only the last 50 timings are kept
+        self.failUnless ( summary ['phaseSecs']['search']['p50'] == 0.75 )
+        self.failUnless ( summary ['phaseSecs']['search']['p99'] == 0.99 )
+
+
+import SyntheticNetwork
+import ContractionHierarchy as ContractionHierarchyModule
+import Landmarks as LandmarksModule
+
+class Test_SyntheticNetwork (unittest.TestCase):
+
+    def setUp(self):
+
+        fd, self.path = tempfile.mkstemp ()
+        os.close ( fd )
+
+        RoutingFacade.GraphRepository.getGraphRepository ().clear ()
+
+    def tearDown(self):
+
+        os.remove ( self.path )
+        RoutingFacade.GraphRepository.getGraphRepository ().clear ()
+        ContractionHierarchyModule.aContractionHierarchy = None
+        LandmarksModule.aLandmarkTable = None
+
+    def testGenerate (self):
+
+        numRoads = SyntheticNetwork.generateNetwork ( self.path, ['m-2.52', 'm-1.52'], 
+                                                      nodesPerTileSide = 20 )
+
+        # 41 x 21 nodes
+        self.failUnless ( numRoads == 40 * 21 + 41 * 20 )
+
+        dataStore = DataStore.FileDataStore ( self.path )
+        G1 = dataStore.loadEdgeGraphForTile ( Tile ( -2, 52 ) )
+        G2 = dataStore.loadEdgeGraphForTile ( Tile ( -1, 52 ) )
+
+        # the tiles meet along x = -1
+        self.failUnless ( set ( G1 ) & set ( G2 ) )
+        self.failUnless ( [ e for v in G1 for e in G1[v].itervalues () if e.isToll ] )
+
+        self.failUnless ( SyntheticNetwork.generateQueries ( ['m-2.52'], 5 ) == 
+                          SyntheticNetwork.generateQueries ( ['m-2.52'], 5 ) )
+
+    def testRoutingBenchmark (self):
+
+        SyntheticNetwork.generateNetwork ( self.path, ['m-2.52'], nodesPerTileSide = 12 )
+
+        queries = SyntheticNetwork.generateQueries ( ['m-2.52'], 3 )
+
+        result = benchmarks.routingBenchmark ( DataStore.FileDataStore ( self.path ), 
+                                               ['m-2.52'], queries )
+
+        self.failUnless ( sorted ( result ['engines'] ) == sorted ( RoutingFacade.ROUTING_ENGINES ) )
+        for engine, summary in result ['engines'].iteritems ():
+            self.failUnless ( summary ['queries'] == 3 )
+            self.failUnless ( summary ['failures'] == 0 )
+            self.failUnless ( summary ['phaseSecs']['total']['p99'] > 0 )
+
+        self.failUnless ( result ['peakRSSKB']['routed'] > 0 )
+        json.dumps ( result )
+
+
+class Test_StitchedAdjacency (unittest.TestCase):
+
+    def setUp(self):
+
+        # 'c' and 'a' are on the border of the two tiles
+        self.graph_1_1 =  {'a':{ 'b': 1, 'c': 1 }, 
+                           'b':{ 'a': 1 },
+                           'c':{ 'a': 1 }
+                          }
+
+        self.graph_2_2 =  {'c':{ 'a': 1, 'd': 1 }, 
+                           'd':{ 'c': 1 },
+                           'a':{ 'c': 1 }
+                          }
+
+        self.GR = GraphRepository ([])
+        self.GR [Tile (1, 1)] = self.graph_1_1
+        self.GR [Tile (2, 2)] = self.graph_2_2
+
+    def testAddTile (self):
+
+        adjacency = self.GR.adjacency
+
+        self.failUnless ( adjacency ['b'] is self.graph_1_1 ['b'] )
+        self.failUnless ( adjacency ['c'] == { 'a': 1, 'd': 1 } )
+        self.failUnless ( sorted ( self.GR.sharedNodes ) == [ 'a', 'c' ] )
+
+        CG = CompositeGraph ( self.GR )
+        self.failUnless ( CG ['d'] == { 'c': 1 } )
+        self.failUnless ( 'd' in CG and 'e' not in CG )
+        self.failUnless ( CG.lookups == 1 )
+
+    def testRemoveTile (self):
+
+        self.GR.pop ( Tile (2, 2) )
+
+        self.failUnless ( self.GR.adjacency == self.graph_1_1 )
+        self.failUnless ( self.GR.adjacency ['c'] is self.graph_1_1 ['c'] )
+        self.failUnless ( not self.GR.sharedNodes )
+
+        del self.GR [Tile (1, 1)]
+        self.failUnless ( not self.GR.adjacency )
+
+    def testTrimAndReplace (self):
+
+        self.GR [Tile (3, 3)] = { 'd': { 'e': 1 }, 'e': { 'd': 1 } }
+        self.failUnless ( self.GR.adjacency ['d'] == { 'c': 1, 'e': 1 } )
+
+        # replacing a tile replaces its nodes
+        self.GR [Tile (3, 3)] = { 'd': { 'f': 1 }, 'f': { 'd': 1 } }
+        self.failUnless ( self.GR.adjacency ['d'] == { 'c': 1, 'f': 1 } )
+        self.failUnless ( 'e' not in self.GR.adjacency )
+
+        self.GR [Tile (2, 2)]   # most used
+        self.GR.trim ( 1 )
+
+        self.failUnless ( self.GR.getKeys () == [ str ( Tile (2, 2) ) ] )
+        self.failUnless ( self.GR.adjacency == self.graph_2_2 )
+
+    def testCSRTiles (self):
+
+        G = _makeGridGraph ( 6 )
+        left  = dict ( [ (v, G[v]) for v in G if int ( v.split ('.')[0] ) <= 2 ] )
+        right = dict ( [ (v, dict ( [ (w, e) for w, e in G[v].iteritems () 
+                                       if int ( w.split ('.')[0] ) >= 2 ] ) )
+                         for v in G if int ( v.split ('.')[0] ) >= 2 ] )
+        for v in left:
+            left [v] = dict ( [ (w, e) for w, e in G[v].iteritems () 
+                                if int ( w.split ('.')[0] ) <= 2 ] )
+
+        GR = GraphRepository ([])
+        GR ['left']  = left
+        GR ['right'] = CSRGraph.fromGraph ( right )
+
+        CG = CompositeGraph ( GR )
+
+        # column 2 is in both tiles
+        self.failUnless ( sorted ( CG ['2.3'] ) == [ '1.3', '2.2', '2.4', '3.3' ] )
+        self.failUnless ( sorted ( CG ['4.3'] ) == [ '3.3', '4.2', '4.4', '5.3' ] )
+
+        edgeList = shortestPath2 ( CG, '0.0', '5.5' )
+        self.failUnless ( len ( edgeList ) == 10 )
+
+        GR.pop ( 'right' )
+        self.failUnless ( sorted ( CG ['2.3'] ) == [ '1.3', '2.2', '2.4' ] )
+        self.failUnless ( '4.3' not in CG )
+
+
+from DataStructures import TileGraphView
+
+class Test_TileGraphView (unittest.TestCase):
+
+    def setUp(self):
+
+        self.graph_1_1 =  {'a':{ 'b': 1, 'c': 1 }, 
+                           'b':{ 'a': 1 },
+                           'c':{ 'a': 1 }
+                          }
+
+        self.graph_2_2 =  {'c':{ 'a': 1, 'd': 1 }, 
+                           'd':{ 'c': 1 },
+                           'a':{ 'c': 1 }
+                          }
+
+        self.graph_3_3 =  {'e':{ 'f': 1 }, 
+                           'f':{ 'e': 1 }
+                          }
+
+        self.GR = GraphRepository ([])
+        self.GR [Tile (1, 1)] = self.graph_1_1
+        self.GR [Tile (2, 2)] = self.graph_2_2
+        self.GR [Tile (3, 3)] = self.graph_3_3
+
+    def testOnlyViewTiles (self):
+
+        view = TileGraphView ( self.GR, [ Tile (1, 1) ] )
+
+        self.failUnless ( view ['b'] == { 'a': 1 } )
+
+        # border nodes only have their neighbours in the view
+        self.failUnless ( view ['c'] == { 'a': 1 } )
+        self.failUnless ( 'c' in view )
+        self.failUnless ( 'd' not in view and 'e' not in view )
+        self.failUnlessRaises ( AppError, view.__getitem__, 'e' )
+
+        view = TileGraphView ( self.GR, [ Tile (1, 1), Tile (2, 2) ] )
+        self.failUnless ( view ['c'] == { 'a': 1, 'd': 1 } )
+
+    def testTilesRead (self):
+
+        self.GR [Tile (4, 4)] = CSRGraph.fromGraph ( _makeGridGraph ( 3 ) )
+
+        view = TileGraphView ( self.GR, [ Tile (1, 1), Tile (2, 2), Tile (3, 3), Tile (4, 4) ] )
+        self.failUnless ( view.tilesRead == set () )
+
+        view ['b']
+        self.failUnless ( view.tilesRead == set ( [ Tile (1, 1).getID () ] ) )
+
+        view ['c']
+        view ['0.0']
+        self.failUnless ( view.tilesRead == set ( [ Tile (1, 1).getID (), Tile (2, 2).getID (),
+                                                    Tile (4, 4).getID () ] ) )
+
+    def testRemovedTile (self):
+
+        # 'a' and 'c' are left in one tile, and are looked up by their tile
+        del self.GR [Tile (2, 2)]
+
+        view = TileGraphView ( self.GR, [ Tile (1, 1) ] )
+        self.failUnless ( view ['c'] == { 'a': 1 } )
+        self.failUnless ( view ['c'] is self.graph_1_1 ['c'] )
+
+        view = TileGraphView ( self.GR, [ Tile (2, 2), Tile (3, 3) ] )
+        self.failUnless ( 'a' not in view and 'd' not in view )
+        self.failUnlessRaises ( AppError, view.__getitem__, 'a' )
+        self.failUnless ( view ['e'] == { 'f': 1 } )
+
+    def testNoTileScan (self):
+
+        class CountingGraph (dict):
+            tests = 0
+            def __contains__ (self, key):
+                CountingGraph.tests += 1
+                return dict.__contains__ ( self, key )
+
+        GR = GraphRepository ([])
+        for x in range (20):
+            GR [Tile (x, 1)] = CountingGraph ( { 'n%d' %(x): { 'm%d' %(x): 1 }, 
+                                                 'm%d' %(x): { 'n%d' %(x): 1 } } )
+
+        view = TileGraphView ( GR, [ Tile (x, 1) for x in range (20) ] )
+        CountingGraph.tests = 0
+        for x in range (20):
+            self.failUnless ( view ['n%d' %(x)] == { 'm%d' %(x): 1 } )
+        self.failUnless ( CountingGraph.tests == 0 )
+
+    def testCorridor (self):
+
+        tiles = Locator.getTileCorridorSet ( -1.5, 52.5, -1.4, 52.6, 0.6 )
+        self.failUnless ( sorted ( [ t.getID () for t in tiles ] ) == 
+                          sorted ( [ Tile (x, y).getID () for x in (-3, -2, -1) 
+                                                          for y in (51, 52, 53) ] ) )
+
+        tiles = Locator.getTileCorridorSet ( -1.5, 52.5, -1.4, 52.6, 0 )
+        self.failUnless ( [ t.getID () for t in tiles ] == [ Tile (-2, 52).getID () ] )
+
+
+from DataStructures import CompactEdge, GeometryBlob
+
+class Test_CompactEdge (_EdgeFileTestCase):
+
+    def setUp(self):
+
+        _EdgeFileTestCase.setUp ( self )
+        self.dataStore = DataStore.FileDataStore ( self.path )
+
+    def testSameAsGISEdge (self):
+
+        G  = self.dataStore.loadEdgeGraphForTile ( Tile ( -2, 52 ) )
+        CG = self.dataStore.loadCompactGraphForTile ( Tile ( -2, 52 ) )
+
+        self.failUnless ( sorted ( G ) == sorted ( CG ) )
+
+        for v in G:
+            for w, e in G[v].iteritems ():
+                c = CG[v][w]
+                self.failUnless ( isinstance ( c, CompactEdge ) )
+                self.failUnless ( not hasattr ( c, '__dict__' ) )
+                for attr in [ 'edgeID', 'sourceNode', 'targetNode', 'WKT', 'lengthKM', 
+                              'isToll', 'CentroidX', 'CentroidY', 'originalCost' ]:
+                    self.failUnless ( getattr ( c, attr ) == getattr ( e, attr ) )
+                self.failUnless ( c.getCost () == e.getCost () )
+
+        path1 = shortestPath2 ( G,  '0.0', '5.5' )
+        path2 = shortestPath2 ( CG, '0.0', '5.5' )
+        self.failUnless ( [ e.edgeID for e in path1 ] == [ e.edgeID for e in path2 ] )
+        self.failUnless ( RoutingFacade._getResultDictFromNodesList ( path1 ) == 
+                          RoutingFacade._getResultDictFromNodesList ( path2 ) )
+
+    def testGeometryBlob (self):
+
+        blob = GeometryBlob ()
+        refs = [ blob.add ( wkt ) for wkt in [ 'LINESTRING(0 0,1 1)', '', 'LINESTRING(2 2,3 3)' ] ]
+        blob.close ()
+
+        self.failUnless ( [ blob.getWKT ( r ) for r in refs ] == 
+                          [ 'LINESTRING(0 0,1 1)', '', 'LINESTRING(2 2,3 3)' ] )
+
+    def testPickle (self):
+
+        import cPickle
+
+        CG = self.dataStore.loadCompactGraphForTile ( Tile ( -2, 52 ) )
+        edge = CG ['0.0']['1.0']
+
+        copy = cPickle.loads ( cPickle.dumps ( edge, cPickle.HIGHEST_PROTOCOL ) )
+        self.failUnless ( copy.WKT == edge.WKT and copy.getCost () == edge.getCost () )
+
+    def testSmaller (self):
+
+        sizes = benchmarks.edgeSizeBenchmark ( self.dataStore, Tile ( -2, 52 ) )
+        self.failUnless ( sizes ['CompactEdge'] < sizes ['GISEdge'] / 2 )
+
+
+from DataStructures import MappedGeometry
+import shutil
+
+class Test_MappedGeometry (_EdgeFileTestCase):
+
+    def setUp(self):
+
+        _EdgeFileTestCase.setUp ( self )
+        self.dir = tempfile.mkdtemp ()
+
+    def tearDown(self):
+        _EdgeFileTestCase.tearDown ( self )
+        shutil.rmtree ( self.dir )
+
+    def testWriteAndMap (self):
+
+        lstWKT = [ 'LINESTRING(0 0,1 1)', '', 'LINESTRING(2 2,3 3)' ]
+        filePath = os.path.join ( self.dir, 't.geom' )
+
+        geometry = MappedGeometry.openOrWrite ( filePath, lstWKT )
+        self.failUnless ( [ geometry.getWKT (i) for i in range (3) ] == lstWKT )
+
+        # unchanged geometry is not rewritten, changed geometry is
+        mtime = os.stat ( filePath ).st_mtime
+        MappedGeometry.openOrWrite ( filePath, lstWKT )
+        self.failUnless ( os.stat ( filePath ).st_mtime == mtime )
+
+        geometry = MappedGeometry.openOrWrite ( filePath, lstWKT [:2] )
+        self.failUnless ( geometry.numEdges == 2 )
+
+    def testLoadTile (self):
+
+        dataStore = DataStore.FileDataStore ( self.path )
+
+        G  = dataStore.loadEdgeGraphForTile ( Tile ( -2, 52 ) )
+        MG = dataStore.loadMappedGraphForTile ( Tile ( -2, 52 ), self.dir )
+
+        self.failUnless ( os.path.exists ( os.path.join ( self.dir, 'm-2.52.geom' ) ) )
+
+        for v in G:
+            for w, e in G[v].iteritems ():
+                self.failUnless ( MG[v][w].WKT == e.WKT )
+                self.failUnless ( MG[v][w].getCost () == e.getCost () )
+
+
+from GraphRepository import estimateGraphBytes
+import GraphRepository as GraphRepositoryModule
+import sys
+
+class Test_MemoryBudget (unittest.TestCase):
+
+    def setUp(self):
+
+        self.GR = GraphRepository ( [ 'm-2.52' ] )
+        self.GR [Tile (-2, 52)] = _makeGridGraph ( 4 )
+        self.GR [Tile (-1, 52)] = _makeGridGraph ( 10, origin = (-1, 52) )
+        self.GR [Tile (-3, 52)] = _makeGridGraph ( 10, origin = (-3, 52) )
+
+    def testEstimate (self):
+
+        small = estimateGraphBytes ( _makeGridGraph ( 4 ) )
+        large = estimateGraphBytes ( _makeGridGraph ( 10 ) )
+
+        self.failUnless ( 0 < small < large )
+        self.failUnless ( self.GR.totalBytes == sum ( self.GR.tileBytes.values () ) )
+
+        self.GR.pop ( 'm-1.52' )
+        self.failUnless ( sorted ( self.GR.tileBytes ) == [ 'm-2.52', 'm-3.52' ] )
+
+    def testEstimateGeometry (self):
+
+        '''
+        The estimate counts the edges' geometry
+        '''
+
+        estimates = []
+
+        for numPoints in ( 2, 50, 500 ):
+            G = _makeGridGraph ( 10 )
+            for v in G:
+                for e in G[v].itervalues ():
+                    e.WKT = 'LINESTRING(%s)' %( ','.join ( [ '%r %r' %( e.CentroidX + i * 1e-6, 
+                                                           e.CentroidY ) for i in range ( numPoints ) ] ) )
+            estimates.append ( estimateGraphBytes ( G ) )
+
+            wktBytes = sum ( [ sys.getsizeof ( e.WKT ) for v in G for e in G[v].itervalues () ] ) / 2
+            self.failUnless ( estimates [-1] > wktBytes )
+
+        self.failUnless ( estimates [0] < estimates [1] < estimates [2] )
+        self.failUnless ( self.GR.totalBytes == sum ( self.GR.tileBytes.values () ) )
+
+    def testEnforceBudget (self):
+
+        self.GR ['m-3.52']
+
+        # room for the pinned tile and one other
+        self.GR.setMemoryBudget ( self.GR.tileBytes ['m-2.52'] + self.GR.tileBytes ['m-3.52'] )
+        self.failUnless ( self.GR.overBudget () )
+
+        # the least used tile goes
+        self.failUnless ( self.GR.enforceBudget () )
+        self.failUnless ( sorted ( self.GR ) == [ 'm-2.52', 'm-3.52' ] )
+
+        # tiles to keep are not evicted, even when over budget
+        self.GR.setMemoryBudget ( 1 )
+        self.failUnless ( not self.GR.enforceBudget ( [ Tile (-3, 52) ] ) )
+        self.failUnless ( sorted ( self.GR ) == [ 'm-2.52', 'm-3.52' ] )
+
+        self.failUnless ( not self.GR.enforceBudget () )
+        self.failUnless ( self.GR.keys () == [ 'm-2.52' ] )
+
+    def testRSSLimit (self):
+
+        '''
+        Resident memory over the limit lowers the byte target by the 
+        overshoot, once, and does not put the repository over budget
+        '''
+
+        rss = [ 10 ** 9 ]
+        currentRSSBytes = GraphRepositoryModule.currentRSSBytes
+        GraphRepositoryModule.currentRSSBytes = lambda: rss [0]
+
+        try:
+            self.GR.setMemoryBudget ( None, 10 ** 9 )
+            self.failUnless ( self.GR.enforceBudget () and len (self.GR) == 3 )
+
+            # over by one of the large tiles: one goes
+            rss [0] = 10 ** 9 + self.GR.tileBytes ['m-1.52']
+            self.failUnless ( self.GR.enforceBudget () and len (self.GR) == 2 )
+
+            # the resident memory does not fall as tiles are freed
+            self.failUnless ( self.GR.enforceBudget () and len (self.GR) == 2 )
+            self.failUnless ( not self.GR.overBudget () )
+
+            # a new tile evicts one to stay within the lowered target
+            self.GR [Tile (-4, 52)] = _makeGridGraph ( 10, origin = (-4, 52) )
+            self.failUnless ( len (self.GR) == 2 and 'm-4.52' in self.GR )
+
+            # back under the limit the target is lifted
+            rss [0] = 10 ** 9
+            self.GR [Tile (-1, 52)] = _makeGridGraph ( 10, origin = (-1, 52) )
+            self.failUnless ( len (self.GR) == 3 )
+
+        finally:
+            GraphRepositoryModule.currentRSSBytes = currentRSSBytes
+
+
+from GraphRepository import LRUPolicy, ARCPolicy, GDSFPolicy, makeEvictionPolicy
+
+class Test_EvictionPolicy (unittest.TestCase):
+
+    def setUp(self):
+
+        # tiles of (nearly) the same size
+        self.graphs = dict ( [ ( 'm%s.52' %(x), _makeGridGraph ( 5, origin = (x, 52) ) ) \
+                               for x in range (1, 7) ] )
+        self.tileBytes = max ( [ estimateGraphBytes ( g ) for g in self.graphs.values () ] )
+
+    def _repository (self, policy, numTiles, lstImmutableTiles = []):
+
+        GR = GraphRepository ( lstImmutableTiles, policy )
+        GR.setMemoryBudget ( int ( self.tileBytes * ( numTiles + 0.5 ) ) )
+        return GR
+
+    def testLRU (self):
+
+        GR = self._repository ( LRUPolicy (), 3, [ 'm1.52' ] )
+
+        for tileID in [ 'm1.52', 'm2.52', 'm3.52' ]:
+            GR [tileID] = self.graphs [tileID]
+
+        self.failUnless ( GR.lookupTile ( 'm2.52' ) )
+        self.failUnless ( not GR.lookupTile ( 'm4.52' ) )
+
+        # evicted on insert: the least recently used, not the immutable tile
+        GR [ 'm4.52' ] = self.graphs [ 'm4.52' ]
+        self.failUnless ( sorted ( GR ) == [ 'm1.52', 'm2.52', 'm4.52' ] )
+
+        # pinned tiles stay
+        GR.pin ( [ 'm2.52' ] )
+        GR [ 'm5.52' ] = self.graphs [ 'm5.52' ]
+        self.failUnless ( sorted ( GR ) == [ 'm1.52', 'm2.52', 'm5.52' ] )
+        GR.unpin ( [ 'm2.52' ] )
+        self.failUnless ( not GR.pinCounts )
+
+        stats = GR.cacheStats ()
+        self.failUnless ( stats ['policy'] == 'lru' )
+        self.failUnless ( stats ['hits'] == 1 and stats ['misses'] == 1 )
+        self.failUnless ( stats ['hitRate'] == 0.5 )
+        self.failUnless ( stats ['evictions'] == 2 and stats ['evictedBytes'] > 0 )
+        self.failUnless ( stats ['totalBytes'] == GR.totalBytes )
+
+    def testARC (self):
+
+        GR = self._repository ( ARCPolicy (), 3 )
+
+        # a tile used repeatedly survives a scan over tiles used once
+        GR [ 'm1.52' ] = self.graphs [ 'm1.52' ]
+        GR.lookupTile ( 'm1.52' )
+
+        for tileID in [ 'm2.52', 'm3.52', 'm4.52', 'm5.52', 'm6.52' ]:
+            GR [tileID] = self.graphs [tileID]
+
+        self.failUnless ( 'm1.52' in GR )
+        self.failUnless ( len (GR) == 3 )
+
+        # a tile evicted too soon comes back as frequently used
+        GR [ 'm2.52' ] = self.graphs [ 'm2.52' ]
+        self.failUnless ( 'm2.52' in GR.policy.frequent )
+
+    def testGDSF (self):
+
+        GR = self._repository ( GDSFPolicy (), 2 )
+
+        # a slow tile outlives a quick one
+        GR.addTile ( 'm1.52', self.graphs [ 'm1.52' ], 5.0 )
+        GR.addTile ( 'm2.52', self.graphs [ 'm2.52' ], 0.1 )
+        GR.addTile ( 'm3.52', self.graphs [ 'm3.52' ], 1.0 )
+
+        self.failUnless ( sorted ( GR ) == [ 'm1.52', 'm3.52' ] )
+        self.failUnless ( GR.policy.inflation > 0 )
+
+    def testTrim (self):
+
+        for policy in [ LRUPolicy (), ARCPolicy (), GDSFPolicy () ]:
+
+            GR = GraphRepository ( [ 'm1.52' ], policy )
+            for tileID in [ 'm1.52', 'm2.52', 'm3.52' ]:
+                GR [tileID] = self.graphs [tileID]
+
+            GR.trim (1)
+            self.failUnless ( GR.keys () == [ 'm1.52' ] )
+
+    def testMakePolicy (self):
+
+        self.failUnless ( isinstance ( makeEvictionPolicy ( 'arc' ), ARCPolicy ) )
+
+        try:
+            makeEvictionPolicy ( 'fifo' )
+            self.fail ()
+        except AppError as ae:
+            self.failUnless ( ae.args[1] == 'GraphRepository' )
+
+
+import threading
+import time
+
+class Test_SingleFlightLoading (unittest.TestCase):
+
+    def setUp(self):
+
+        self.GR    = GraphRepository ( [] )
+        self.loads = []
+
+    def _slowLoad (self, graph, secs = 0.05):
+
+        def load ():
+            self.loads.append ( graph )
+            time.sleep ( secs )
+            return graph
+
+        return load
+
+    def _inThreads (self, numThreads, function):
+
+        results = [ None ] * numThreads
+
+        def run (i):
+            try:
+                results [i] = function ()
+            except AppError as ae:
+                results [i] = ae
+
+        threads = [ threading.Thread ( target = run, args = (i,) ) for i in range ( numThreads ) ]
+        for t in threads:
+            t.start ()
+        for t in threads:
+            t.join ()
+
+        return results
+
+    def testOneLoadPerTile (self):
+
+        graph = _makeGridGraph ( 3 )
+
+        results = self._inThreads ( 8, lambda: self.GR.loadTile ( Tile (-2, 52), 
+                                                                   self._slowLoad ( graph ) ) )
+
+        self.failUnless ( len ( self.loads ) == 1 )
+        self.failUnless ( len ( [ r for r in results if r is graph ] ) == 8 )
+        self.failUnless ( self.GR ['m-2.52'] is graph )
+        self.failUnless ( not self.GR.loading )
+
+        stats = self.GR.cacheStats ()
+        self.failUnless ( stats ['misses'] == 1 )
+        self.failUnless ( stats ['coalesced'] + stats ['hits'] == 7 )
+
+    def testFailedLoad (self):
+
+        def load ():
+            self.loads.append ( None )
+            time.sleep ( 0.05 )
+            raise AppError ( 'now', 'DataStore', 'no such tile', None )
+
+        results = self._inThreads ( 4, lambda: self.GR.loadTile ( 'm-2.52', load ) )
+
+        # every waiter is given the error; none of them loads again
+        self.failUnless ( len ( [ r for r in results if isinstance ( r, AppError ) ] ) == 4 )
+        self.failUnless ( len ( self.loads ) == 1 )
+        self.failUnless ( 'm-2.52' not in self.GR and not self.GR.loading )
+
+        # a later request tries again
+        graph = _makeGridGraph ( 3 )
+        self.failUnless ( self.GR.loadTile ( 'm-2.52', self._slowLoad ( graph, 0 ) ) is graph )
+
+    def testDifferentTilesLoadTogether (self):
+
+        graphs = [ _makeGridGraph ( 3, origin = (x, 52) ) for x in range (4) ]
+        nextTile = iter ( range (4) )
+
+        def loadNext ():
+            x = nextTile.next ()
+            return self.GR.loadTile ( 'm%s.52' %(x), self._slowLoad ( graphs [x], 0.1 ) )
+
+        startTime = time.time ()
+        self._inThreads ( 4, loadNext )
+
+        self.failUnless ( len (self.GR) == 4 )
+        self.failUnless ( time.time () - startTime < 0.3 )
+
+    def testPinned (self):
+
+        GR = GraphRepository ( [] )
+        GR [ 'm-1.52' ] = _makeGridGraph ( 3 )
+
+        with GR.pinned ( [ Tile (-1, 52) ] ):
+            GR.setMemoryBudget ( 1 )
+            self.failUnless ( not GR.enforceBudget () )
+
+        self.failUnless ( not GR.pinCounts )
+        self.failUnless ( GR.enforceBudget () and len (GR) == 0 )
+
+
+from FetchPool import FetchPool
+
+class _SlowDataStore (DataStore.FileDataStore):
+
+    '''
+    Helper: a FileDataStore that takes latency seconds to fetch each 
+    tile, as S3 would, and counts its fetches
+    '''
+
+    def __init__ (self, filePath, latency):
+        DataStore.FileDataStore.__init__ ( self, filePath )
+        self.latency = latency
+        self.fetches = []
+
+    def _getLineStream (self, thisTile):
+        self.fetches.append ( str ( thisTile ) )
+        time.sleep ( self.latency )
+        return DataStore.FileDataStore._getLineStream ( self, thisTile )
+
+
+class Test_ConcurrentFetch (unittest.TestCase):
+
+    def setUp(self):
+
+        fd, self.path = tempfile.mkstemp ()
+        os.close ( fd )
+
+        self.tileIDs = [ 'm-2.52', 'm-1.52', 'm-2.53', 'm-1.53' ]
+        SyntheticNetwork.generateNetwork ( self.path, self.tileIDs, nodesPerTileSide = 8 )
+
+        RoutingFacade.GraphRepository.getGraphRepository ().clear ()
+
+    def tearDown(self):
+
+        os.remove ( self.path )
+        RoutingFacade.GraphRepository.getGraphRepository ().clear ()
+
+    def testPool (self):
+
+        pool = FetchPool ( 2 )
+
+        self.failUnless ( pool.runAll ( [ lambda: 1, lambda: 2, lambda: 3 ] ) == [ 1, 2, 3 ] )
+        self.failUnless ( pool.runAll ( [] ) == [] )
+
+        def fail ():
+            raise AppError ( 'now', 'DataStore', 'no such tile', None )
+
+        self.failUnlessRaises ( AppError, pool.runAll, [ lambda: 1, fail ] )
+
+        # no more than 2 at once
+        startTime = time.time ()
+        pool.runAll ( [ lambda: time.sleep ( 0.1 ) ] * 4 )
+        self.failUnless ( time.time () - startTime >= 0.2 )
+
+        try:
+            pool.runAll ( [ lambda: time.sleep ( 0.2 ) ], timeoutSecs = 0.05 )
+            self.fail ()
+        except AppError as ae:
+            self.failUnless ( ae.args[1] == 'FetchPool' )
+
+    def testColdRouteFetchesInParallel (self):
+
+        dataStore = _SlowDataStore ( self.path, 0.2 )
+
+        startTime = time.time ()
+        result = json.loads ( RoutingFacade.findRoute ( -1.9, 52.1, -0.1, 53.9, 'dijkstra', 
+                                                        dataStore ) )
+
+        # one fetch per tile, overlapping
+        self.failUnless ( sorted ( dataStore.fetches ) == sorted ( self.tileIDs ) )
+        self.failUnless ( time.time () - startTime < 0.6 )
+        self.failUnless ( result ['STATS']['counters']['tilesLoaded'] == 4 )
+        self.failUnless ( result ['DIST_KM'] > 0 )
+
+    def testTimeout (self):
+
+        dataStore = _SlowDataStore ( self.path, 0.2 )
+        timeoutSecs = RoutingFacade.FETCH_TIMEOUT_SECS
+
+        RoutingFacade.FETCH_TIMEOUT_SECS = 0.05
+        try:
+            self.failUnlessRaises ( AppError, RoutingFacade.findRoute, 
+                                    -1.9, 52.1, -0.1, 53.9, 'dijkstra', dataStore )
+        finally:
+            RoutingFacade.FETCH_TIMEOUT_SECS = timeoutSecs
+
+        # the fetches carry on, and the next request uses them
+        time.sleep ( 0.4 )
+        RoutingFacade.findRoute ( -1.9, 52.1, -0.1, 53.9, 'dijkstra', dataStore )
+        self.failUnless ( len ( dataStore.fetches ) == 4 )
+
+
+from DataStructures import SharedCSRGraph
+import struct
+
+class Test_SharedCSRGraph (unittest.TestCase):
+
+    def setUp(self):
+
+        self.G   = _makeGridGraph ( 6, fastRow = 2 )
+        self.dir = tempfile.mkdtemp ()
+
+        self.filePath = os.path.join ( self.dir, 't.csr' )
+        SharedCSRGraph.write ( self.filePath, CSRGraph.fromGraph ( self.G ) )
+        self.SG = SharedCSRGraph ( self.filePath )
+
+    def tearDown(self):
+        shutil.rmtree ( self.dir )
+
+    def testMappingProtocol (self):
+
+        self.failUnless ( len (self.SG) == len (self.G) )
+        self.failUnless ( sorted ( self.SG.keys () ) == sorted ( self.G.keys () ) )
+        self.failUnless ( '0.0' in self.SG and 'x' not in self.SG )
+        self.failUnlessRaises ( KeyError, self.SG.__getitem__, 'x' )
+
+        for v in self.G:
+            row = self.SG [v]
+            self.failUnless ( sorted (row) == sorted (self.G[v]) )
+            for w, edge in row.iteritems ():
+                original = self.G[v][w]
+                self.failUnless ( edge.getCost ()  == original.getCost () )
+                self.failUnless ( edge.sourceNode  == original.sourceNode )
+                self.failUnless ( edge.WKT         == original.WKT )
+                self.failUnless ( edge.CentroidY   == original.CentroidY )
+                self.failUnless ( edge.isToll      == original.isToll )
+
+        edge = Locator.closestEdgeInGraph ( -2, 52, self.SG )
+        self.failUnless ( edge.edgeID in ( '0.0-1.0', '0.0-0.1' ) )
+
+        # all in the mapped file, not the heap
+        self.failUnless ( estimateGraphBytes ( self.SG ) < 2000 )
+
+    def testRouting (self):
+
+        GR = GraphRepository ([])
+        GR [ Tile (-2, 52) ] = self.SG
+
+        edgeList = shortestPath2 ( TileGraphView ( GR, [ Tile (-2, 52) ] ), '0.0', '5.4' )
+        expected = shortestPath2 ( self.G, '0.0', '5.4' )
+
+        self.failUnless ( abs ( _pathCost (edgeList) - _pathCost (expected) ) < 1e-9 )
+
+    def testBadFile (self):
+
+        self.failUnless ( SharedCSRGraph.openFile ( os.path.join ( self.dir, 'none.csr' ) ) is None )
+
+        fs = open ( self.filePath, 'r+b' )
+        fs.seek ( 4 )
+        fs.write ( struct.pack ( '<H', SharedCSRGraph.VERSION + 1 ) )
+        fs.close ()
+
+        self.failUnless ( SharedCSRGraph.openFile ( self.filePath ) is None )
+
+    def testLoadOnce (self):
+
+        fd, path = tempfile.mkstemp ()
+        os.close ( fd )
+        _writeEdgeFile ( self.G, path )
+
+        try:
+            # another process would find the file written by the first
+            for n in range (2):
+                dataStore = _SlowDataStore ( path, 0 )
+                SG = dataStore.loadSharedGraphForTile ( Tile (-2, 52), self.dir )
+                self.failUnless ( sorted ( SG.keys () ) == sorted ( self.G.keys () ) )
+                self.failUnless ( dataStore.fetches == [ [ 'm-2.52' ], [] ] [n] )
+        finally:
+            os.remove ( path )
+
+    def testRebuiltWhenChanged (self):
+
+        '''
+        The shared file of a tile is built again when the tile changes
+        '''
+
+        fd, path = tempfile.mkstemp ()
+        os.close ( fd )
+        _writeEdgeFile ( self.G, path )
+
+        try:
+            SG = _SlowDataStore ( path, 0 ).loadSharedGraphForTile ( Tile (-2, 52), self.dir )
+            self.failUnless ( '5.5' in SG and '6.6' not in SG )
+
+            # a new road in the tile
+            edge = GISEdge ( edgeID = '5.5-6.6', sourceNode = '5.5', targetNode = '6.6',
+                             WKT = "LINESTRING(-1.95 52.05,-1.94 52.06)", lengthKM = 1.0,
+                             edgeCost = 0.1, centroidWKT = "POINT(-1.945 52.055)" )
+            self.G ['5.5']['6.6'] = edge
+            self.G ['6.6'] = { '5.5': edge }
+            _writeEdgeFile ( self.G, path )
+
+            dataStore = _SlowDataStore ( path, 0 )
+            SG = dataStore.loadSharedGraphForTile ( Tile (-2, 52), self.dir )
+            self.failUnless ( '6.6' in SG and dataStore.fetches == [ 'm-2.52' ] )
+        finally:
+            os.remove ( path )
+
+
+import TileCompiler
+
+class Test_CompiledTiles (unittest.TestCase):
+
+    def setUp(self):
+
+        self.G   = _makeGridGraph ( 6, fastRow = 2 )
+        self.dir = tempfile.mkdtemp ()
+
+        self.edgeFile = os.path.join ( self.dir, 'edges.txt' )
+        _writeEdgeFile ( self.G, self.edgeFile )
+
+        self.textStore = DataStore.FileDataStore ( self.edgeFile )
+        self.tileDir   = os.path.join ( self.dir, 'compiled' )
+        TileCompiler.compileTiles ( self.textStore, [ 'm-2.52' ], self.tileDir )
+
+        self.compiledStore = DataStore.CompiledFileDataStore ( self.tileDir )
+
+    def tearDown(self):
+        shutil.rmtree ( self.dir )
+
+    def testRoundTrip (self):
+
+        for name in [ 'loadEdgeGraphForTile', 'loadCompactGraphForTile', 
+                      'loadCSRGraphForTile' ]:
+
+            expected = getattr ( self.textStore, name ) ( Tile (-2, 52) )
+            graph    = getattr ( self.compiledStore, name ) ( Tile (-2, 52) )
+
+            self.failUnless ( sorted ( graph.keys () ) == sorted ( expected.keys () ) )
+
+            for v in expected.keys ():
+                self.failUnless ( sorted ( graph[v] ) == sorted ( expected[v] ) )
+                for w, edge in expected[v].items ():
+                    compiled = graph[v][w]
+                    self.failUnless ( compiled.getCost () == edge.getCost () )
+                    self.failUnless ( compiled.edgeID     == edge.edgeID )
+                    self.failUnless ( compiled.WKT        == edge.WKT )
+                    self.failUnless ( compiled.lengthKM   == edge.lengthKM )
+                    self.failUnless ( compiled.CentroidX  == edge.CentroidX )
+                    self.failUnless ( compiled.isToll     == edge.isToll )
+
+        # one edge for both directions, as from text
+        graph = self.compiledStore.loadEdgeGraphForTile ( Tile (-2, 52) )
+        self.failUnless ( graph ['0.0']['1.0'] is graph ['1.0']['0.0'] )
+
+    def testRouting (self):
+
+        GR = GraphRepository ([])
+        GR [ Tile (-2, 52) ] = self.compiledStore.loadCompactGraphForTile ( Tile (-2, 52) )
+
+        edgeList = shortestPath2 ( TileGraphView ( GR, [ Tile (-2, 52) ] ), '0.0', '5.4' )
+        expected = shortestPath2 ( self.G, '0.0', '5.4' )
+
+        self.failUnless ( abs ( _pathCost (edgeList) - _pathCost (expected) ) < 1e-9 )
+
+    def testSharedFromCompiled (self):
+
+        sharedDir = os.path.join ( self.dir, 'shared' )
+        SG = self.compiledStore.loadSharedGraphForTile ( Tile (-2, 52), sharedDir )
+
+        self.failUnless ( sorted ( SG.keys () ) == sorted ( self.G.keys () ) )
+
+        # the compiled file, marked with the compiled file's version
+        compiledPath = os.path.join ( self.tileDir, 'm-2.52.csr' )
+        self.failUnless ( SG.sourceCRC == self.compiledStore._getSourceCRC ( Tile (-2, 52) ) )
+        self.failUnless ( SG.data [:] == SharedCSRGraph.withSourceCRC ( 
+                                             open ( compiledPath, 'rb' ).read (), SG.sourceCRC ) )
+
+        # compiled again: the shared file is replaced
+        TileCompiler.compileTiles ( self.textStore, [ 'm-2.52' ], self.tileDir )
+        os.utime ( compiledPath, ( 0, 0 ) )
+
+        SG2 = self.compiledStore.loadSharedGraphForTile ( Tile (-2, 52), sharedDir )
+        self.failUnless ( SG2.sourceCRC != SG.sourceCRC )
+        self.failUnless ( SG2.sourceCRC == self.compiledStore._getSourceCRC ( Tile (-2, 52) ) )
+
+    def testBadTile (self):
+
+        self.failUnlessRaises ( AppError, self.compiledStore.loadCSRGraphForTile, Tile (-3, 52) )
+
+        fs = open ( os.path.join ( self.tileDir, 'm-2.52.csr' ), 'r+b' )
+        fs.seek ( 4 )
+        fs.write ( struct.pack ( '<H', SharedCSRGraph.VERSION + 1 ) )
+        fs.close ()
+
+        self.failUnlessRaises ( AppError, self.compiledStore.loadCSRGraphForTile, Tile (-2, 52) )
+
+    def testTileIDsInFile (self):
+
+        self.failUnless ( TileCompiler.tileIDsInFile ( self.edgeFile ) == [ 'm-2.52' ] )
+
+    def testLoadBenchmark (self):
+
+        result = benchmarks.tileLoadBenchmark ( self.textStore, self.compiledStore, 
+                                                Tile (-2, 52) )
+
+        self.failUnless ( sorted ( result ) == [ 'compiled', 'text' ] )
+        self.failUnless ( result ['compiled'] >= 0 and result ['text'] >= 0 )
+
+
+class _FakeS3Key (object):
+
+    '''
+    Helper: a boto Key over a string, iterated in blocks of blockSize
+    '''
+
+    def __init__ (self, data, blockSize = 8192):
+        self.data      = data
+        self.blockSize = blockSize
+        self.closed    = False
+        self.etag      = '"%s"' %( hashlib.md5 ( data ).hexdigest () )
+
+    def __iter__ (self):
+        for i in xrange ( 0, len ( self.data ), self.blockSize ):
+            yield self.data [ i : i + self.blockSize ]
+
+    def get_contents_as_string (self):
+        return self.data
+
+    def close (self):
+        self.closed = True
+
+
+class _FakeS3Connection (object):
+
+    '''
+    Helper: an S3Connection with one bucket of { key name: string }
+    '''
+
+    def __init__ (self, keys, blockSize = 8192):
+        self.keys      = keys
+        self.blockSize = blockSize
+        self.gets      = []
+
+    def get_bucket (self, name):
+        return self
+
+    def get_key (self, name):
+        self.gets.append ( name )
+        if name not in self.keys:
+            return None
+        return _FakeS3Key ( self.keys [name], self.blockSize )
+
+    def close (self):
+        pass
+
+
+class _FakeS3DataStore (DataStore.AWS_S3DataStore):
+
+    '''
+    Helper: an AWS_S3DataStore on a _FakeS3Connection, counting the 
+    connections
+    '''
+
+    def __init__ (self, conn):
+        DataStore.AWS_S3DataStore.__init__ ( self )
+        self.conn        = conn
+        self.connections = 0
+
+    def _getS3Connection (self):
+        self.connections += 1
+        return self.conn
+
+
+class _FakeS3CompiledDataStore (DataStore.AWS_S3CompiledDataStore, _FakeS3DataStore):
+
+    '''
+    Helper: an AWS_S3CompiledDataStore on a _FakeS3Connection
+    '''
+
+    pass
+
+
+class Test_StreamingIngest (unittest.TestCase):
+
+    def setUp(self):
+
+        self.G = _makeGridGraph ( 6, fastRow = 2 )
+
+        fd, self.path = tempfile.mkstemp ()
+        os.close ( fd )
+        _writeEdgeFile ( self.G, self.path )
+
+        self.fileStore = DataStore.FileDataStore ( self.path )
+        self.body      = open ( self.path ).read ()
+
+    def tearDown(self):
+        os.remove ( self.path )
+
+    def testIterLines (self):
+
+        chunks = [ 'ab\ncd', 'e\n\nf', 'g', '\nh' ]
+        self.failUnless ( list ( DataStore._iterLines ( chunks ) ) == [ 'ab', 'cde', 'fg', 'h' ] )
+        self.failUnless ( list ( DataStore._iterLines ( [] ) ) == [] )
+
+    def testS3Stream (self):
+
+        # blocks smaller than a line, so that lines span blocks
+        conn  = _FakeS3Connection ( { 'm-2.52': self.body }, blockSize = 37 )
+        store = _FakeS3DataStore ( conn )
+
+        lines = store._getStringList ( Tile (-2, 52) )
+        self.failUnless ( lines == [ aLine.rstrip ('\n') for aLine in 
+                                     self.fileStore._getStringList ( Tile (-2, 52) ) ] )
+
+        for name in [ 'loadEdgeGraphForTile', 'loadCompactGraphForTile', 
+                      'loadCSRGraphForTile' ]:
+
+            expected = getattr ( self.fileStore, name ) ( Tile (-2, 52) )
+            graph    = getattr ( store, name ) ( Tile (-2, 52) )
+
+            self.failUnless ( sorted ( graph.keys () ) == sorted ( expected.keys () ) )
+            for v in expected.keys ():
+                for w, edge in expected[v].items ():
+                    self.failUnless ( graph[v][w].edgeID    == edge.edgeID )
+                    self.failUnless ( graph[v][w].getCost () == edge.getCost () )
+                    self.failUnless ( graph[v][w].WKT       == edge.WKT )
+                    self.failUnless ( graph[v][w].CentroidY == edge.CentroidY )
+                    self.failUnless ( graph[v][w].isToll    == edge.isToll )
+
+        self.failUnlessRaises ( AppError, store.loadEdgeGraphForTile, Tile (-3, 52) )
+
+    def testRowEdge (self):
+
+        aLine = self.body.split ('\n') [0]
+        cols  = aLine.split ('|')
+
+        edge     = self.fileStore._createEdgeFromLine ( aLine )
+        original = GISEdge ( cols[0] + '-' + cols[1], cols[0], cols[1], cols[7], 
+                             cols[4], float ( cols[2] ), cols[8], cols[6] == 't' )
+
+        for attr in [ 'edgeID', 'sourceNode', 'targetNode', 'WKT', 'lengthKM', 
+                      'edgeCost', 'originalCost', 'CentroidX', 'CentroidY', 'isToll' ]:
+            self.failUnless ( getattr ( edge, attr ) == getattr ( original, attr ) )
+
+
+class _IndexCountingDataStore (DataStore.FileDataStore):
+
+    '''
+    Helper: a FileDataStore that counts the times it indexes the file,
+    and the passes through it (with the number of ranges read by each)
+    '''
+
+    builds = 0
+
+    def __init__ (self, filePath, hasHeader = False, indexPath = None):
+        DataStore.FileDataStore.__init__ ( self, filePath, hasHeader, indexPath )
+        self.passes = []
+
+    def _buildIndex (self, fileStat):
+        _IndexCountingDataStore.builds += 1
+        return DataStore.FileDataStore._buildIndex ( self, fileStat )
+
+    def _readRanges (self, ranges):
+        self.passes.append ( len ( ranges ) )
+        return DataStore.FileDataStore._readRanges ( self, ranges )
+
+
+class Test_FileDataStoreIndex (unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir  = tempfile.mkdtemp ()
+        self.path = os.path.join ( self.dir, 'edges.txt' )
+
+        # two tiles, their lines shuffled together
+        lines = []
+        for origin in [ (-2, 52), (-1, 52) ]:
+            tilePath = os.path.join ( self.dir, 'tile.txt' )
+            _writeEdgeFile ( _makeGridGraph ( 4, origin = origin ), tilePath )
+            lines.extend ( open ( tilePath ).read ().splitlines () )
+
+        random.Random (1).shuffle ( lines )
+        fs = open ( self.path, 'w' )
+        fs.write ( 'header\n' + '\n'.join ( lines ) + '\n' )
+        fs.close ()
+
+        self.lines = lines
+        DataStore.FileDataStore._indexes.clear ()
+        _IndexCountingDataStore.builds = 0
+
+    def tearDown(self):
+        shutil.rmtree ( self.dir )
+        DataStore.FileDataStore._indexes.clear ()
+
+    def _expected (self, aTile):
+
+        # the lines in aTile, by their centroid
+        return [ aLine for aLine in self.lines
+                 if Tile ( *[ int ( math.floor ( float (c) ) ) for c in 
+                     aLine.split ('|') [8][6:-1].split (' ') ] ) == aTile ]
+
+    def testLoads (self):
+
+        dataStore = DataStore.FileDataStore ( self.path, hasHeader = True )
+
+        self.failUnless ( dataStore.getTileIDs () == [ 'm-1.52', 'm-2.52' ] )
+
+        for aTile in [ Tile (-2, 52), Tile (-1, 52) ]:
+            self.failUnless ( dataStore._getStringList ( aTile ) == self._expected ( aTile ) )
+
+        self.failUnless ( dataStore._getStringList ( Tile (5, 5) ) == [] )
+
+        # shuffled, so each tile is several ranges
+        self.failUnless ( len ( dataStore.getIndex () ['tiles']['m-2.52'] ) > 1 )
+
+        tiles = dataStore.readTiles ( [ Tile (-1, 52), Tile (-2, 52), Tile (5, 5) ] )
+        self.failUnless ( tiles ['m-2.52'] == self._expected ( Tile (-2, 52) ) )
+        self.failUnless ( tiles ['m-1.52'] == self._expected ( Tile (-1, 52) ) )
+        self.failUnless ( tiles ['5.5'] == [] )
+
+    def testLoadTileSet (self):
+
+        '''
+        The missing tiles of a query are read in one pass
+        '''
+
+        dataStore = _IndexCountingDataStore ( self.path, hasHeader = True )
+        GR = GraphRepository ( [] )
+
+        self.failUnless ( RoutingFacade._loadTileSet ( GR, dataStore, [ Tile (-2, 52), Tile (-1, 52) ] ) )
+
+        numRanges = sum ( [ len ( dataStore.getIndex () ['tiles'][tileID] ) 
+                            for tileID in [ 'm-2.52', 'm-1.52' ] ] )
+        self.failUnless ( dataStore.passes == [ numRanges ] )
+
+        for aTile in [ Tile (-2, 52), Tile (-1, 52) ]:
+            self.failUnless ( sorted ( GR [aTile].keys () ) == 
+                              sorted ( dataStore.loadEdgeGraphForTile ( aTile ).keys () ) )
+
+    def testIndexOnce (self):
+
+        for n in range (3):
+            dataStore = _IndexCountingDataStore ( self.path, hasHeader = True )
+            for aTile in [ Tile (-2, 52), Tile (-1, 52) ]:
+                dataStore.loadEdgeGraphForTile ( aTile )
+
+        self.failUnless ( _IndexCountingDataStore.builds == 1 )
+
+        # a changed file is indexed again
+        fs = open ( self.path, 'a' )
+        fs.write ( self.lines [0] + '\n' )
+        fs.close ()
+
+        dataStore._getStringList ( Tile (-2, 52) )
+        self.failUnless ( _IndexCountingDataStore.builds == 2 )
+
+    def testSavedIndex (self):
+
+        indexPath = os.path.join ( self.dir, 'edges.idx' )
+
+        _IndexCountingDataStore ( self.path, True, indexPath ).getTileIDs ()
+        self.failUnless ( os.path.exists ( indexPath ) )
+
+        # as in another process
+        DataStore.FileDataStore._indexes.clear ()
+        dataStore = _IndexCountingDataStore ( self.path, True, indexPath )
+
+        self.failUnless ( dataStore._getStringList ( Tile (-1, 52) ) == self._expected ( Tile (-1, 52) ) )
+        self.failUnless ( _IndexCountingDataStore.builds == 1 )
+
+    def testSortedByTile (self):
+
+        sortedPath = os.path.join ( self.dir, 'sorted.txt' )
+        DataStore.FileDataStore ( self.path, hasHeader = True ).writeSortedByTile ( sortedPath )
+
+        dataStore = DataStore.FileDataStore ( sortedPath )
+        tiles = dataStore.getIndex () ['tiles']
+
+        self.failUnless ( sorted ( tiles ) == [ 'm-1.52', 'm-2.52' ] )
+        for tileID in tiles:
+            aTile = Locator.getTileFromID ( tileID )
+            self.failUnless ( len ( tiles [tileID] ) == 1 )
+            self.failUnless ( sorted ( dataStore._getStringList ( aTile ) ) == 
+                              sorted ( self._expected ( aTile ) ) )
+
+
+class _MemoryDataStore (DataStore.GenericDataStore):
+
+    '''
+    Helper: tiles as strings in memory, { tileID: (text, version) }, 
+    counting the fetches and version checks
+    '''
+
+    def __init__ (self, tiles):
+        self.tiles    = tiles
+        self.fetches  = []
+        self.versions = 0
+
+    def _getStringList (self, thisTile):
+        self.fetches.append ( str ( thisTile ) )
+        return self.tiles [ thisTile.getID () ][0].splitlines ()
+
+    def _getTileVersion (self, thisTile):
+        self.versions += 1
+        return self.tiles [ thisTile.getID () ][1]
+
+
+class _MemoryCompiledDataStore (DataStore.CompiledDataStore):
+
+    '''
+    Helper: compiled tiles in memory, { tileID: bytes }
+    '''
+
+    def __init__ (self, tiles):
+        self.tiles   = tiles
+        self.fetches = []
+
+    def _getCompiledBytes (self, thisTile):
+        self.fetches.append ( str ( thisTile ) )
+        return self.tiles [ thisTile.getID () ]
+
+
+class Test_CachingDataStore (unittest.TestCase):
+
+    def setUp(self):
+
+        self.G   = _makeGridGraph ( 6, fastRow = 2 )
+        self.dir = tempfile.mkdtemp ()
+
+        path = os.path.join ( self.dir, 'edges.txt' )
+        _writeEdgeFile ( self.G, path )
+        self.text = open ( path ).read ()
+
+        self.source   = _MemoryDataStore ( { 'm-2.52': ( self.text, 'v1' ) } )
+        self.cacheDir = os.path.join ( self.dir, 'cache' )
+
+    def tearDown(self):
+        shutil.rmtree ( self.dir )
+
+    def _caching (self, revalidateSecs = 300, maxBytes = 10 ** 8):
+        return DataStore.makeCachingDataStore ( self.source, self.cacheDir, maxBytes, 
+                                                revalidateSecs )
+
+    def testReadThrough (self):
+
+        expected = self.source.loadEdgeGraphForTile ( Tile (-2, 52) )
+        self.source.fetches = []
+
+        # the second store is as another process, or a restart
+        for dataStore in [ self._caching (), self._caching () ]:
+            for n in range (2):
+                graph = dataStore.loadEdgeGraphForTile ( Tile (-2, 52) )
+                self.failUnless ( sorted ( graph ) == sorted ( expected ) )
+                self.failUnless ( graph ['0.0']['1.0'].WKT == expected ['0.0']['1.0'].WKT )
+
+        self.failUnless ( self.source.fetches == [ 'm-2.52' ] )
+        # a version when it was stored, none since
+        self.failUnless ( self.source.versions == 1 )
+
+        stats = dataStore.cacheStats ()
+        self.failUnless ( stats ['hits'] == 2 and stats ['misses'] == 0 )
+        self.failUnless ( stats ['totalBytes'] == len ( self.text ) )
+
+    def testNewVersion (self):
+
+        dataStore = self._caching ( revalidateSecs = 0 )
+
+        dataStore.loadEdgeGraphForTile ( Tile (-2, 52) )
+        dataStore.loadEdgeGraphForTile ( Tile (-2, 52) )
+        self.failUnless ( self.source.fetches == [ 'm-2.52' ] )
+
+        # one road fewer
+        text = '\n'.join ( self.text.splitlines () [1:] )
+        self.source.tiles ['m-2.52'] = ( text, 'v2' )
+
+        graph = dataStore.loadCSRGraphForTile ( Tile (-2, 52) )
+        self.failUnless ( self.source.fetches == [ 'm-2.52', 'm-2.52' ] )
+        self.failUnless ( len ( graph.WKT ) == len ( text.splitlines () ) )
+        self.failUnless ( dataStore.cacheStats () ['stale'] == 1 )
+
+    def testUnreachableSource (self):
+
+        dataStore = self._caching ( revalidateSecs = 0 )
+        dataStore.loadEdgeGraphForTile ( Tile (-2, 52) )
+
+        def unreachable (thisTile):
+            raise AppError ( 'now', 'test', 'no network', None )
+        self.source._getTileVersion = unreachable
+
+        graph = dataStore.loadEdgeGraphForTile ( Tile (-2, 52) )
+        self.failUnless ( sorted ( graph ) == sorted ( self.G ) )
+        self.failUnless ( self.source.fetches == [ 'm-2.52' ] )
+
+    def testSharedFile (self):
+
+        '''
+        A current shared file is used without asking the source
+        '''
+
+        sharedDir = os.path.join ( self.dir, 'shared' )
+
+        self._caching ().loadSharedGraphForTile ( Tile (-2, 52), sharedDir )
+        versions = self.source.versions
+
+        SG = self._caching ().loadSharedGraphForTile ( Tile (-2, 52), sharedDir )
+        self.failUnless ( sorted ( SG.keys () ) == sorted ( self.G.keys () ) )
+        self.failUnless ( self.source.versions == versions )
+        self.failUnless ( self.source.fetches == [ 'm-2.52' ] )
+
+        # once the cached version is due to be checked, the source is asked
+        self._caching ( revalidateSecs = 0 ).loadSharedGraphForTile ( Tile (-2, 52), sharedDir )
+        self.failUnless ( self.source.versions > versions )
+        self.failUnless ( self.source.fetches == [ 'm-2.52' ] )
+
+    def testEviction (self):
+
+        tileIDs = [ 'm-2.52', 'm-2.53', 'm-2.54' ]
+        for tileID in tileIDs:
+            self.source.tiles [tileID] = ( self.text, 'v1' )
+
+        # room for two tiles
+        dataStore = self._caching ( maxBytes = 2 * len ( self.text ) + 10 )
+
+        for tileID in tileIDs:
+            dataStore._getStringList ( Locator.getTileFromID ( tileID ) )
+            time.sleep ( 0.01 )
+
+        cached = sorted ( [ name for used, nbytes, name in dataStore.cache.entries () ] )
+        self.failUnless ( cached == [ 'm-2.53.txt', 'm-2.54.txt' ] )
+        self.failUnless ( dataStore.cacheStats () ['evictions'] == 1 )
+        self.failUnless ( not os.path.exists ( os.path.join ( self.cacheDir, 'm-2.52.txt.meta' ) ) )
+
+        dataStore._getStringList ( Tile (-2, 52) )
+        self.failUnless ( self.source.fetches == tileIDs + [ 'm-2.52' ] )
+
+    def testFailedFetch (self):
+
+        dataStore = self._caching ()
+        self.failUnlessRaises ( AppError, dataStore.loadEdgeGraphForTile, Tile (5, 5) )
+        self.failUnless ( dataStore.cache.entries () == [] )
+
+    def testCompiled (self):
+
+        data   = SharedCSRGraph.pack ( CSRGraph.fromGraph ( self.G ) )
+        source = _MemoryCompiledDataStore ( { 'm-2.52': data } )
+
+        dataStore = DataStore.makeCachingDataStore ( source, self.cacheDir )
+        self.failUnless ( isinstance ( dataStore, DataStore.CachingCompiledDataStore ) )
+
+        for n in range (2):
+            graph = dataStore.loadCompactGraphForTile ( Tile (-2, 52) )
+            self.failUnless ( sorted ( graph ) == sorted ( self.G ) )
+
+        self.failUnless ( source.fetches == [ 'm-2.52' ] )
+        self.failUnless ( open ( os.path.join ( self.cacheDir, 'm-2.52.csr' ), 'rb' ).read () == data )
+
+    def testS3 (self):
+
+        conn   = _FakeS3Connection ( { 'm-2.52': self.text } )
+        source = _FakeS3DataStore ( conn )
+
+        dataStore = DataStore.makeCachingDataStore ( source, self.cacheDir )
+
+        for n in range (3):
+            graph = dataStore.loadEdgeGraphForTile ( Tile (-2, 52) )
+            self.failUnless ( sorted ( graph ) == sorted ( self.G ) )
+
+        # the body, with its ETag, once
+        self.failUnless ( conn.gets == [ 'm-2.52' ] )
+        self.failUnless ( json.load ( open ( os.path.join ( self.cacheDir, 'm-2.52.txt.meta' ) ) ) \
+                          ['version'] == _FakeS3Key ( self.text ).etag )
+
+    def testS3Warm (self):
+
+        '''
+        A tile in the cache is loaded, in any form, without a request to S3
+        '''
+
+        conn   = _FakeS3Connection ( { 'm-2.52': self.text } )
+        source = _FakeS3DataStore ( conn )
+        sharedDir = os.path.join ( self.dir, 'shared' )
+
+        DataStore.makeCachingDataStore ( source, self.cacheDir ).loadSharedGraphForTile ( 
+                                                                Tile (-2, 52), sharedDir )
+        conn.gets = []
+        source.connections = 0
+
+        # as another process
+        dataStore = DataStore.makeCachingDataStore ( source, self.cacheDir )
+        dataStore.loadEdgeGraphForTile ( Tile (-2, 52) )
+        dataStore.loadCSRGraphForTile ( Tile (-2, 52) )
+        SG = dataStore.loadSharedGraphForTile ( Tile (-2, 52), sharedDir )
+
+        self.failUnless ( sorted ( SG.keys () ) == sorted ( self.G.keys () ) )
+        self.failUnless ( conn.gets == [] and source.connections == 0 )
+
+    def testS3Compiled (self):
+
+        data   = SharedCSRGraph.pack ( CSRGraph.fromGraph ( self.G ) )
+        conn   = _FakeS3Connection ( { 'm-2.52.csr': data } )
+        source = _FakeS3CompiledDataStore ( conn )
+
+        for n in range (2):
+            graph = DataStore.makeCachingDataStore ( source, self.cacheDir ) \
+                                .loadCompactGraphForTile ( Tile (-2, 52) )
+            self.failUnless ( sorted ( graph ) == sorted ( self.G ) )
+
+        self.failUnless ( conn.gets == [ 'm-2.52.csr' ] )
+        self.failUnless ( json.load ( open ( os.path.join ( self.cacheDir, 'm-2.52.csr.meta' ) ) ) \
+                          ['version'] == _FakeS3Key ( data ).etag )
+
+
 if __name__ == "__main__":
 
     import unittest
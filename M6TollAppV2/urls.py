@@ -11,6 +11,11 @@ urlpatterns = patterns('',
     ( r'^geocode/(?P<txtLocation>.+)/$', M6TollAppV2.views.geocode),
     ( r'^route/(?P<fromX>.+)/(?P<fromY>.+)/(?P<toX>.+)/(?P<toY>.+)/$', M6TollAppV2.views.getRoute),
     ( r'^route2/(\d+)/(\d+)/(\d+)/(\d+)/$', M6TollAppV2.views.getRoute),
+    ( r'^compare/(?P<fromX>.+)/(?P<fromY>.+)/(?P<toX>.+)/(?P<toY>.+)/$', M6TollAppV2.views.compareToll),
+    ( r'^alternatives/(?P<fromX>.+)/(?P<fromY>.+)/(?P<toX>.+)/(?P<toY>.+)/$', M6TollAppV2.views.getAlternatives),
+    ( r'^matrix/$', M6TollAppV2.views.getMatrix),
+    ( r'^stats/$', M6TollAppV2.views.getStats),
+    ( r'^isochrone/(?P<X>.+)/(?P<Y>.+)/(?P<minutes>.+)/$', M6TollAppV2.views.getIsochrone),
 )
 
 
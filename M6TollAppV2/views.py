@@ -3,6 +3,7 @@ from django.shortcuts import render_to_response
 
 import settings
 import RoutingFacade
+import Instrumentation
 
 
 def loadData ():
@@ -28,9 +29,94 @@ def getRoute (request, fromX, fromY, toX, toY ):
 
     print "in get route : %s, %s " %(fromX, toX)
 
-    JSON_Result  =  RoutingFacade.findRoute (fromX, fromY, toX, toY )
+    engine = request.GET.get ( 'engine', 'dijkstra' )
+
+    JSON_Result  =  RoutingFacade.findRoute (fromX, fromY, toX, toY, engine )
     return HttpResponse (JSON_Result)
 
+def _parsePoints (txtPoints):
+
+    '''
+    "x1,y1;x2,y2;..." -> [ (x1, y1), (x2, y2), ... ] of floats.  Http404 if
+    any point is not two numbers.
+    '''
+
+    points = []
+
+    for txtPoint in txtPoints.split (';'):
+
+        if not txtPoint:
+            continue
+
+        coords = txtPoint.split (',')
+        if len ( coords ) != 2:
+            raise Http404
+
+        try:
+            points.append ( ( float ( coords [0] ), float ( coords [1] ) ) )
+        except ValueError:
+            raise Http404
+
+    return points
+
+def compareToll (request, fromX, fromY, toX, toY ):
+
+    JSON_Result  =  RoutingFacade.compareTollRoute (fromX, fromY, toX, toY )
+    return HttpResponse (JSON_Result)
+
+def getAlternatives (request, fromX, fromY, toX, toY ):
+
+    k = request.GET.get ( 'k', '3' )
+
+    JSON_Result  =  RoutingFacade.findAlternatives (fromX, fromY, toX, toY, k )
+    return HttpResponse (JSON_Result)
+
+def getMatrix (request):
+
+    '''
+    GET params: origins=x1,y1;x2,y2  destinations=x3,y3;x4,y4  (engine=...)
+    '''
+
+    origins      = _parsePoints ( request.GET.get ( 'origins', '' ) )
+    destinations = _parsePoints ( request.GET.get ( 'destinations', '' ) )
+    engine       = request.GET.get ( 'engine', 'dijkstra' )
+
+    if not origins or not destinations or engine not in RoutingFacade.MATRIX_ENGINES:
+        raise Http404
+
+    JSON_Result  =  RoutingFacade.findMatrix ( origins, destinations, engine )
+    return HttpResponse (JSON_Result)
+
+def getIsochrone (request, X, Y, minutes ):
+
+    '''
+    GET param avoidToll=1 to keep off the toll roads
+    '''
+
+    avoidToll = request.GET.get ( 'avoidToll', '0' ) not in ( '0', '' )
+
+    JSON_Result  =  RoutingFacade.findIsochrone ( X, Y, minutes, avoidToll )
+    return HttpResponse (JSON_Result)
+
+def getStats (request):
+
+    '''
+    Aggregate query statistics, and the tile caches' (in memory and on 
+    disk) hits, misses and evictions, if env TOLL_QUERY_STATS is '1'
+    '''
+
+    if not Instrumentation.AGGREGATE_ENABLED:
+        raise Http404
+
+    result = Instrumentation.getAggregate ().summary ()
+    result ['tileCache'] = RoutingFacade.GraphRepository.getGraphRepository ().cacheStats ()
+
+    dataStore = RoutingFacade.getDefaultDataStore ()
+    if hasattr ( dataStore, 'cacheStats' ):
+        result ['tileDiskCache'] = dataStore.cacheStats ()
+
+    return HttpResponse ( json.dumps ( result ) )
+
 import Geocoder 
 import json
 